@@ -0,0 +1,144 @@
+"""
+DynamoDB calls per request for each USER_DATA_LAYOUT
+
+Logs users in through the real callback and syncs their libraries with
+each layout ("tables", "dual", "single"), then replays a returning login,
+a library sync, a POST /batch of library stats and sync status, and the
+user + connections read one at a time, counting the DynamoDB calls of
+each by operation. Read caches are emptied before every request, so the
+counts are those of a container that has not seen the user yet.
+
+Usage:
+    python benchmarks/bench_layout.py
+    python benchmarks/bench_layout.py --layouts tables single --requests 20
+    python benchmarks/bench_layout.py --json layout.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("AWS_REGION", "eu-central-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("SPOTIFY_RATE_LIMITER", "local")
+os.environ.setdefault("REQUEST_RATE_LIMITER", "off")
+os.environ.setdefault("SPOTIFY_REDIRECT_URI", "http://localhost/callback")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.bench_sync import configure_spotify  # noqa: E402
+from benchmarks.fake_spotify import FakeSpotify, generate_library  # noqa: E402
+from benchmarks.harness import CallCounter, local_aws, make_event  # noqa: E402
+from benchmarks.load_test import _handlers, build_event, seed_users  # noqa: E402
+
+LAYOUTS = ["tables", "dual", "single"]
+SCENARIOS = ["login", "sync", "batch", "user_and_connections"]
+READ_OPERATIONS = frozenset({"GetItem", "BatchGetItem", "Query", "Scan"})
+
+
+def _requests(handlers, user):
+    """One request of every scenario for a user, as zero-argument callables."""
+    from shared import db
+
+    batch_event = make_event(
+        "POST",
+        "/batch",
+        user_id=user["userId"],
+        body={"operations": [{"op": "library.stats"}, {"op": "sync.status"}]},
+    )
+    return {
+        "login": lambda: handlers["callback"](build_event("callback", user, 1), None),
+        "sync": lambda: handlers["fetch_library"](build_event("fetch_library", user, 1), None),
+        "batch": lambda: handlers["batch"](batch_event, None),
+        "user_and_connections": lambda: db.get_user_and_connections(user["userId"]),
+    }
+
+
+def run_layout(layout, users, requests, tracks):
+    """
+    Returns:
+        Dict of scenario -> {"calls": {operation: per request}, "reads",
+        "writes", "total"}
+    """
+    from service.batch import lambda_handler as batch_handler
+    from shared import db, library_sync, token_manager
+
+    handlers = {**_handlers(), "batch": batch_handler}
+    previous = (db.USER_DATA_LAYOUT, library_sync.SYNC_DEBOUNCE_SECONDS)
+    with local_aws(), FakeSpotify(
+        generate_library(tracks, seed=1), users_by_code=True
+    ) as spotify:
+        configure_spotify(spotify, 1_000_000)
+        db.USER_DATA_LAYOUT = layout
+        library_sync.SYNC_DEBOUNCE_SECONDS = 0
+        counter = None
+        try:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                seeded = seed_users(users, handlers)
+                counter = CallCounter(db.dynamodb.meta.client)
+                results = {}
+                for scenario in SCENARIOS:
+                    calls = Counter()
+                    for i in range(requests):
+                        request = _requests(handlers, seeded[i % len(seeded)])[scenario]
+                        db.clear_read_caches()
+                        token_manager._token_cache.clear()
+                        counter.reset()
+                        request()
+                        calls.update(counter.calls)
+                    per_request = {
+                        operation: round(count / requests, 2)
+                        for operation, count in sorted(calls.items())
+                    }
+                    reads = sum(v for k, v in per_request.items() if k in READ_OPERATIONS)
+                    total = sum(per_request.values())
+                    results[scenario] = {
+                        "calls": per_request,
+                        "reads": round(reads, 2),
+                        "writes": round(total - reads, 2),
+                        "total": round(total, 2),
+                    }
+                return results
+        finally:
+            db.USER_DATA_LAYOUT, library_sync.SYNC_DEBOUNCE_SECONDS = previous
+            if counter:
+                counter.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=LAYOUTS)
+    parser.add_argument("--requests", type=int, default=10, help="Requests per scenario")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--tracks", type=int, default=100, help="Library size of every user")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {
+        layout: run_layout(layout, args.users, args.requests, args.tracks)
+        for layout in args.layouts
+    }
+    for scenario in SCENARIOS:
+        print(f"{scenario}:")
+        for layout, by_scenario in results.items():
+            result = by_scenario[scenario]
+            calls = ", ".join(f"{count} {operation}" for operation, count in result["calls"].items())
+            print(
+                f"  {layout:>6}: {result['reads']} reads, {result['writes']} writes "
+                f"per request ({calls})"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
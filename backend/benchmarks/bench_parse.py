@@ -0,0 +1,94 @@
+"""
+Microbenchmark: per-track parse_track path vs page-level parse_tracks_page
+
+Both paths start from raw /me/tracks pages and end with the DynamoDB items
+save_tracks writes, so the comparison covers parsing and item building.
+
+Usage:
+    python benchmarks/bench_parse.py
+    python benchmarks/bench_parse.py --tracks 100000 --repeat 3
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AWS_REGION", "eu-central-1")
+
+from benchmarks.fake_spotify import generate_library  # noqa: E402
+from shared.spotify_utils import parse_track, parse_tracks_page  # noqa: E402
+from shared.track_batch import TrackBatch  # noqa: E402
+
+PAGE_SIZE = 50
+
+
+def pages_of(library):
+    """Fresh page dicts, as each sync would decode them from JSON."""
+    return [
+        [{"added_at": item["added_at"], "track": dict(item["track"])} for item in library[i : i + PAGE_SIZE]]
+        for i in range(0, len(library), PAGE_SIZE)
+    ]
+
+
+def per_track_path(pages):
+    tracks = []
+    for items in pages:
+        for item in items:
+            track = item.get("track")
+            if track:
+                track["added_at"] = item.get("added_at", "")
+                tracks.append(track)
+    parsed = [t for t in (parse_track(track) for track in tracks) if t]
+    return TrackBatch.from_tracks(parsed), parsed
+
+
+def page_path(pages):
+    batch = TrackBatch()
+    for items in pages:
+        parse_tracks_page(items, batch)
+    return batch, None
+
+
+def measure(path, library, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        pages = pages_of(library)
+        start = time.perf_counter()
+        batch, _ = path(pages)
+        batch.to_items("bench-user")
+        best = min(best, time.perf_counter() - start)
+
+    # Memory retained by the parsed result while the sync holds it
+    pages = pages_of(library)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = path(pages)
+    del pages
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return best, retained
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tracks", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    library = generate_library(args.tracks)
+    per_track_time, per_track_mem = measure(per_track_path, library, args.repeat)
+    page_time, page_mem = measure(page_path, library, args.repeat)
+
+    print(f"{args.tracks} tracks, best of {args.repeat}")
+    print(f"  per-track: {per_track_time * 1000:8.1f} ms, {per_track_mem / 2**20:6.2f} MB retained")
+    print(f"  page:      {page_time * 1000:8.1f} ms, {page_mem / 2**20:6.2f} MB retained")
+    print(f"  speedup {per_track_time / page_time:.2f}x, memory {per_track_mem / max(page_mem, 1):.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
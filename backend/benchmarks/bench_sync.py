@@ -0,0 +1,316 @@
+"""
+Sync throughput benchmark
+
+Runs the real fetch_library and library handlers against the local Spotify
+stand-in and in-memory DynamoDB and S3 for synthetic libraries of several
+sizes, then compares the results to benchmarks/baseline.json.
+
+Usage:
+    python benchmarks/bench_sync.py                       # run and check
+    python benchmarks/bench_sync.py --sizes 100 100000    # custom sizes
+    python benchmarks/bench_sync.py --save-baseline       # record new baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("AWS_REGION", "eu-central-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("SPOTIFY_RATE_LIMITER", "local")
+os.environ.setdefault("REQUEST_RATE_LIMITER", "off")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.fake_spotify import FakeSpotify, generate_library  # noqa: E402
+from benchmarks.harness import CallCounter, local_aws, make_event  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = [100, 1000, 10000]
+BENCH_USER_ID = "bench-user"
+
+# Allowed ratio to the baseline before a metric counts as a regression.
+# Timings get generous headroom for machine noise, call counts none.
+DEFAULT_THRESHOLDS = {
+    "syncSeconds": 1.5,
+    "peakMemoryMb": 1.25,
+    "pageLatencyMs.p95": 1.5,
+    "httpCalls": 1.0,
+    "dbCalls": 1.0,
+}
+# Differences below these absolute amounts are never reported
+ABSOLUTE_SLACK = {
+    "syncSeconds": 0.25,
+    "peakMemoryMb": 2.0,
+    "pageLatencyMs.p95": 5.0,
+    "httpCalls": 0,
+    "dbCalls": 0,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def invoke(handler, event):
+    """Call a handler, returning its response and the EMF record it emitted."""
+    out = io.StringIO()
+    with redirect_stdout(out):
+        response = handler(event, None)
+    records = [json.loads(line) for line in out.getvalue().splitlines() if line.startswith("{")]
+    return response, (records[-1] if records else {})
+
+
+def configure_spotify(spotify, rate_limit):
+    from shared import spotify_client, spotify_utils
+    from shared.spotify_client import LocalTokenBucket
+
+    spotify_utils.SPOTIFY_API_BASE = spotify.api_base
+    spotify_utils.SPOTIFY_TOKEN_URL = spotify.token_url
+    spotify_client.SPOTIFY_BACKOFF_BASE = 0.01
+    spotify_client.set_rate_limiter(LocalTokenBucket(rate_limit, rate_limit))
+    spotify_client.stats.reset()
+
+
+def seed_connection(user_id):
+    from shared import db, token_manager
+
+    token_manager._token_cache.clear()
+    db.users_table.put_item(
+        Item={"userId": user_id, "email": f"{user_id}@example.com", "displayName": user_id}
+    )
+    db.save_platform_connection(
+        user_id,
+        "spotify",
+        {
+            "access_token": "fake-access-token",
+            "refresh_token": "fake-refresh-token",
+            "expires_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat(),
+        },
+        None,
+    )
+
+
+def measure_pages(library_handler, user_id, max_pages, page_size):
+    latencies = []
+    last_key = None
+    for _ in range(max_pages):
+        query = {"limit": str(page_size)}
+        if last_key:
+            query["lastKey"] = json.dumps(last_key)
+        event = make_event("GET", "/library", user_id=user_id, query=query)
+        start = time.perf_counter()
+        response, _ = invoke(library_handler, event)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response["statusCode"] != 200:
+            raise RuntimeError(f"GET /library failed: {response['body']}")
+        last_key = json.loads(response["body"])["lastKey"]
+        if not last_key:
+            break
+    return latencies
+
+
+def measure_snapshot(library_handler, user_id):
+    """One-shot library load: snapshot URL request plus the object download."""
+    from shared import library_snapshot
+
+    start = time.perf_counter()
+    response, _ = invoke(library_handler, make_event("GET", "/library/snapshot", user_id=user_id))
+    if response["statusCode"] != 200:
+        raise RuntimeError(f"GET /library/snapshot failed: {response['body']}")
+    snapshot = library_snapshot.get_library_snapshot(user_id)
+    body = library_snapshot._get_s3_client().get_object(
+        Bucket=library_snapshot.SNAPSHOT_BUCKET, Key=snapshot["key"]
+    )["Body"].read()
+    tracks = len(library_snapshot.decode_snapshot(body)["items"])
+    return (time.perf_counter() - start) * 1000, len(body), tracks
+
+
+def run_size(size, args):
+    from shared import db, library_sync
+    from service.library import lambda_handler as library_handler
+    from service.spotify.fetch_library import lambda_handler as fetch_library_handler
+
+    library = generate_library(size, seed=size)
+    with local_aws(), FakeSpotify(
+        library,
+        latency_ms=args.latency_ms,
+        throttle_every=args.throttle_every,
+        error_rate=args.error_rate,
+    ) as spotify:
+        configure_spotify(spotify, args.rate_limit)
+        seed_connection(BENCH_USER_ID)
+        debounce_seconds = library_sync.SYNC_DEBOUNCE_SECONDS
+        counter = CallCounter(db.dynamodb.meta.client)
+        try:
+            event = make_event(
+                "POST",
+                "/library/sync/spotify",
+                user_id=BENCH_USER_ID,
+                path_params={"platform": "spotify"},
+            )
+            tracemalloc.start()
+            start = time.perf_counter()
+            response, metrics = invoke(fetch_library_handler, event)
+            sync_seconds = time.perf_counter() - start
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            body = json.loads(response["body"])
+            if response["statusCode"] != 200 or body.get("synced") != size:
+                raise RuntimeError(f"Sync of {size} tracks failed: {body}")
+            sync_db_calls = dict(counter.calls)
+            http_calls = dict(spotify.requests)
+            throttled, server_errors = spotify.throttled, spotify.errors
+
+            counter.reset()
+            latencies = measure_pages(library_handler, BENCH_USER_ID, args.pages, args.page_size)
+            # The first request builds the snapshot, later ones only sign a URL
+            build_ms, _, _ = measure_snapshot(library_handler, BENCH_USER_ID)
+            snapshot_ms, snapshot_bytes, snapshot_tracks = measure_snapshot(
+                library_handler, BENCH_USER_ID
+            )
+            if snapshot_tracks != size:
+                raise RuntimeError(f"Snapshot holds {snapshot_tracks} of {size} tracks")
+
+            # Steady state: nothing changed on Spotify since the last sync.
+            # Debouncing would hand back the first sync's result instead.
+            library_sync.SYNC_DEBOUNCE_SECONDS = 0
+            counter.reset()
+            start = time.perf_counter()
+            invoke(fetch_library_handler, event)
+            resync_seconds = time.perf_counter() - start
+            resync_db_calls = dict(counter.calls)
+        finally:
+            library_sync.SYNC_DEBOUNCE_SECONDS = debounce_seconds
+            counter.close()
+
+    return {
+        "tracks": size,
+        "syncSeconds": round(sync_seconds, 3),
+        "tracksPerSecond": round(size / sync_seconds, 1),
+        "peakMemoryMb": round(peak_bytes / 2**20, 2),
+        "httpCalls": sum(http_calls.values()),
+        "httpCallsByPath": http_calls,
+        "throttled": throttled,
+        "serverErrors": server_errors,
+        "dbCalls": sum(sync_db_calls.values()),
+        "dbCallsByOperation": sync_db_calls,
+        "consumedWCU": metrics.get("ConsumedWCU"),
+        "consumedRCU": metrics.get("ConsumedRCU"),
+        "pages": len(latencies),
+        "pageLatencyMs": {
+            "p50": round(statistics.median(latencies), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "max": round(max(latencies), 2),
+        },
+        "resyncSeconds": round(resync_seconds, 3),
+        "resyncDbCallsByOperation": resync_db_calls,
+        "snapshotBuildMs": round(build_ms, 2),
+        "snapshotLoadMs": round(snapshot_ms, 2),
+        "snapshotKb": round(snapshot_bytes / 1024, 1),
+    }
+
+
+def metric_value(result, name):
+    value = result
+    for part in name.split("."):
+        value = value[part]
+    return value
+
+
+def compare(results, baseline):
+    """
+    Returns:
+        List of human-readable regression descriptions (empty if none)
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    regressions = []
+    for size, result in results.items():
+        expected = baseline.get("results", {}).get(size)
+        if not expected:
+            continue
+        for name, ratio in thresholds.items():
+            current = metric_value(result, name)
+            reference = metric_value(expected, name)
+            limit = max(reference * ratio, reference + ABSOLUTE_SLACK.get(name, 0))
+            if current > limit:
+                regressions.append(
+                    f"{size} tracks: {name} {current} exceeds baseline {reference} (limit {limit:.2f})"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--throttle-every", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=1_000_000)
+    parser.add_argument("--pages", type=int, default=20, help="GET /library pages to time")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        result = run_size(size, args)
+        results[str(size)] = result
+        print(
+            f"{size:>7} tracks: sync {result['syncSeconds']:.2f}s "
+            f"({result['tracksPerSecond']:.0f} tracks/s), peak {result['peakMemoryMb']} MB, "
+            f"{result['httpCalls']} HTTP / {result['dbCalls']} DB calls, "
+            f"page p50 {result['pageLatencyMs']['p50']} ms p95 {result['pageLatencyMs']['p95']} ms, "
+            f"snapshot {result['snapshotLoadMs']} ms ({result['snapshotKb']} KB), "
+            f"unchanged resync {result['resyncSeconds']:.2f}s"
+        )
+
+    scenario = {
+        "latencyMs": args.latency_ms,
+        "throttleEvery": args.throttle_every,
+        "errorRate": args.error_rate,
+        "pageSize": args.page_size,
+    }
+
+    if args.save_baseline:
+        baseline = {"scenario": scenario, "thresholds": DEFAULT_THRESHOLDS, "results": results}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found, run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("scenario") != scenario:
+        print("Scenario differs from the baseline, skipping regression check")
+        return 0
+
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not regressions:
+        print("No regressions against baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+In-process second streaming service for multi-provider syncs.
+
+Serves a synthetic library page by page with configurable per-request
+latency, behind its own rate limit, so tests and benchmarks can sync a
+user connected to Spotify and another service.
+"""
+
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from shared.providers import LibraryProvider
+from shared.spotify_client import LocalTokenBucket
+
+
+def generate_fake_library(track_count):
+    """Synthetic saved tracks in the fake service's own format."""
+    return [
+        {
+            "id": f"fm{i:010d}",
+            "title": f"Fake Track {i}",
+            "artist": f"Fake Artist {i // 24}",
+            "album": {"id": f"fmalbum{i // 8:08d}", "name": f"Fake Album {i // 8}"},
+            "savedAt": "2024-01-01T00:00:00+00:00",
+            "durationMs": 180_000,
+        }
+        for i in range(track_count)
+    ]
+
+
+class FakeProvider(LibraryProvider):
+    name = "fakemusic"
+    display_name = "Fake Music"
+
+    def __init__(
+        self,
+        track_count=100,
+        latency_ms=0,
+        page_size=50,
+        pool_size=4,
+        rate=1_000,
+        fail=False,
+    ):
+        self.library = generate_fake_library(track_count)
+        self.latency = latency_ms / 1000
+        self.page_size = page_size
+        self.pool_size = pool_size
+        self.limiter = LocalTokenBucket(rate, capacity=max(1, int(rate)))
+        self.fail = fail
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def _request(self, endpoint):
+        self.limiter.acquire()
+        with self._lock:
+            self.requests[endpoint] += 1
+        time.sleep(self.latency)
+        if self.fail:
+            raise ConnectionError("Fake Music is down")
+
+    def refresh_tokens(self, refresh_token):
+        self._request("token")
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+        return {"access_token": f"fake-{refresh_token}", "expires_at": expires_at.isoformat()}, None
+
+    def fetch_page(self, access_token, offset, limit):
+        self._request("tracks")
+        items = self.library[offset : offset + limit]
+        return items, len(self.library), offset + limit < len(self.library)
+
+    def parse_page(self, items, batch):
+        columns = batch.columns
+        for item in items:
+            if "id" not in item:
+                batch.malformed += 1
+                continue
+            columns["trackId"].append(f"{self.name}:{item['id']}")
+            columns["trackName"].append(item.get("title", "Unknown"))
+            columns["artistName"].append(item.get("artist", ""))
+            columns["albumName"].append(item["album"]["name"])
+            columns["platform"].append(self.name)
+            columns["platformTrackId"].append(item["id"])
+            columns["platformAlbumId"].append(item["album"]["id"])
+            columns["platformArtistId"].append(None)
+            columns["coverArt"].append(None)
+            columns["addedDate"].append(item["savedAt"])
+            columns["duration"].append(item.get("durationMs"))
+            columns["releaseYear"].append(None)
+            columns["isManual"].append(False)
+            columns["audioFeatures"].append(None)
+            columns["coverArtUrl"].append(None)
+        return batch
@@ -0,0 +1,296 @@
+"""
+Local stand-in for the Spotify accounts and Web APIs.
+
+Serves paged /v1/me/tracks from a synthetic library, /v1/audio-features,
+/v1/me, /api/token and album images under /image over real HTTP on
+127.0.0.1, with configurable latency, 429 throttling and 5xx errors.
+"""
+
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MAX_PAGE_SIZE = 50
+MAX_AUDIO_FEATURES_IDS = 100
+
+
+def generate_library(track_count, seed=0):
+    """
+    Generate a synthetic saved-tracks library
+
+    Artists and albums repeat the way they do in real libraries (roughly
+    8 tracks per album, 3 albums per artist) so string reuse is realistic.
+
+    Returns:
+        List of /me/tracks items ({"added_at", "track"})
+    """
+    rng = random.Random(seed)
+    album_count = max(1, track_count // 8)
+    artist_count = max(1, album_count // 3)
+    artists = [
+        {"id": f"artist{i:07d}", "name": f"Artist {i}"} for i in range(artist_count)
+    ]
+    albums = []
+    for i in range(album_count):
+        image_id = f"{i:040x}"
+        albums.append(
+            {
+                "id": f"album{i:08d}",
+                "name": f"Album {i}",
+                "release_date": f"{1970 + i % 55}-01-01",
+                "images": [
+                    {
+                        "url": f"https://i.scdn.co/image/{image_id}{size}",
+                        "width": size,
+                        "height": size,
+                    }
+                    for size in (640, 300, 64)
+                ],
+                "artists": [artists[i % artist_count]],
+            }
+        )
+
+    items = []
+    for i in range(track_count):
+        album = albums[rng.randrange(album_count)]
+        track_artists = list(album["artists"])
+        if rng.random() < 0.2:
+            track_artists.append(artists[rng.randrange(artist_count)])
+        items.append(
+            {
+                "added_at": f"20{10 + i % 15:02d}-{1 + i % 12:02d}-{1 + i % 28:02d}T12:00:00Z",
+                "track": {
+                    "id": f"track{i:016d}",
+                    "name": f"Track {i}",
+                    "duration_ms": 120_000 + rng.randrange(240_000),
+                    "artists": track_artists,
+                    "album": album,
+                },
+            }
+        )
+    return items
+
+
+class FakeSpotify:
+    """
+    Usage:
+        with FakeSpotify(generate_library(1000), throttle_every=20) as spotify:
+            os.environ["SPOTIFY_API_BASE"] = spotify.api_base
+            ...
+            spotify.requests["/v1/me/tracks"]
+    """
+
+    def __init__(
+        self,
+        library=None,
+        latency_ms=0,
+        throttle_every=0,
+        error_rate=0.0,
+        retry_after=0,
+        seed=0,
+        images=None,
+        users_by_code=False,
+    ):
+        self.library = library or []
+        # Give every authorization code its own account, e.g. for load tests
+        # logging in many users; otherwise all codes log in self.profile
+        self.users_by_code = users_by_code
+        # Image ID -> bytes served under image_origin
+        self.images = images or {}
+        self.latency = latency_ms / 1000
+        self.throttle_every = throttle_every
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.profile = {
+            "id": "fake-spotify-user",
+            "display_name": "Fake User",
+            "email": "fake@example.com",
+            "external_urls": {"spotify": "https://open.spotify.com/user/fake"},
+        }
+        self.requests = Counter()
+        self.throttled = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self):
+        return f"{self.base_url}/v1"
+
+    @property
+    def token_url(self):
+        return f"{self.base_url}/api/token"
+
+    @property
+    def image_origin(self):
+        return f"{self.base_url}/image"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _fault(self):
+        """Decide whether the next request is throttled or fails."""
+        with self._lock:
+            total = sum(self.requests.values())
+            if self.throttle_every and total % self.throttle_every == 0:
+                self.throttled += 1
+                return 429
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return 500
+        return None
+
+    def _tracks_page(self, query):
+        limit = min(int(query.get("limit", ["20"])[0]), MAX_PAGE_SIZE)
+        offset = int(query.get("offset", ["0"])[0])
+        items = self.library[offset : offset + limit]
+        has_next = offset + limit < len(self.library)
+        return {
+            "items": items,
+            "limit": limit,
+            "offset": offset,
+            "total": len(self.library),
+            "next": (
+                f"{self.api_base}/me/tracks?limit={limit}&offset={offset + limit}"
+                if has_next
+                else None
+            ),
+        }
+
+    def _audio_features(self, query):
+        """Features derived from each ID, null for every tenth track like unanalysed ones."""
+        ids = query.get("ids", [""])[0].split(",")
+        if len(ids) > MAX_AUDIO_FEATURES_IDS:
+            return 400, {"error": "too many ids"}
+        features = []
+        for track_id in ids:
+            seed = zlib.crc32(track_id.encode("utf-8"))
+            if seed % 10 == 0:
+                features.append(None)
+                continue
+            rng = random.Random(seed)
+            features.append(
+                {
+                    "id": track_id,
+                    "tempo": round(60 + rng.random() * 120, 3),
+                    "energy": round(rng.random(), 3),
+                    "key": rng.randrange(12),
+                    "mode": rng.randrange(2),
+                    "danceability": round(rng.random(), 3),
+                    "valence": round(rng.random(), 3),
+                    "acousticness": round(rng.random(), 4),
+                    "instrumentalness": round(rng.random() ** 4, 5),
+                    "loudness": round(-20 + rng.random() * 18, 3),
+                    "time_signature": 4,
+                }
+            )
+        return 200, {"audio_features": features}
+
+    def _token(self, form):
+        suffix = ""
+        if self.users_by_code:
+            code = form.get("code", [""])[0]
+            if not code:
+                _, _, code = form.get("refresh_token", [""])[0].partition(":")
+            suffix = f":{code}" if code else ""
+        return {
+            "access_token": f"fake-access-token{suffix}",
+            "refresh_token": f"fake-refresh-token{suffix}",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+        }
+
+    def _profile(self, authorization):
+        _, _, code = (authorization or "").partition(":")
+        if not self.users_by_code or not code:
+            return self.profile
+        return {
+            "id": f"fake-{code}",
+            "display_name": f"Fake {code}",
+            "email": f"{code}@example.com",
+            "external_urls": {"spotify": f"https://open.spotify.com/user/fake-{code}"},
+        }
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                payload = json.dumps(body or {}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length).decode("utf-8") if length else ""
+                with fake._lock:
+                    fake.requests[url.path] += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                fault = fake._fault()
+                if fault == 429:
+                    return self._send(
+                        429, {"error": "rate limited"}, {"Retry-After": str(fake.retry_after)}
+                    )
+                if fault:
+                    return self._send(fault, {"error": "server error"})
+
+                if url.path == "/v1/me/tracks":
+                    return self._send(200, fake._tracks_page(parse_qs(url.query)))
+                if url.path == "/v1/audio-features":
+                    return self._send(*fake._audio_features(parse_qs(url.query)))
+                if url.path == "/v1/me":
+                    return self._send(200, fake._profile(self.headers.get("Authorization")))
+                if url.path == "/api/token":
+                    return self._send(200, fake._token(parse_qs(body)))
+                image = fake.images.get(url.path.removeprefix("/image/"))
+                if url.path.startswith("/image/") and image is not None:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(image)))
+                    self.end_headers()
+                    return self.wfile.write(image)
+                return self._send(404, {"error": "not found"})
+
+            do_GET = _dispatch
+            do_POST = _dispatch
+
+        return Handler
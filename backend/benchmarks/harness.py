@@ -0,0 +1,233 @@
+"""
+Shared plumbing for tests, benchmarks and load runs: in-memory AWS (moto)
+with the real table definitions, API Gateway event builders and
+DynamoDB call counting.
+"""
+
+import json
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import boto3
+from moto import mock_aws
+from moto.dynamodb.models import DynamoDBBackend
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (backend_dir, os.path.join(backend_dir, "lambda")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+INFRASTRUCTURE_DIR = os.path.join(os.path.dirname(backend_dir), "infrastructure")
+TABLES_FILE = os.path.join(INFRASTRUCTURE_DIR, "dynamodb_tables.json")
+BUCKETS_FILE = os.path.join(INFRASTRUCTURE_DIR, "s3_buckets.json")
+
+LOCAL_SECRETS = {
+    "JWT_SECRET": "local-benchmark-secret-not-for-production",
+    "SPOTIFY_CLIENT_ID": "fake-client-id",
+    "SPOTIFY_CLIENT_SECRET": "fake-client-secret",
+}
+
+
+def table_definitions():
+    with open(TABLES_FILE) as f:
+        return json.load(f)["tables"]
+
+
+def time_to_live_definitions():
+    with open(TABLES_FILE) as f:
+        return json.load(f).get("timeToLive", [])
+
+
+def bucket_definitions():
+    with open(BUCKETS_FILE) as f:
+        return json.load(f)["buckets"]
+
+
+@contextmanager
+def _atomic_writes():
+    """
+    Serialize moto's DynamoDB writes
+
+    moto checks a write's condition and applies it in separate steps, so
+    concurrent conditional writes (leases, rate limit buckets) could both
+    succeed; DynamoDB applies each one atomically.
+    """
+    lock = threading.RLock()
+
+    def serialized(write):
+        def locked(*args, **kwargs):
+            with lock:
+                return write(*args, **kwargs)
+
+        return locked
+
+    with ExitStack() as stack:
+        for name in ("put_item", "update_item", "delete_item", "transact_write_items"):
+            write = getattr(DynamoDBBackend, name)
+            stack.enter_context(mock.patch.object(DynamoDBBackend, name, serialized(write)))
+        yield
+
+
+@contextmanager
+def local_aws(secrets=LOCAL_SECRETS):
+    """
+    In-memory DynamoDB, S3 and SSM with every table and bucket from
+    infrastructure/ created and the given secrets stored under SSM_PREFIX.
+
+    Yields:
+        boto3 DynamoDB service resource
+    """
+    from shared import analytics_export, config, db, library_snapshot, thumbnails
+
+    region = os.environ.get("AWS_REGION", "eu-central-1")
+    with mock_aws(), _atomic_writes():
+        dynamodb = boto3.resource("dynamodb", region_name=region)
+        for table in table_definitions():
+            dynamodb.create_table(**table)
+        for ttl in time_to_live_definitions():
+            dynamodb.meta.client.update_time_to_live(
+                TableName=ttl["TableName"],
+                TimeToLiveSpecification={"Enabled": True, "AttributeName": ttl["AttributeName"]},
+            )
+
+        s3 = boto3.client("s3", region_name=region)
+        for bucket in bucket_definitions():
+            s3.create_bucket(
+                Bucket=bucket["Bucket"],
+                CreateBucketConfiguration={"LocationConstraint": region},
+            )
+            if "CORSConfiguration" in bucket:
+                s3.put_bucket_cors(
+                    Bucket=bucket["Bucket"], CORSConfiguration=bucket["CORSConfiguration"]
+                )
+
+        ssm = boto3.client("ssm", region_name=region)
+        for name, value in (secrets or {}).items():
+            ssm.put_parameter(
+                Name=f"{config.SSM_PREFIX}/{name}", Value=value, Type="SecureString"
+            )
+        config._cache.clear()
+        config._ssm_client = None
+        library_snapshot._s3_client = None
+        thumbnails._s3_client = None
+        analytics_export._s3_client = None
+        db.clear_read_caches()
+        try:
+            yield dynamodb
+        finally:
+            config._cache.clear()
+            config._ssm_client = None
+            library_snapshot._s3_client = None
+            thumbnails._s3_client = None
+            analytics_export._s3_client = None
+            db.clear_read_caches()
+
+
+class CallCounter:
+    """
+    Counts API calls made through a boto3 client, by operation name.
+
+    Usage:
+        counter = CallCounter(db.dynamodb.meta.client)
+        ...
+        counter.calls["BatchWriteItem"]
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._prefix = f"before-call.{client.meta.service_model.endpoint_prefix}"
+        client.meta.events.register(self._prefix, self._count)
+
+    def _count(self, model, **kwargs):
+        with self._lock:
+            self.calls[model.name] += 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def close(self):
+        self.client.meta.events.unregister(self._prefix, self._count)
+
+
+def auth_header(user_id, email=None):
+    """Authorization header with a valid JWT for the user."""
+    from shared.auth_utils import generate_jwt
+
+    return f"Bearer {generate_jwt(user_id, email or f'{user_id}@example.com')}"
+
+
+def make_event(
+    method="GET",
+    path="/",
+    user_id=None,
+    query=None,
+    path_params=None,
+    body=None,
+    version=1,
+    route=None,
+    source_ip="127.0.0.1",
+):
+    """
+    Build an API Gateway proxy event
+
+    Args:
+        method: HTTP method
+        path: Request path
+        user_id: If given, a valid JWT for this user is attached
+        query: Query string parameters
+        path_params: Path parameters
+        body: JSON-serializable request body
+        version: 1 for REST API events, 2 for HTTP API events
+        route: Resource template of the path, e.g. "/library/{trackId}";
+            defaults to the path with the path parameters as placeholders
+        source_ip: Client address API Gateway reports
+
+    Returns:
+        Event dict as the Lambda handlers receive it
+    """
+    headers = {"content-type": "application/json"}
+    if user_id:
+        # REST APIs keep header case, HTTP APIs lower-case every header
+        headers["Authorization" if version == 1 else "authorization"] = auth_header(user_id)
+
+    event = {
+        "headers": headers,
+        "queryStringParameters": query or None,
+        "pathParameters": path_params or None,
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False,
+    }
+    if route is None:
+        placeholders = {value: f"{{{name}}}" for name, value in (path_params or {}).items()}
+        route = "/".join(placeholders.get(part, part) for part in path.split("/"))
+    if version == 1:
+        event.update(
+            {
+                "resource": route,
+                "path": path,
+                "httpMethod": method,
+                "requestContext": {"identity": {"sourceIp": source_ip}},
+            }
+        )
+    else:
+        event.update(
+            {
+                "version": "2.0",
+                "routeKey": f"{method} {route}",
+                "rawPath": path,
+                "requestContext": {
+                    "http": {"method": method, "path": path, "sourceIp": source_ip}
+                },
+            }
+        )
+    return event
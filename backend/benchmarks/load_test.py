@@ -0,0 +1,358 @@
+"""
+Concurrent load test of the API handlers
+
+Replays API Gateway v1 and v2 events with valid JWTs against the real
+spotify_login, spotify_callback, library and fetch_library handlers, called
+in-process from a thread pool, with in-memory DynamoDB, S3 and SSM and the
+local Spotify stand-in behind them. Endpoints run one after the other, so
+every dependency call is attributed to the endpoint that made it. Reports
+throughput, latency percentiles and dependency calls per request, and
+compares them to benchmarks/load_baseline.json.
+
+Usage:
+    python benchmarks/load_test.py                          # every endpoint, check
+    python benchmarks/load_test.py --endpoints library snapshot --concurrency 32
+    python benchmarks/load_test.py --api-version 2 --requests 1000 --json out.json
+    python benchmarks/load_test.py --save-baseline          # record new baseline
+"""
+
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("AWS_REGION", "eu-central-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("SPOTIFY_RATE_LIMITER", "local")
+os.environ.setdefault("REQUEST_RATE_LIMITER", "off")
+os.environ.setdefault("SPOTIFY_REDIRECT_URI", "http://localhost/callback")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmarks.bench_sync import configure_spotify, percentile  # noqa: E402
+from benchmarks.fake_spotify import FakeSpotify, generate_library  # noqa: E402
+from benchmarks.harness import CallCounter, local_aws, make_event  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_baseline.json")
+ENDPOINTS = ["login", "callback", "library", "snapshot", "fetch_library"]
+
+# Allowed ratio to the baseline before a metric counts as a regression, and
+# differences below which it never does. Calls per request get a little
+# slack for syncs that coalesce differently from run to run.
+DEFAULT_THRESHOLDS = {
+    "latencyMs.p95": 1.5,
+    "latencyMs.p99": 2.0,
+    "callsPerRequest.dynamodb": 1.0,
+    "callsPerRequest.s3": 1.0,
+    "callsPerRequest.ssm": 1.0,
+    "callsPerRequest.spotify": 1.0,
+}
+ABSOLUTE_SLACK = {
+    "latencyMs.p95": 5.0,
+    "latencyMs.p99": 10.0,
+    "callsPerRequest.dynamodb": 0.1,
+    "callsPerRequest.s3": 0.1,
+    "callsPerRequest.ssm": 0.1,
+    "callsPerRequest.spotify": 0.1,
+}
+
+
+def _handlers():
+    from auth.spotify_callback import lambda_handler as callback_handler
+    from auth.spotify_login import lambda_handler as login_handler
+    from service.library import lambda_handler as library_handler
+    from service.spotify.fetch_library import lambda_handler as fetch_library_handler
+
+    return {
+        "login": login_handler,
+        "callback": callback_handler,
+        "library": library_handler,
+        "snapshot": library_handler,
+        "fetch_library": fetch_library_handler,
+    }
+
+
+def build_event(endpoint, user, version):
+    """
+    API Gateway event for one request
+
+    Args:
+        endpoint: Name from ENDPOINTS
+        user: {"userId", "code"} of the user making the request
+        version: 1 for REST API events, 2 for HTTP API events
+    """
+    if endpoint == "login":
+        return make_event("GET", "/auth/spotify/login", version=version)
+    if endpoint == "callback":
+        return make_event(
+            "GET", "/auth/spotify/callback", query={"code": user["code"]}, version=version
+        )
+    if endpoint == "library":
+        return make_event(
+            "GET", "/library", user_id=user["userId"], query={"limit": "50"}, version=version
+        )
+    if endpoint == "snapshot":
+        return make_event("GET", "/library/snapshot", user_id=user["userId"], version=version)
+    if endpoint == "fetch_library":
+        return make_event(
+            "POST",
+            "/library/sync/spotify",
+            user_id=user["userId"],
+            path_params={"platform": "spotify"},
+            version=version,
+        )
+    raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+def api_version(args, i):
+    if args.api_version == "mixed":
+        return 1 + i % 2
+    return int(args.api_version)
+
+
+def seed_users(count, handlers):
+    """
+    Log users in through the callback and sync their libraries once, so
+    the measured requests see returning users with a stored library
+
+    Returns:
+        List of {"userId", "code"}
+    """
+    from shared.library_sync import sync_spotify_library
+
+    users = []
+    for i in range(count):
+        code = f"load{i:04d}"
+        response = handlers["callback"](build_event("callback", {"code": code}, 1), None)
+        if response["statusCode"] != 200:
+            raise RuntimeError(f"Login of {code} failed: {response['body']}")
+        user_id = json.loads(response["body"])["user"]["userId"]
+        sync_spotify_library(user_id)
+        users.append({"userId": user_id, "code": code})
+    return users
+
+
+class Dependencies:
+    """Call counters for every service the handlers talk to."""
+
+    def __init__(self, spotify):
+        from shared import config, db, library_snapshot
+
+        self.spotify = spotify
+        self.counters = {
+            "dynamodb": CallCounter(db.dynamodb.meta.client),
+            "s3": CallCounter(library_snapshot._get_s3_client()),
+            "ssm": CallCounter(config._get_ssm_client()),
+        }
+
+    def reset(self):
+        for counter in self.counters.values():
+            counter.reset()
+        with self.spotify._lock:
+            self.spotify.requests.clear()
+
+    def snapshot(self):
+        calls = {name: dict(counter.calls) for name, counter in self.counters.items()}
+        calls["spotify"] = dict(self.spotify.requests)
+        return calls
+
+    def close(self):
+        for counter in self.counters.values():
+            counter.close()
+
+
+def run_endpoint(endpoint, handler, users, dependencies, args):
+    """
+    Send args.requests requests to one endpoint from args.concurrency
+    threads, users taking turns
+
+    Returns:
+        Result dict of the endpoint
+    """
+    dependencies.reset()
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def request(i):
+        event = build_event(endpoint, users[i % len(users)], api_version(args, i))
+        start = time.perf_counter()
+        response = handler(event, None)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed_ms)
+            statuses[str(response["statusCode"])] += 1
+
+    # Handlers print one EMF record per invocation
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for _ in executor.map(
+                lambda i: contextvars.copy_context().run(request, i), range(args.requests)
+            ):
+                pass
+        seconds = time.perf_counter() - start
+
+    calls = dependencies.snapshot()
+    return {
+        "requests": args.requests,
+        "seconds": round(seconds, 3),
+        "throughput": round(args.requests / seconds, 1),
+        "statuses": dict(statuses),
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "latencyMs": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+        "callsPerRequest": {
+            name: round(sum(by_operation.values()) / args.requests, 2)
+            for name, by_operation in calls.items()
+        },
+        "calls": calls,
+    }
+
+
+def run(args):
+    """
+    Run the load test against fresh local stand-ins
+
+    Returns:
+        Dict of endpoint name -> result dict
+    """
+    from shared import library_sync
+
+    handlers = _handlers()
+    debounce_seconds = library_sync.SYNC_DEBOUNCE_SECONDS
+    with local_aws(), FakeSpotify(
+        generate_library(args.tracks, seed=1), latency_ms=args.latency_ms, users_by_code=True
+    ) as spotify:
+        configure_spotify(spotify, args.rate_limit)
+        # Every sync request crawls, unless one for the same user is in flight
+        library_sync.SYNC_DEBOUNCE_SECONDS = args.sync_debounce
+        dependencies = None
+        try:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                users = seed_users(args.users, handlers)
+            dependencies = Dependencies(spotify)
+            return {
+                endpoint: run_endpoint(
+                    endpoint, handlers[endpoint], users, dependencies, args
+                )
+                for endpoint in args.endpoints
+            }
+        finally:
+            library_sync.SYNC_DEBOUNCE_SECONDS = debounce_seconds
+            if dependencies:
+                dependencies.close()
+
+
+def metric_value(result, name):
+    value = result
+    for part in name.split("."):
+        value = value[part]
+    return value
+
+
+def compare(results, baseline):
+    """
+    Returns:
+        List of human-readable regression descriptions (empty if none)
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    regressions = []
+    for endpoint, result in results.items():
+        expected = baseline.get("results", {}).get(endpoint)
+        if not expected:
+            continue
+        if result["errors"] > expected["errors"]:
+            regressions.append(
+                f"{endpoint}: {result['errors']} errors, baseline {expected['errors']}"
+            )
+        for name, ratio in thresholds.items():
+            current = metric_value(result, name)
+            reference = metric_value(expected, name)
+            limit = max(reference * ratio, reference + ABSOLUTE_SLACK.get(name, 0))
+            if current > limit:
+                regressions.append(
+                    f"{endpoint}: {name} {current} exceeds baseline {reference} (limit {limit:.2f})"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--tracks", type=int, default=300, help="Library size of every user")
+    parser.add_argument("--api-version", choices=["1", "2", "mixed"], default="mixed")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=1_000_000)
+    parser.add_argument("--sync-debounce", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    for endpoint, result in results.items():
+        latency = result["latencyMs"]
+        calls = ", ".join(f"{value} {name}" for name, value in result["callsPerRequest"].items())
+        print(
+            f"{endpoint:>13}: {result['throughput']:.0f} req/s, "
+            f"p50 {latency['p50']} ms p95 {latency['p95']} ms p99 {latency['p99']} ms, "
+            f"{result['errors']} errors, per request: {calls}"
+        )
+
+    scenario = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "users": args.users,
+        "tracks": args.tracks,
+        "apiVersion": args.api_version,
+        "latencyMs": args.latency_ms,
+        "syncDebounce": args.sync_debounce,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"scenario": scenario, "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.save_baseline:
+        baseline = {"scenario": scenario, "thresholds": DEFAULT_THRESHOLDS, "results": results}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found, run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("scenario") != scenario:
+        print("Scenario differs from the baseline, skipping regression check")
+        return 0
+
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if not regressions:
+        print("No regressions against baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,117 @@
+import contextvars
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from shared.config import get_logger
+from shared.config import get_logger, preload_secrets
+from shared.instrumentation import increment, instrument_handler, span
 from shared.responses import success_response, error_response
 
 logger = get_logger(__name__)
 from shared.spotify_utils import exchange_code_for_tokens, get_user_profile
 from shared.auth_utils import generate_jwt
 from shared.db import (
+    create_spotify_user,
+    get_identities,
+    get_user,
     get_user_by_email,
-    create_user,
-    save_platform_connection,
     get_user_by_spotify_id,
+    link_spotify_user,
+    update_platform_connection,
 )
 
+# Users created before the Identities table only have spotifyId on their
+# row. Scanning for them can be turned off once they are all linked.
+LEGACY_USER_LOOKUP = os.environ.get("LEGACY_USER_LOOKUP", "true").lower() != "false"
+MAX_RESOLVE_ATTEMPTS = 2
 
+
+def _in_parallel(*calls):
+    """Run independent calls on threads, returning their results in order."""
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        # Copy the caller's context so the calls report to its invocation
+        futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+        return [future.result() for future in futures]
+
+
+def _resolve_user(spotify_id, spotify_email, display_name, tokens, profile):
+    """
+    Find or create the user of a Spotify account and save its connection
+
+    Returns:
+        Tuple of (user, outcome), outcome being "existing", "linked" or "created"
+
+    Raises:
+        LookupError if the account's identity belongs to a user that does
+        not exist
+    """
+    keys = [("spotify", spotify_id)]
+    if spotify_email:
+        keys.append(("email", spotify_email))
+
+    for _ in range(MAX_RESOLVE_ATTEMPTS):
+        found = get_identities(*keys)
+
+        user_id = found.get(("spotify", spotify_id))
+        if user_id:
+            user, _ = _in_parallel(
+                lambda: get_user(user_id),
+                lambda: update_platform_connection(user_id, "spotify", tokens, profile),
+            )
+            if user is None:
+                # A dangling identity, or a profile not copied to the table
+                # USER_DATA_LAYOUT reads; creating another user would orphan it
+                raise LookupError(f"Spotify ID {spotify_id} belongs to missing user {user_id}")
+            return user, "existing"
+
+        user = None
+        link_email = None
+        user_id = found.get(("email", spotify_email))
+        if user_id:
+            link_email = spotify_email
+        elif LEGACY_USER_LOOKUP:
+            user = get_user_by_spotify_id(spotify_id)
+            if not user and spotify_email:
+                user = get_user_by_email(spotify_email)
+                link_email = spotify_email if user else None
+            user_id = user["userId"] if user else None
+
+        if user_id:
+            if user is None:
+                user, linked = _in_parallel(
+                    lambda: get_user(user_id),
+                    lambda: link_spotify_user(user_id, spotify_id, link_email, tokens, profile),
+                )
+            else:
+                linked = link_spotify_user(user_id, spotify_id, link_email, tokens, profile)
+            if linked:
+                return user, "linked"
+        else:
+            user = create_spotify_user(
+                email=spotify_email or f"{spotify_id}@spotify.melodiary.local",
+                display_name=display_name,
+                spotify_id=spotify_id,
+                has_real_email=bool(spotify_email),
+                tokens=tokens,
+                profile_data=profile,
+            )
+            if user:
+                return user, "created"
+
+        # A concurrent login of the same account claimed an identity first
+        increment("callback.identity_conflicts")
+
+    raise RuntimeError(f"Could not resolve a user for Spotify ID {spotify_id}")
+
+
+@instrument_handler
 def lambda_handler(event, context):
     """
     Handle Spotify OAuth callback
 
+    Each stage is timed as a callback.* span, so the EMF record of every
+    login carries its latency breakdown.
+
     Expects:
         code: Authorization code from Spotify
 
@@ -40,11 +134,18 @@ def lambda_handler(event, context):
     if not code:
         return error_response("Missing authorization code", 400)
 
-    tokens, error = exchange_code_for_tokens(code)
+    # Every secret of the login in one SSM call on a cold start, so signing
+    # the JWT at the end never waits on SSM
+    with span("callback.secrets"):
+        preload_secrets("SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "JWT_SECRET")
+
+    with span("callback.exchange"):
+        tokens, error = exchange_code_for_tokens(code)
     if error:
         return error_response(f"Failed to authenticate with Spotify: {error}", 400)
 
-    profile, error = get_user_profile(tokens["access_token"])
+    with span("callback.profile"):
+        profile, error = get_user_profile(tokens["access_token"])
     if error:
         return error_response(f"Failed to get user profile: {error}", 400)
 
@@ -56,37 +157,23 @@ def lambda_handler(event, context):
     spotify_email = profile.get("email")
     display_name = profile.get("display_name") or f"spotify_user_{spotify_id[:8]}"
 
-    user = None
-
-    user = get_user_by_spotify_id(spotify_id)
-
-    if not user and spotify_email:
-        user = get_user_by_email(spotify_email)
-
-        if user:
-            from shared.db import link_spotify_id_to_user
-
-            link_spotify_id_to_user(user["userId"], spotify_id)
-
-    # Create if doesn't exist
-    if not user:
-        email = spotify_email or f"{spotify_id}@spotify.melodiary.local"
-
-        user = create_user(
-            email=email,
-            display_name=display_name,
-            spotify_id=spotify_id,
-            has_real_email=bool(spotify_email),
-        )
+    try:
+        with span("callback.user"):
+            user, outcome = _resolve_user(
+                spotify_id, spotify_email, display_name, tokens, profile
+            )
+    except Exception as e:
+        logger.error("Failed to store login of Spotify ID %s: %s", spotify_id, e)
+        return error_response("Failed to sign in", 500)
+
+    increment(f"callback.{outcome}")
+    if outcome == "created":
         logger.info("Created new user: %s (Spotify ID: %s)", user["userId"], spotify_id)
     else:
         logger.info("Existing user logged in: %s (Spotify ID: %s)", user["userId"], spotify_id)
 
-    save_platform_connection(
-        user_id=user["userId"], platform="spotify", tokens=tokens, profile_data=profile
-    )
-
-    jwt_token = generate_jwt(user["userId"], user["email"])
+    with span("callback.jwt"):
+        jwt_token = generate_jwt(user["userId"], user["email"])
 
     return success_response(
         {
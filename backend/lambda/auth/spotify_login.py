@@ -2,9 +2,11 @@ import os
 import urllib.parse
 
 from shared.config import get_secret
+from shared.instrumentation import instrument_handler
 from shared.responses import success_response, error_response
 
 
+@instrument_handler
 def lambda_handler(event, context):
     """
     Generate Spotify authorization URL for OAuth flow.
@@ -0,0 +1,35 @@
+from shared.analytics_export import run_export
+from shared.config import get_logger
+from shared.instrumentation import instrument_handler
+
+logger = get_logger(__name__)
+
+# Left of the invocation for the last parts and checkpoints to be written
+STOP_MARGIN_SECONDS = 60
+
+
+@instrument_handler
+def lambda_handler(event, context):
+    """
+    Admin analytics export of the library table to S3, invoked directly:
+        {}                                  - Start a new run
+        {"runId": "...", ...}               - Resume a run
+        {"totalSegments": 32, "maxWorkers": 8, "readCapacityPerSecond": 100}
+
+    Stops before the invocation times out; invoke it again with the
+    returned runId until it reports complete.
+
+    Returns:
+        Dict with runId, complete and, once complete, the summary
+    """
+    time_budget = None
+    if context is not None:
+        time_budget = max(0, context.get_remaining_time_in_millis() / 1000 - STOP_MARGIN_SECONDS)
+
+    return run_export(
+        run_id=event.get("runId"),
+        total_segments=event.get("totalSegments"),
+        max_workers=event.get("maxWorkers"),
+        read_capacity_per_second=event.get("readCapacityPerSecond"),
+        time_budget_seconds=time_budget,
+    )
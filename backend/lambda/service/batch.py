@@ -0,0 +1,265 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.config import get_logger
+from shared.responses import success_response, error_response
+from shared.auth_utils import require_auth
+from shared.cover_art import add_cover_art_url
+from shared.instrumentation import increment, instrument_handler, span
+from shared.db import (
+    batch_get,
+    get_user_library,
+    library_table,
+    soft_delete_tracks,
+    split_user_data,
+    user_data_keys,
+)
+from shared.library_sketch import refresh_sketch
+from shared.library_snapshot import refresh_snapshot
+
+logger = get_logger(__name__)
+
+# Sub-operations per request, each one at most a few DynamoDB calls
+BATCH_MAX_OPERATIONS = int(os.environ.get("BATCH_MAX_OPERATIONS", "25"))
+# Library page queries run at once next to the merged BatchGetItem
+BATCH_READ_CONCURRENCY = int(os.environ.get("BATCH_READ_CONCURRENCY", "8"))
+
+OPERATIONS = ("library.page", "library.delete", "library.stats", "sync.status")
+
+
+@instrument_handler
+@require_auth
+def lambda_handler(event, context):
+    """
+    Run several API operations in one request (POST /batch)
+
+    Body: {"operations": [{"id": ..., "op": ..., ...}, ...]} with op one of
+        library.page    - {"limit", "lastKey"}, like GET /library
+        library.delete  - {"trackId"}, like DELETE /library/{trackId}
+        library.stats   - Number of tracks and time of the last change
+        sync.status     - {"platform"}, state of the last and current sync
+
+    Reads run concurrently, with the stats, sync status and delete lookups
+    merged into one BatchGetItem, and see the library as it was before the
+    batch's deletes. Deletes are logged and patched into the snapshot
+    together.
+
+    Returns:
+        {"results": [{"id", "status", "body"}, ...]} in operation order
+    """
+    # REST API (v1) uses "httpMethod", HTTP API (v2) uses "requestContext.http.method"
+    method = event.get("httpMethod") or (
+        event.get("requestContext", {}).get("http", {}).get("method", "")
+    )
+    user_id = event.get("userId")
+
+    if not user_id:
+        return error_response("No such user", 404)
+    if method != "POST":
+        return error_response("Method not allowed", 405)
+
+    try:
+        body = json.loads(event.get("body") or "{}")
+    except json.JSONDecodeError:
+        return error_response("Invalid JSON body", 400)
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return error_response("Missing operations", 400)
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return error_response(f"At most {BATCH_MAX_OPERATIONS} operations per batch", 400)
+
+    results = [_parse_operation(i, operation) for i, operation in enumerate(operations)]
+    _run_reads(user_id, results)
+    _run_deletes(user_id, results)
+
+    increment("batch.operations", len(results))
+    return success_response(
+        {
+            "results": [
+                {"id": result["id"], "status": result["status"], "body": result["body"]}
+                for result in results
+            ]
+        }
+    )
+
+
+def _parse_operation(index, operation):
+    """Validate one operation into its pending result."""
+    if not isinstance(operation, dict):
+        result = {"id": index, "op": None}
+        return _fail(result, 400, "Operation must be an object")
+    result = {"id": operation.get("id", index), "op": operation.get("op"), "status": None}
+    op = result["op"]
+
+    if op == "library.page":
+        try:
+            result["limit"] = min(int(operation.get("limit", 50)), 100)
+        except (ValueError, TypeError):
+            return _fail(result, 400, "Invalid limit parameter")
+        if result["limit"] < 1:
+            return _fail(result, 400, "Limit must be a positive integer")
+        last_key = operation.get("lastKey")
+        if isinstance(last_key, str):
+            try:
+                last_key = json.loads(last_key)
+            except json.JSONDecodeError:
+                return _fail(result, 400, "Invalid lastKey format")
+        result["lastKey"] = last_key
+    elif op == "library.delete":
+        result["trackId"] = operation.get("trackId")
+        if not result["trackId"] or not isinstance(result["trackId"], str):
+            return _fail(result, 400, "Missing trackId")
+    elif op == "sync.status":
+        result["platform"] = operation.get("platform", "spotify")
+        if not isinstance(result["platform"], str):
+            return _fail(result, 400, "Invalid platform")
+    elif op != "library.stats":
+        return _fail(result, 400, f"Unknown operation, expected one of {', '.join(OPERATIONS)}")
+    return result
+
+
+def _fail(result, status, message):
+    result.update(status=status, body={"error": message})
+    return result
+
+
+def _pending(results, op):
+    return [result for result in results if result["op"] == op and result["status"] is None]
+
+
+def _read_keys(user_id, results):
+    """Keys of every item the stats, sync status and delete operations read."""
+    platforms = dict.fromkeys(result["platform"] for result in _pending(results, "sync.status"))
+    keys = user_data_keys(
+        user_id, platforms, profile=bool(_pending(results, "library.stats"))
+    )
+    track_ids = dict.fromkeys(result["trackId"] for result in _pending(results, "library.delete"))
+    if track_ids:
+        keys[library_table] = [{"userId": user_id, "trackId": track_id} for track_id in track_ids]
+    return keys
+
+
+def _run_reads(user_id, results):
+    """Run the merged lookup and the page queries concurrently."""
+    keys = _read_keys(user_id, results)
+    pages = _pending(results, "library.page")
+
+    def lookup():
+        return batch_get(keys, projections={library_table: "trackId, deletedAt"})
+
+    def page(result):
+        return get_user_library(user_id, limit=result["limit"], last_key=result["lastKey"])
+
+    calls = ([lookup] if keys else []) + [lambda result=result: page(result) for result in pages]
+    if not calls:
+        return
+    with span("batch.reads"), ThreadPoolExecutor(
+        max_workers=min(BATCH_READ_CONCURRENCY, len(calls))
+    ) as executor:
+        # Copy the caller's context so the calls report to its invocation
+        futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+        lookup_future = futures.pop(0) if keys else None
+
+    for result, future in zip(pages, futures):
+        try:
+            library = future.result()
+        except Exception as e:
+            logger.error("Failed to retrieve library for user %s: %s", user_id, e)
+            _fail(result, 500, "Failed to retrieve library")
+            continue
+        result.update(
+            status=200,
+            body={
+                "items": [add_cover_art_url(item) for item in library["items"]],
+                "lastKey": library["lastKey"],
+                "count": library["count"],
+            },
+        )
+
+    if lookup_future is None:
+        return
+    try:
+        found = lookup_future.result()
+    except Exception as e:
+        logger.error("Failed to read batch items for user %s: %s", user_id, e)
+        for result in results:
+            if result["status"] is None and result["op"] != "library.page":
+                _fail(result, 500, "Failed to read data")
+        return
+
+    user, connections = split_user_data(found)
+    _answer_stats(results, user)
+    _answer_sync_status(results, connections)
+    existing = {
+        item["trackId"] for item in found.get(library_table.name, []) if "deletedAt" not in item
+    }
+    for result in _pending(results, "library.delete"):
+        if result["trackId"] not in existing:
+            _fail(result, 404, "Track not found")
+
+
+def _answer_stats(results, user):
+    for result in _pending(results, "library.stats"):
+        if user is None:
+            _fail(result, 404, "No such user")
+            continue
+        # Both are kept up to date by syncs and deletes once they exist
+        summary = user.get("librarySnapshot") or user.get("librarySketch")
+        result.update(
+            status=200,
+            body={
+                "tracks": int(summary["count"]) if summary else None,
+                "lastChangedAt": user.get("librarySeqAt"),
+            },
+        )
+
+
+def _answer_sync_status(results, connections):
+    by_platform = {connection["platform"]: connection for connection in connections}
+    now = int(time.time())
+    for result in _pending(results, "sync.status"):
+        connection = by_platform.get(result["platform"])
+        if connection is None:
+            result.update(status=200, body={"platform": result["platform"], "connected": False})
+            continue
+        result.update(
+            status=200,
+            body={
+                "platform": result["platform"],
+                "connected": True,
+                "syncing": int(connection.get("syncLeaseUntil", 0)) >= now,
+                "lastSyncedAt": connection.get("lastSyncedAt"),
+                "lastSyncResult": connection.get("lastSyncResult"),
+            },
+        )
+
+
+def _run_deletes(user_id, results):
+    """Delete the tracks found by the lookup, with one log write and snapshot patch."""
+    deletes = _pending(results, "library.delete")
+    if not deletes:
+        return
+    track_ids = list(dict.fromkeys(result["trackId"] for result in deletes))
+    try:
+        deleted = set(soft_delete_tracks(user_id, track_ids))
+    except Exception as e:
+        logger.error("Failed to delete tracks for user %s: %s", user_id, e)
+        for result in deletes:
+            _fail(result, 500, "Failed to delete track")
+        return
+
+    answered = set()
+    for result in deletes:
+        # The first of several deletes of one track does it, like separate requests
+        if result["trackId"] in deleted and result["trackId"] not in answered:
+            answered.add(result["trackId"])
+            result.update(status=200, body={"message": "Track deleted"})
+        else:
+            _fail(result, 404, "Track not found")
+
+    if deleted:
+        refresh_snapshot(user_id, removed_track_ids=list(deleted))
+        refresh_sketch(user_id, removed_track_ids=list(deleted))
@@ -0,0 +1,59 @@
+import base64
+
+from shared.config import get_logger
+from shared.cover_art import THUMBNAIL_SIZES, is_image_id
+from shared.instrumentation import increment, instrument_handler
+from shared.request_limits import check_public_request
+from shared.responses import error_response, get_standard_cors_headers, rate_limited_response
+from shared.thumbnails import THUMBNAIL_CACHE_CONTROL, ThumbnailError, get_thumbnail
+
+logger = get_logger(__name__)
+
+
+@instrument_handler
+def lambda_handler(event, context):
+    """
+    Album cover thumbnails:
+        GET /cover-art/{imageId}/{size}
+
+    Public, so <img> tags can load it without a token, and limited per
+    source IP instead. Thumbnails are made once per image and size and
+    served from S3 afterwards; the response is immutable, so browsers and a
+    CDN in front of the API cache it for a year.
+    """
+    retry_after = check_public_request(event)
+    if retry_after:
+        increment("ratelimit.rejected")
+        return rate_limited_response(retry_after)
+
+    params = event.get("pathParameters") or {}
+    image_id = params.get("imageId")
+    try:
+        size = int(params.get("size", ""))
+    except ValueError:
+        size = None
+
+    if not is_image_id(image_id):
+        return error_response("Invalid cover art ID", 400)
+    if size not in THUMBNAIL_SIZES:
+        return error_response(
+            f"Size must be one of {', '.join(str(size) for size in THUMBNAIL_SIZES)}", 400
+        )
+
+    try:
+        body = get_thumbnail(image_id, size)
+    except ThumbnailError as e:
+        return error_response(e.message, e.status_code)
+    except Exception as e:
+        logger.error("Failed to get cover art %s: %s", image_id, e)
+        return error_response("Failed to get cover art", 500)
+
+    headers = get_standard_cors_headers()
+    headers["Content-Type"] = "image/jpeg"
+    headers["Cache-Control"] = THUMBNAIL_CACHE_CONTROL
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": base64.b64encode(body).decode("ascii"),
+        "isBase64Encoded": True,
+    }
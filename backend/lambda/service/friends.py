@@ -0,0 +1,58 @@
+from shared.config import get_logger
+from shared.responses import success_response, error_response
+from shared.auth_utils import require_auth
+from shared.instrumentation import instrument_handler
+from shared.db import get_friend_ids
+from shared.library_sketch import exact_overlap, rank_friends_by_overlap
+
+logger = get_logger(__name__)
+
+
+@instrument_handler
+@require_auth
+def lambda_handler(event, context):
+    """
+    Friends resource handler. Routes based on HTTP method and path:
+        GET /friends/overlap              - Friends ranked by shared tracks (estimated)
+        GET /friends/{friendId}/overlap   - Exact number of tracks shared with a friend
+    """
+    # REST API (v1) uses "httpMethod", HTTP API (v2) uses "requestContext.http.method"
+    method = event.get("httpMethod") or (
+        event.get("requestContext", {}).get("http", {}).get("method", "")
+    )
+    user_id = event.get("userId")
+
+    if not user_id:
+        return error_response("No such user", 404)
+
+    if method != "GET":
+        return error_response("Method not allowed", 405)
+
+    friend_id = (event.get("pathParameters") or {}).get("friendId")
+    if friend_id:
+        return _get_exact_overlap(user_id, friend_id)
+    return _get_overlap_ranking(user_id)
+
+
+def _get_overlap_ranking(user_id):
+    """Rank every friend by library overlap, from library sketches."""
+    try:
+        friends = rank_friends_by_overlap(user_id)
+    except Exception as e:
+        logger.error("Failed to rank friends of user %s: %s", user_id, e)
+        return error_response("Failed to compute library overlap", 500)
+
+    return success_response({"friends": friends})
+
+
+def _get_exact_overlap(user_id, friend_id):
+    """Count the tracks shared with one friend by reading both libraries."""
+    try:
+        if friend_id not in get_friend_ids(user_id):
+            return error_response("Friend not found", 404)
+        overlap = exact_overlap(user_id, friend_id)
+    except Exception as e:
+        logger.error("Failed to compare libraries of %s and %s: %s", user_id, friend_id, e)
+        return error_response("Failed to compute library overlap", 500)
+
+    return success_response({"friendId": friend_id, **overlap})
@@ -3,16 +3,24 @@ import json
 from shared.config import get_logger
 from shared.responses import success_response, error_response
 from shared.auth_utils import require_auth
+from shared.cover_art import add_cover_art_url
+from shared.instrumentation import instrument_handler
 from shared.db import get_user_library, soft_delete_track
+from shared.library_changes import CursorExpired, get_changes_since
+from shared.library_sketch import refresh_sketch
+from shared.library_snapshot import get_snapshot_download, refresh_snapshot
 
 logger = get_logger(__name__)
 
 
+@instrument_handler
 @require_auth
 def lambda_handler(event, context):
     """
     Library resource handler. Routes based on HTTP method:
         GET    /library             - List tracks with pagination
+        GET    /library/snapshot    - URL of the full-library snapshot
+        GET    /library/changes     - Changes since a cursor
         DELETE /library/{trackId}   - Soft-delete a track
     """
     # REST API (v1) uses "httpMethod", HTTP API (v2) uses "requestContext.http.method"
@@ -24,7 +32,14 @@ def lambda_handler(event, context):
     if not user_id:
         return error_response("No such user", 404)
 
-    if method == "GET":
+    # REST API (v1) uses "path", HTTP API (v2) uses "rawPath"
+    path = event.get("path") or event.get("rawPath") or ""
+
+    if method == "GET" and path.rstrip("/").endswith("/snapshot"):
+        return _get_snapshot(user_id)
+    elif method == "GET" and path.rstrip("/").endswith("/changes"):
+        return _get_changes(event, user_id)
+    elif method == "GET":
         return _get_library(event, user_id)
     elif method == "DELETE":
         return _delete_track(event, user_id)
@@ -58,13 +73,48 @@ def _get_library(event, user_id):
 
     return success_response(
         {
-            "items": result["items"],
+            "items": [add_cover_art_url(item) for item in result["items"]],
             "lastKey": result["lastKey"],
             "count": result["count"],
         }
     )
 
 
+def _get_snapshot(user_id):
+    """Get a download URL for the whole library as one gzipped JSON object."""
+    try:
+        download = get_snapshot_download(user_id)
+    except Exception as e:
+        logger.error("Failed to get library snapshot for user %s: %s", user_id, e)
+        return error_response("Failed to get library snapshot", 500)
+
+    return success_response(download)
+
+
+def _get_changes(event, user_id):
+    """
+    Get library changes since a cursor from a snapshot or an earlier call.
+    Answers 410 when the cursor has expired and the client must reload the
+    snapshot.
+    """
+    params = event.get("queryStringParameters") or {}
+    cursor = params.get("since")
+    if not cursor:
+        return error_response("Missing since parameter", 400)
+
+    try:
+        changes = get_changes_since(user_id, cursor)
+    except ValueError:
+        return error_response("Invalid since cursor", 400)
+    except CursorExpired:
+        return error_response("Cursor expired, full resync required", 410, {"resync": True})
+    except Exception as e:
+        logger.error("Failed to retrieve changes for user %s: %s", user_id, e)
+        return error_response("Failed to retrieve changes", 500)
+
+    return success_response(changes)
+
+
 def _delete_track(event, user_id):
     """Soft-delete a track from user's library."""
     path_params = event.get("pathParameters") or {}
@@ -82,4 +132,7 @@ def _delete_track(event, user_id):
     if not deleted:
         return error_response("Track not found", 404)
 
+    refresh_snapshot(user_id, removed_track_ids=[track_id])
+    refresh_sketch(user_id, removed_track_ids=[track_id])
+
     return success_response({"message": "Track deleted"})
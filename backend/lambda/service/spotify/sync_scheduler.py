@@ -0,0 +1,32 @@
+from shared.config import get_logger
+from shared.instrumentation import instrument_handler
+from shared.queues import sqs_messages
+from shared.sync_scheduler import schedule_segment, start_scheduled_run
+
+logger = get_logger(__name__)
+
+
+@instrument_handler
+def lambda_handler(event, context):
+    """
+    Scheduled library sync orchestrator. Routes based on the trigger:
+        EventBridge schedule    - Fan out one scan message per segment
+        SQS (scan queue)        - Rank one segment and enqueue its syncs
+
+    Returns:
+        Run summary, or SQS partial batch failures for segment messages
+    """
+    if "Records" not in event:
+        return start_scheduled_run()
+
+    failures = []
+    for message_id, message in sqs_messages(event):
+        try:
+            schedule_segment(
+                message["segment"], message["totalSegments"], message["callBudget"]
+            )
+        except Exception as e:
+            logger.error("Failed to schedule segment %s: %s", message.get("segment"), e)
+            failures.append({"itemIdentifier": message_id})
+
+    return {"batchItemFailures": failures}
@@ -0,0 +1,30 @@
+from shared.config import get_logger
+from shared.instrumentation import instrument_handler
+from shared.queues import sqs_messages
+from shared.sync_scheduler import run_sync_job
+
+logger = get_logger(__name__)
+
+
+@instrument_handler
+def lambda_handler(event, context):
+    """
+    Run scheduled library syncs from the sync queue
+
+    The SQS event source's maximum concurrency is the global cap on
+    scheduled syncs running at once.
+
+    Returns:
+        SQS partial batch failures, so only failed jobs are retried
+    """
+    failures = []
+    for message_id, job in sqs_messages(event):
+        try:
+            done = run_sync_job(job)
+        except Exception as e:
+            logger.error("Scheduled sync crashed for user %s: %s", job.get("userId"), e)
+            done = False
+        if not done:
+            failures.append({"itemIdentifier": message_id})
+
+    return {"batchItemFailures": failures}
@@ -0,0 +1,26 @@
+from shared.config import get_logger
+from shared.instrumentation import instrument_handler
+from shared.user_data_backfill import backfill_user_data
+
+logger = get_logger(__name__)
+
+
+@instrument_handler
+def lambda_handler(event, context):
+    """
+    Admin backfill of Melodiary-UserData from the Users and
+    PlatformConnections tables, invoked directly:
+        {}                      - Copy the missing items
+        {"overwrite": true}     - Also rewrite items that differ
+        {"dryRun": true}        - Only count missing and differing items
+        {"totalSegments": 16}
+
+    Returns:
+        Dict of table name -> scanned, missing, different, written and
+        failed counts
+    """
+    return backfill_user_data(
+        overwrite=bool(event.get("overwrite")),
+        dry_run=bool(event.get("dryRun")),
+        total_segments=event.get("totalSegments"),
+    )
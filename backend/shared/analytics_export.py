@@ -0,0 +1,362 @@
+import boto3
+import contextvars
+import gzip
+import json
+import math
+import os
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+from shared.config import get_logger
+from shared.db import library_table
+from shared.instrumentation import increment, span
+from shared.parallel_scan import scan_segment
+from shared.responses import DecimalEncoder
+from shared.spotify_client import LocalTokenBucket
+
+logger = get_logger(__name__)
+
+ANALYTICS_BUCKET = os.environ.get("ANALYTICS_BUCKET", "melodiary-analytics")
+# Read capacity the export may use per second, the rest is left for the app
+ANALYTICS_READ_CAPACITY_PER_SECOND = float(
+    os.environ.get("ANALYTICS_READ_CAPACITY_PER_SECOND", "200")
+)
+ANALYTICS_SEGMENTS = int(os.environ.get("ANALYTICS_SEGMENTS", "16"))
+ANALYTICS_WORKERS = int(os.environ.get("ANALYTICS_WORKERS", "8"))
+# Rows per columnar part; a checkpoint is written after each part
+ANALYTICS_PART_ROWS = int(os.environ.get("ANALYTICS_PART_ROWS", "50000"))
+# Items per Scan page, small pages keep the read rate smooth
+ANALYTICS_SCAN_PAGE_ITEMS = int(os.environ.get("ANALYTICS_SCAN_PAGE_ITEMS", "1000"))
+# An eventually consistent Scan page is at most 1 MB, 128 read units
+MAX_PAGE_READ_UNITS = 128
+
+# Exported library columns; deleted is derived from deletedAt
+EXPORT_COLUMNS = (
+    "userId",
+    "trackId",
+    "platform",
+    "artistName",
+    "albumName",
+    "releaseYear",
+    "duration",
+    "addedDate",
+    "isManual",
+    "deleted",
+)
+LIBRARY_SIZE_BUCKETS = (0, 10, 100, 1_000, 10_000, 100_000)
+
+_s3_client = None
+
+
+class ExportStopped(Exception):
+    """The time budget ran out; finished parts are checkpointed for a resume."""
+
+
+def _get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            "s3",
+            region_name=os.environ.get("AWS_REGION", "eu-central-1"),
+            endpoint_url=os.environ.get("S3_ENDPOINT") or None,
+        )
+    return _s3_client
+
+
+def _put_json(key, document, compress=True):
+    body = json.dumps(document, cls=DecimalEncoder, separators=(",", ":")).encode("utf-8")
+    kwargs = {"ContentType": "application/json"}
+    if compress:
+        body = gzip.compress(body, compresslevel=6)
+        kwargs["ContentEncoding"] = "gzip"
+    with span("s3.put_object"):
+        _get_s3_client().put_object(Bucket=ANALYTICS_BUCKET, Key=key, Body=body, **kwargs)
+
+
+def _get_json(key, compressed=True):
+    """Stored document, or None if there is none."""
+    try:
+        with span("s3.get_object"):
+            body = _get_s3_client().get_object(Bucket=ANALYTICS_BUCKET, Key=key)["Body"].read()
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            return None
+        raise
+    return json.loads(gzip.decompress(body) if compressed else body)
+
+
+def _prefix(run_id):
+    return f"analytics/{run_id}"
+
+
+def _checkpoint_key(run_id, segment):
+    return f"{_prefix(run_id)}/checkpoints/segment-{segment:04d}.json"
+
+
+def _part_key(run_id, segment, part):
+    return f"{_prefix(run_id)}/tracks/segment-{segment:04d}-part-{part:05d}.json.gz"
+
+
+def _users_key(run_id, segment):
+    return f"{_prefix(run_id)}/users/segment-{segment:04d}.json.gz"
+
+
+def _summary_key(run_id):
+    return f"{_prefix(run_id)}/summary.json"
+
+
+def new_run_id(now=None):
+    now = now or datetime.now(timezone.utc)
+    return f"{now:%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+
+
+def _add_user(users, item):
+    """Count a library item into its user's aggregate."""
+    user = users.get(item["userId"])
+    if user is None:
+        user = users[item["userId"]] = {"tracks": 0, "deleted": 0, "platforms": {}}
+    if "deletedAt" in item:
+        user["deleted"] += 1
+    else:
+        user["tracks"] += 1
+        platform = item.get("platform") or "unknown"
+        user["platforms"][platform] = user["platforms"].get(platform, 0) + 1
+
+
+def _merge_users(users, segment_users):
+    """Add a segment's per-user aggregates into the run's."""
+    for user_id, counts in segment_users.items():
+        user = users.get(user_id)
+        if user is None:
+            user = users[user_id] = {"tracks": 0, "deleted": 0, "platforms": {}}
+        user["tracks"] += counts["tracks"]
+        user["deleted"] += counts["deleted"]
+        for platform, count in counts["platforms"].items():
+            user["platforms"][platform] = user["platforms"].get(platform, 0) + count
+
+
+def _flush_part(run_id, segment, part, columns):
+    count = len(columns["userId"])
+    _put_json(
+        _part_key(run_id, segment, part),
+        {"segment": segment, "part": part, "count": count, "columns": columns},
+    )
+    increment("analytics.parts")
+    increment("analytics.rows", count)
+
+
+def export_segment(run_id, segment, total_segments, limiter, deadline=None):
+    """
+    Export one scan segment, resuming from its checkpoint
+
+    The per-user aggregates cover only the segment's items; run_export
+    merges those of every segment. Rows are buffered column by column and
+    written as a part every ANALYTICS_PART_ROWS rows, followed by a
+    checkpoint holding the scan position and the aggregates so far; a
+    resumed segment continues from the last checkpoint and rewrites nothing
+    before it. The deadline is checked after every scanned page, so a part
+    cut short by it is written early with its checkpoint.
+
+    Args:
+        run_id: Export run
+        segment: Segment number
+        total_segments: Total segments of the run
+        limiter: Token bucket of read capacity units, shared by all segments
+        deadline: time.monotonic() after which to stop at the next checkpoint
+
+    Returns:
+        Dict of userId -> {"tracks", "deleted", "platforms"} of the segment
+
+    Raises:
+        ExportStopped if the deadline passed first
+    """
+    checkpoint = _get_json(_checkpoint_key(run_id, segment), compressed=False) or {}
+    if checkpoint.get("done"):
+        return _get_json(_users_key(run_id, segment))
+
+    if deadline is not None and time.monotonic() >= deadline:
+        raise ExportStopped(f"Segment {segment} not started")
+
+    users = checkpoint.get("users", {})
+    part = checkpoint.get("part", 0)
+    columns = {name: [] for name in EXPORT_COLUMNS}
+
+    pages = scan_segment(
+        library_table,
+        segment,
+        total_segments,
+        start_key=checkpoint.get("lastKey"),
+        Limit=ANALYTICS_SCAN_PAGE_ITEMS,
+        ProjectionExpression="userId, trackId, platform, artistName, albumName, "
+        "releaseYear, #duration, addedDate, isManual, deletedAt",
+        ExpressionAttributeNames={"#duration": "duration"},
+    )
+    for items, last_key, consumed in pages:
+        # Paid after the fact, a page's cost is only known once it is read
+        limiter.acquire(min(max(consumed, 0.5), MAX_PAGE_READ_UNITS))
+        for item in items:
+            _add_user(users, item)
+            for name in EXPORT_COLUMNS[:-1]:
+                columns[name].append(item.get(name))
+            columns["deleted"].append("deletedAt" in item)
+
+        stopping = deadline is not None and time.monotonic() >= deadline
+        if last_key and not stopping and len(columns["userId"]) < ANALYTICS_PART_ROWS:
+            continue
+        if columns["userId"]:
+            _flush_part(run_id, segment, part, columns)
+            part += 1
+            columns = {name: [] for name in EXPORT_COLUMNS}
+        if not last_key:
+            break
+        _put_json(
+            _checkpoint_key(run_id, segment),
+            {"lastKey": last_key, "part": part, "users": users},
+            compress=False,
+        )
+        if stopping:
+            raise ExportStopped(f"Segment {segment} stopped at part {part}")
+
+    _put_json(_users_key(run_id, segment), users)
+    _put_json(_checkpoint_key(run_id, segment), {"done": True, "part": part}, compress=False)
+    logger.info("Exported analytics segment %d/%d (%d users)", segment, total_segments, len(users))
+    return users
+
+
+def _percentile(values, pct):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summarize(users):
+    """
+    Aggregate per-user library statistics
+
+    Args:
+        users: Dict of userId -> {"tracks", "deleted", "platforms"}
+
+    Returns:
+        Dict with user and track totals, per-platform track counts, the
+        library size distribution and the tombstone ratio distribution
+    """
+    sizes = sorted(user["tracks"] for user in users.values())
+    ratios = sorted(
+        user["deleted"] / (user["tracks"] + user["deleted"])
+        for user in users.values()
+        if user["tracks"] + user["deleted"]
+    )
+    platforms = Counter()
+    for user in users.values():
+        platforms.update(user["platforms"])
+
+    histogram = {}
+    bounds = LIBRARY_SIZE_BUCKETS + (None,)
+    for low, high in zip(bounds, bounds[1:]):
+        label = f"{low}-{high - 1}" if high is not None else f"{low}+"
+        histogram[label] = sum(1 for size in sizes if size >= low and (high is None or size < high))
+
+    return {
+        "users": len(users),
+        "tracks": sum(sizes),
+        "deletedTracks": sum(user["deleted"] for user in users.values()),
+        "platforms": dict(platforms),
+        "librarySize": {
+            "p50": _percentile(sizes, 50),
+            "p90": _percentile(sizes, 90),
+            "p99": _percentile(sizes, 99),
+            "max": sizes[-1] if sizes else 0,
+            "histogram": histogram,
+        },
+        "tombstoneRatio": {
+            "p50": _percentile(ratios, 50),
+            "p90": _percentile(ratios, 90),
+            "p99": _percentile(ratios, 99),
+            "usersOverHalf": sum(1 for ratio in ratios if ratio > 0.5),
+        },
+    }
+
+
+def run_export(
+    run_id=None,
+    total_segments=None,
+    max_workers=None,
+    read_capacity_per_second=None,
+    time_budget_seconds=None,
+):
+    """
+    Export the whole library table to S3 for analytics
+
+    Segments are scanned in parallel on a worker pool, all sharing one
+    token bucket of read capacity. Writes, under analytics/<runId>/ in
+    ANALYTICS_BUCKET:
+        tracks/segment-NNNN-part-NNNNN.json.gz  columnar rows
+        users/segment-NNNN.json.gz              per-user aggregates
+        checkpoints/segment-NNNN.json           resume positions
+        summary.json                            totals and distributions
+
+    Calling it again with the same run_id resumes it: finished segments are
+    skipped and the others continue from their last checkpoint.
+
+    Args:
+        run_id: Run to start or resume, a new one by default
+        total_segments: Scan segments (fixed for the life of a run)
+        max_workers: Segments scanned at once
+        read_capacity_per_second: Read capacity budget of the whole export
+        time_budget_seconds: Stop starting new parts after this long, e.g.
+            to finish within a Lambda invocation
+
+    Returns:
+        Dict with the runId, whether it is complete, and the summary once it is
+    """
+    run_id = run_id or new_run_id()
+    manifest = _get_json(f"{_prefix(run_id)}/manifest.json", compressed=False)
+    if manifest is None:
+        manifest = {
+            "runId": run_id,
+            "totalSegments": total_segments or ANALYTICS_SEGMENTS,
+            "startedAt": datetime.now(timezone.utc).isoformat(),
+            "columns": list(EXPORT_COLUMNS),
+        }
+        _put_json(f"{_prefix(run_id)}/manifest.json", manifest, compress=False)
+    total_segments = int(manifest["totalSegments"])
+
+    rate = read_capacity_per_second or ANALYTICS_READ_CAPACITY_PER_SECOND
+    limiter = LocalTokenBucket(rate, max(rate, MAX_PAGE_READ_UNITS))
+    deadline = None if time_budget_seconds is None else time.monotonic() + time_budget_seconds
+
+    users, stopped = {}, 0
+    with ThreadPoolExecutor(max_workers=max_workers or ANALYTICS_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                export_segment,
+                run_id,
+                segment,
+                total_segments,
+                limiter,
+                deadline,
+            )
+            for segment in range(total_segments)
+        ]
+        for future in futures:
+            try:
+                _merge_users(users, future.result())
+            except ExportStopped:
+                stopped += 1
+
+    if stopped:
+        logger.info("Analytics export %s paused with %d segments left", run_id, stopped)
+        return {"runId": run_id, "complete": False, "segmentsLeft": stopped}
+
+    summary = dict(summarize(users), runId=run_id, totalSegments=total_segments)
+    summary["finishedAt"] = datetime.now(timezone.utc).isoformat()
+    _put_json(_summary_key(run_id), summary, compress=False)
+    logger.info("Analytics export %s complete: %d users", run_id, summary["users"])
+    return {"runId": run_id, "complete": True, "summary": summary}
@@ -0,0 +1,180 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.config import get_logger
+from shared.db import get_audio_features, put_audio_features
+from shared.instrumentation import increment, span
+from shared.providers import get_provider
+from shared.token_manager import get_access_token, invalidate_if_rejected
+
+logger = get_logger(__name__)
+
+AUDIO_FEATURES_ENABLED = os.environ.get("AUDIO_FEATURES_ENABLED", "true").lower() == "true"
+# Feature batches requested at once per sync, within the app-wide rate limit
+AUDIO_FEATURES_CONCURRENCY = int(os.environ.get("AUDIO_FEATURES_CONCURRENCY", "4"))
+
+# Encoded order, with the decimals kept for each field
+AUDIO_FEATURE_FIELDS = (
+    ("tempo", 1),
+    ("energy", 2),
+    ("key", 0),
+    ("mode", 0),
+    ("danceability", 2),
+    ("valence", 2),
+    ("acousticness", 2),
+    ("instrumentalness", 2),
+    ("loudness", 1),
+    ("time_signature", 0),
+)
+
+
+def encode_features(features):
+    """
+    Compact form of an audio features object, stored on library rows and in
+    the shared features table
+
+    Comma-separated values in AUDIO_FEATURE_FIELDS order, rounded to what
+    sorting and filtering need: "120.1,0.73,5,1,0.52,0.4,0.01,0,-5.2,4".
+    An empty string means the platform has no features for the track.
+    """
+    if not features:
+        return ""
+    values = []
+    for name, decimals in AUDIO_FEATURE_FIELDS:
+        value = features.get(name)
+        if value is None:
+            values.append("")
+        elif decimals:
+            values.append(format(round(float(value), decimals), "g"))
+        else:
+            values.append(str(int(value)))
+    return ",".join(values)
+
+
+def decode_features(encoded):
+    """Inverse of encode_features, None for tracks without features."""
+    if not encoded:
+        return None
+    return {
+        name: (float(value) if decimals else int(value)) if value else None
+        for (name, decimals), value in zip(AUDIO_FEATURE_FIELDS, encoded.split(","))
+    }
+
+
+def _fetch(user_id, provider, track_ids):
+    """
+    Fetch features from a provider in batches of its maximum size
+
+    Args:
+        user_id: User whose token pays for the calls
+        provider: LibraryProvider with audio features
+        track_ids: Dict of library track ID -> platform track ID
+
+    Returns:
+        Dict of library track ID -> encoded features, for the batches that
+        succeeded
+    """
+    access_token, error = get_access_token(user_id, provider.name)
+    if error:
+        logger.warning(
+            "No %s token to fetch audio features for user %s: %s", provider.name, user_id, error
+        )
+        return {}
+
+    by_platform_id = {platform_id: track_id for track_id, platform_id in track_ids.items()}
+    platform_ids = list(by_platform_id)
+    size = provider.features_batch_size
+    chunks = [platform_ids[start : start + size] for start in range(0, len(platform_ids), size)]
+
+    def fetch(chunk):
+        try:
+            result = provider.fetch_audio_features(access_token, chunk)
+        except Exception as e:
+            # Enrichment is best effort, these tracks are tried again next sync
+            invalidate_if_rejected(user_id, provider.name, e)
+            logger.warning(
+                "Audio features batch of %d failed on %s: %s", len(chunk), provider.name, e
+            )
+            increment("features.failed", len(chunk))
+            return {}
+        # Encoded right away, the full feature objects are much larger
+        return {
+            by_platform_id[platform_id]: encode_features(features)
+            for platform_id, features in result.items()
+        }
+
+    fetched = {}
+    workers = max(1, min(AUDIO_FEATURES_CONCURRENCY, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(
+            lambda chunk: contextvars.copy_context().run(fetch, chunk), chunks
+        ):
+            fetched.update(result)
+    return fetched
+
+
+def enrich_batch(user_id, batch, state):
+    """
+    Fill in the audioFeatures column of a fetched library
+
+    Features are taken, in order, from the user's stored rows, from the
+    features table shared by all users, and only then from the platform in
+    batches of its maximum size. New features are added to the shared
+    table, so overlapping libraries are enriched without platform calls.
+
+    Args:
+        user_id: User ID
+        batch: TrackBatch about to be stored
+        state: get_library_state of the user's library
+
+    Returns:
+        Dict with the numbers of tracks found in the library, found in the
+        shared table and fetched
+    """
+    columns = batch.columns
+    features = columns["audioFeatures"]
+    stats = {"library": 0, "shared": 0, "fetched": 0}
+
+    missing = {}
+    for i, track_id in enumerate(columns["trackId"]):
+        known = state.get(track_id)
+        if known and known[1]:
+            # Soft-deleted, never written again
+            continue
+        if known and known[2] is not None:
+            features[i] = known[2]
+            stats["library"] += 1
+            continue
+        provider = get_provider(columns["platform"][i])
+        if provider and provider.features_batch_size and columns["platformTrackId"][i]:
+            missing.setdefault(provider.name, {})[track_id] = columns["platformTrackId"][i]
+
+    if missing:
+        with span("features.enrich"):
+            found = get_audio_features(
+                [track_id for track_ids in missing.values() for track_id in track_ids]
+            )
+            stats["shared"] = len(found)
+            for platform, track_ids in missing.items():
+                to_fetch = {
+                    track_id: platform_id
+                    for track_id, platform_id in track_ids.items()
+                    if track_id not in found
+                }
+                if not to_fetch:
+                    continue
+                fetched = _fetch(user_id, get_provider(platform), to_fetch)
+                if fetched:
+                    put_audio_features(fetched)
+                stats["fetched"] += len(fetched)
+                found.update(fetched)
+
+        for i, track_id in enumerate(columns["trackId"]):
+            if features[i] is None and track_id in found:
+                features[i] = found[track_id]
+
+    increment("features.library_hits", stats["library"])
+    increment("features.shared_hits", stats["shared"])
+    increment("features.fetched", stats["fetched"])
+    return stats
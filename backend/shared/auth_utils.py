@@ -2,6 +2,7 @@ import jwt
 from datetime import datetime, timedelta, timezone
 
 from shared.config import get_secret, get_logger
+from shared.instrumentation import increment, timed
 
 logger = get_logger(__name__)
 
@@ -12,6 +13,7 @@ BEARER_PREFIX = "Bearer "
 BEARER_PREFIX_LEN = len(BEARER_PREFIX)
 
 
+@timed("jwt.generate")
 def generate_jwt(user_id, email):
     """
     Generate a JWT token for user
@@ -34,6 +36,7 @@ def generate_jwt(user_id, email):
     return token
 
 
+@timed("jwt.verify")
 def verify_jwt(token):
     """
     Verify and decode JWT token
@@ -67,6 +70,9 @@ def require_auth(lambda_handler):
     """
     Decorator to require authentication for Lambda functions
 
+    Requests over the user's limit for the route (see
+    shared/request_limits.py) get 429 with Retry-After instead.
+
     Usage:
         @require_auth
         def lambda_handler(event, context):
@@ -94,6 +100,15 @@ def require_auth(lambda_handler):
         if user_id:
             event["userId"] = user_id
 
+            from shared.request_limits import check_request
+
+            retry_after = check_request(user_id, event)
+            if retry_after:
+                from shared.responses import rate_limited_response
+
+                increment("ratelimit.rejected")
+                return rate_limited_response(retry_after)
+
         user_email = payload.get("email")
         if user_email:
             event["userEmail"] = user_email
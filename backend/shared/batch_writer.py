@@ -0,0 +1,222 @@
+import boto3
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from shared.config import get_logger
+from shared.instrumentation import increment, record_capacity
+
+logger = get_logger(__name__)
+
+MAX_BATCH_SIZE = 25  # DynamoDB BatchWriteItem limit
+DEFAULT_MAX_WORKERS = int(os.environ.get("BATCH_WRITE_MAX_WORKERS", "8"))
+DEFAULT_MAX_RETRIES = int(os.environ.get("BATCH_WRITE_MAX_RETRIES", "8"))
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 5.0
+# Clean batches needed before concurrency is raised by one again
+INCREASE_AFTER_SUCCESSES = 4
+
+THROTTLING_ERROR_CODES = frozenset(
+    {
+        "ProvisionedThroughputExceededException",
+        "ThrottlingException",
+        "RequestLimitExceeded",
+    }
+)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit that backs off on throttling (AIMD).
+
+    The limit is halved on every throttle signal and grows by one after a
+    run of clean batches, so writers settle just under the table's capacity.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = max_limit
+        self.lowest_limit = max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= INCREASE_AFTER_SUCCESSES and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.lowest_limit = min(self.lowest_limit, self.limit)
+            self._successes = 0
+
+
+class ParallelBatchWriter:
+    """
+    Sends BatchWriteItem requests for one table from a bounded thread pool.
+
+    Unlike boto3's `batch_writer`, batches go out concurrently, unprocessed
+    items are retried with exponential backoff, concurrency adapts to
+    throttling, and consumed capacity and retry counts are reported back.
+
+    Usage:
+        writer = ParallelBatchWriter("Melodiary-UserLibrary")
+        stats = writer.put_items(items)
+    """
+
+    def __init__(
+        self,
+        table_name,
+        client=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+        max_retries=DEFAULT_MAX_RETRIES,
+    ):
+        self.table_name = table_name
+        self.client = client or boto3.resource(
+            "dynamodb", region_name=os.environ.get("AWS_REGION", "eu-central-1")
+        ).meta.client
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+
+    def put_items(self, items):
+        """Write items (plain Python values). Returns write stats."""
+        return self.write([{"PutRequest": {"Item": item}} for item in items])
+
+    def delete_keys(self, keys):
+        """Delete items by primary key. Returns write stats."""
+        return self.write([{"DeleteRequest": {"Key": key}} for key in keys])
+
+    def write(self, write_requests):
+        """
+        Write a list of BatchWriteItem requests
+
+        Args:
+            write_requests: List of {"PutRequest": ...} / {"DeleteRequest": ...}
+
+        Returns:
+            Dict with written/failed counts, batches, retries, throttle events,
+            consumed write capacity and the concurrency the writer settled on
+        """
+        stats = {
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "retries": 0,
+            "throttleEvents": 0,
+            "consumedCapacity": 0.0,
+            "maxConcurrency": self.max_workers,
+            "finalConcurrency": self.max_workers,
+            "lowestConcurrency": self.max_workers,
+        }
+        if not write_requests:
+            return stats
+
+        batches = [
+            write_requests[i : i + MAX_BATCH_SIZE]
+            for i in range(0, len(write_requests), MAX_BATCH_SIZE)
+        ]
+        concurrency = AdaptiveConcurrency(min(self.max_workers, len(batches)))
+        stats_lock = threading.Lock()
+
+        with ThreadPoolExecutor(max_workers=concurrency.max_limit) as executor:
+            # Copy the caller's context so worker threads report to its invocation
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self._send_batch,
+                    batch,
+                    concurrency,
+                    stats,
+                    stats_lock,
+                )
+                for batch in batches
+            ]
+            for future in futures:
+                future.result()
+
+        stats["maxConcurrency"] = concurrency.max_limit
+        stats["finalConcurrency"] = concurrency.limit
+        stats["lowestConcurrency"] = concurrency.lowest_limit
+        if stats["failed"]:
+            # Callers get the count in the stats and decide what a loss means
+            increment("batch_writer.failed_items", stats["failed"])
+            logger.error(
+                "%d items could not be written to %s after %d retries",
+                stats["failed"],
+                self.table_name,
+                self.max_retries,
+            )
+        return stats
+
+    def _send_batch(self, batch, concurrency, stats, stats_lock):
+        pending = batch
+        attempt = 0
+        while True:
+            throttled = False
+            concurrency.acquire()
+            try:
+                response = self.client.batch_write_item(
+                    RequestItems={self.table_name: pending},
+                    ReturnConsumedCapacity="TOTAL",
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in THROTTLING_ERROR_CODES:
+                    raise
+                throttled = True
+                unprocessed = pending
+                capacity = 0.0
+            else:
+                record_capacity("write", response)
+                unprocessed = response.get("UnprocessedItems", {}).get(self.table_name, [])
+                capacity = sum(
+                    c.get("CapacityUnits", 0.0)
+                    for c in response.get("ConsumedCapacity", [])
+                )
+                throttled = bool(unprocessed)
+            finally:
+                concurrency.release()
+
+            with stats_lock:
+                stats["batches"] += 1
+                stats["consumedCapacity"] += capacity
+                stats["written"] += len(pending) - len(unprocessed)
+                if throttled:
+                    stats["throttleEvents"] += 1
+
+            if not unprocessed:
+                concurrency.on_success()
+                return
+
+            concurrency.on_throttle()
+            if attempt >= self.max_retries:
+                with stats_lock:
+                    stats["failed"] += len(unprocessed)
+                return
+
+            with stats_lock:
+                stats["retries"] += 1
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt)))
+            pending = unprocessed
+            attempt += 1
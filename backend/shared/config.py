@@ -52,8 +52,11 @@ def get_secret(name):
     client = _get_ssm_client()
     param_path = f"{SSM_PREFIX}/{name}"
     logger = get_logger(__name__)
+    from shared.instrumentation import span
+
     try:
-        response = client.get_parameter(Name=param_path, WithDecryption=True)
+        with span("ssm.get_parameter"):
+            response = client.get_parameter(Name=param_path, WithDecryption=True)
     except client.exceptions.ParameterNotFound:
         logger.error("SSM parameter not found: %s", param_path)
         return None
@@ -63,3 +66,36 @@ def get_secret(name):
     value = response["Parameter"]["Value"]
     _cache[name] = value
     return value
+
+
+def preload_secrets(*names):
+    """
+    Fetch several secrets in one SSM call and cache them for get_secret
+
+    Names that are already cached are skipped. Missing parameters are
+    logged and left for get_secret to report.
+
+    Args:
+        names: Parameter names, as passed to get_secret
+    """
+    missing = [name for name in dict.fromkeys(names) if name not in _cache]
+    if not missing:
+        return
+
+    client = _get_ssm_client()
+    logger = get_logger(__name__)
+    from shared.instrumentation import span
+
+    # GetParameters accepts at most 10 names per call
+    for start in range(0, len(missing), 10):
+        paths = {f"{SSM_PREFIX}/{name}": name for name in missing[start : start + 10]}
+        try:
+            with span("ssm.get_parameters"):
+                response = client.get_parameters(Names=list(paths), WithDecryption=True)
+        except Exception as e:
+            logger.error("Failed to preload SSM parameters %s: %s", ", ".join(paths), e)
+            continue
+        for parameter in response["Parameters"]:
+            _cache[paths[parameter["Name"]]] = parameter["Value"]
+        for path in response.get("InvalidParameters", []):
+            logger.error("SSM parameter not found: %s", path)
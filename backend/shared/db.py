@@ -1,34 +1,220 @@
 import boto3
 import os
+import re
+import time
 import uuid
+from decimal import Decimal
 from datetime import datetime, timezone
 
+from shared.batch_writer import ParallelBatchWriter
+from shared.config import get_logger
+from shared.instrumentation import increment, record_capacity, timed
+from shared.read_cache import TTLCache
+from shared.track_batch import TrackBatch
+
+logger = get_logger(__name__)
+
 dynamodb = boto3.resource(
-    "dynamodb", region_name=os.environ.get("AWS_REGION", "eu-central-1")
+    "dynamodb",
+    region_name=os.environ.get("AWS_REGION", "eu-central-1"),
+    # e.g. DynamoDB Local for development, unset in Lambda
+    endpoint_url=os.environ.get("DYNAMODB_ENDPOINT") or None,
 )
 
 # Table references
 users_table = dynamodb.Table("Melodiary-Users")
 connections_table = dynamodb.Table("Melodiary-PlatformConnections")
 library_table = dynamodb.Table("Melodiary-UserLibrary")
+changes_table = dynamodb.Table("Melodiary-LibraryChanges")
+identities_table = dynamodb.Table("Melodiary-Identities")
+audio_features_table = dynamodb.Table("Melodiary-AudioFeatures")
+friends_table = dynamodb.Table("Melodiary-Friends")
+rate_limits_table = dynamodb.Table("Melodiary-RateLimits")
+user_data_table = dynamodb.Table("Melodiary-UserData")
 
+library_writer = ParallelBatchWriter(library_table.name, client=dynamodb.meta.client)
+changes_writer = ParallelBatchWriter(changes_table.name, client=dynamodb.meta.client)
+audio_features_writer = ParallelBatchWriter(
+    audio_features_table.name, client=dynamodb.meta.client
+)
 
-def create_user(email, display_name, spotify_id, has_real_email):
+# How long library changes stay readable; entries are deleted by TTL a day later
+CHANGE_LOG_RETENTION_SECONDS = int(os.environ.get("CHANGE_LOG_RETENTION_DAYS", "14")) * 86400
+CHANGE_LOG_TTL_SECONDS = CHANGE_LOG_RETENTION_SECONDS + 86400
+# Larger change sets (e.g. a first import) are logged as one "reset" entry:
+# clients reload the snapshot rather than replay thousands of entries
+CHANGE_LOG_MAX_ENTRIES = int(os.environ.get("CHANGE_LOG_MAX_ENTRIES", "500"))
+# Attributes that are bookkeeping rather than track data
+_INTERNAL_TRACK_ATTRIBUTES = ("userId", "contentHash")
+
+# User and connection rows change rarely but are read by most requests.
+# Writes made here invalidate them; writes by other containers show up
+# within the TTL. Set either setting to 0 to disable the caches.
+READ_CACHE_TTL_SECONDS = float(os.environ.get("READ_CACHE_TTL_SECONDS", "60"))
+READ_CACHE_MAX_ENTRIES = int(os.environ.get("READ_CACHE_MAX_ENTRIES", "1000"))
+user_cache = TTLCache("user", READ_CACHE_MAX_ENTRIES, READ_CACHE_TTL_SECONDS)
+connection_cache = TTLCache("connection", READ_CACHE_MAX_ENTRIES, READ_CACHE_TTL_SECONDS)
+
+
+# Where user profiles and platform connections are read and written:
+#   "tables" - Melodiary-Users and Melodiary-PlatformConnections
+#   "dual"   - read from those, every write copied to Melodiary-UserData
+#   "single" - read from Melodiary-UserData, every write copied back
+# Melodiary-UserData keeps a user's profile (sort key PROFILE) and
+# connections (CONNECTION#<platform>) in one partition, so both load with
+# one Query.
+USER_DATA_LAYOUT = os.environ.get("USER_DATA_LAYOUT", "tables")
+PROFILE_SK = "PROFILE"
+CONNECTION_SK_PREFIX = "CONNECTION#"
+
+
+def clear_read_caches():
+    """Empty the user and connection caches, e.g. between test runs."""
+    user_cache.clear()
+    connection_cache.clear()
+
+
+def _by_layout(legacy, single):
+    if USER_DATA_LAYOUT == "single":
+        return [single, legacy]
+    if USER_DATA_LAYOUT == "dual":
+        return [legacy, single]
+    return [legacy]
+
+
+def _profile_rows(user_id):
+    """(table, key) of a user's profile in every table it is written to, the one read first."""
+    return _by_layout(
+        (users_table, {"userId": user_id}),
+        (user_data_table, {"userId": user_id, "sk": PROFILE_SK}),
+    )
+
+
+def _connection_rows(user_id, platform):
+    """(table, key) of a connection in every table it is written to, the one read first."""
+    return _by_layout(
+        (connections_table, {"userId": user_id, "platform": platform}),
+        (user_data_table, {"userId": user_id, "sk": CONNECTION_SK_PREFIX + platform}),
+    )
+
+
+def _row_item(item):
+    """A profile or connection item as the separate tables store it."""
+    if item is not None:
+        item.pop("sk", None)
+    return item
+
+
+def _put_version():
     """
-    Create a new user
+    rowVersion of a profile or connection written whole: the time in
+    microseconds, above the update count of any row it replaces
+    """
+    return int(time.time() * 1_000_000)
 
-    Args:
-        email: User email
-        display_name: Display name
-        spotify_id: Optional Spotify user ID
-        has_real_email: Whether email is real or generated
+
+def _versioned(update_kwargs):
+    """UpdateItem kwargs of a profile or connection that also count the write in rowVersion."""
+    expression = update_kwargs["UpdateExpression"]
+    if re.search(r"\bADD\b", expression):
+        expression = re.sub(r"\bADD\b", "ADD rowVersion :rowVersionStep,", expression, count=1)
+    else:
+        expression += " ADD rowVersion :rowVersionStep"
+    return {
+        **update_kwargs,
+        "UpdateExpression": expression,
+        "ExpressionAttributeValues": {
+            **update_kwargs.get("ExpressionAttributeValues", {}),
+            ":rowVersionStep": 1,
+        },
+    }
+
+
+def put_if_newer(table, item):
+    """
+    Write a copy of a profile or connection unless the table already holds
+    the same or a newer rowVersion of it
 
     Returns:
-        Created user object
+        True if the copy was written, False if it was stale
+    """
+    try:
+        response = table.put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(rowVersion) OR rowVersion < :rowVersion",
+            ExpressionAttributeValues={":rowVersion": item.get("rowVersion", 0)},
+            ReturnConsumedCapacity="TOTAL",
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    record_capacity("write", response)
+    return True
+
+
+def _mirror(item, mirrors):
+    """
+    Copy the new image of a profile or connection to its other tables
+
+    Every write raises the row's rowVersion and copies only replace older
+    versions, so concurrent writes whose copies land out of order leave the
+    newest. Best effort: rows whose copy failed are found and repaired by
+    the backfill with overwrite.
+    """
+    for table, key in mirrors:
+        try:
+            if not put_if_newer(table, {**_row_item(dict(item)), **key}):
+                increment("user_data.mirror_stale")
+        except Exception as e:
+            logger.error("Failed to copy %s to %s: %s", key, table.name, e)
+            increment("user_data.mirror_failures")
+
+
+def _mirror_current(rows):
+    """Copy a row written in a transaction, which returns no image, to its other tables."""
+    (table, key), mirrors = rows[0], rows[1:]
+    if not mirrors:
+        return
+    try:
+        response = table.get_item(Key=key, ConsistentRead=True, ReturnConsumedCapacity="TOTAL")
+        record_capacity("read", response)
+    except Exception as e:
+        logger.error("Failed to read %s from %s for copying: %s", key, table.name, e)
+        increment("user_data.mirror_failures")
+        return
+    if "Item" in response:
+        _mirror(response["Item"], mirrors)
+
+
+def _update_row(rows, **update_kwargs):
+    """
+    UpdateItem on the first of rows, its new image copied to the others
+
+    Returns:
+        Response of the first update; with copies, Attributes holds the
+        whole new item
     """
-    user_id = str(uuid.uuid4())
+    (table, key), mirrors = rows[0], rows[1:]
+    update_kwargs = _versioned(update_kwargs)
+    if mirrors:
+        update_kwargs["ReturnValues"] = "ALL_NEW"
+    response = table.update_item(Key=key, **update_kwargs)
+    if mirrors:
+        _mirror(response["Attributes"], mirrors)
+    return response
+
+
+def _put_row(rows, item, **put_kwargs):
+    """PutItem on the first of rows, copied to the others."""
+    (table, key), mirrors = rows[0], rows[1:]
+    item = {**item, "rowVersion": _put_version()}
+    response = table.put_item(Item={**item, **key}, **put_kwargs)
+    _mirror(item, mirrors)
+    return response
+
+
+def _new_user_item(email, display_name, spotify_id, has_real_email):
     user = {
-        "userId": user_id,
+        "userId": str(uuid.uuid4()),
         "email": email,
         "displayName": display_name or email.split("@")[0],
         "createdAt": datetime.now(timezone.utc).isoformat(),
@@ -41,15 +227,50 @@ def create_user(email, display_name, spotify_id, has_real_email):
 
     if spotify_id:
         user["spotifyId"] = spotify_id
+    return user
+
+
+@timed("db.create_user")
+def create_user(email, display_name, spotify_id, has_real_email):
+    """
+    Create a new user
+
+    Args:
+        email: User email
+        display_name: Display name
+        spotify_id: Optional Spotify user ID
+        has_real_email: Whether email is real or generated
 
-    users_table.put_item(Item=user)
+    Returns:
+        Created user object
+    """
+    user = _new_user_item(email, display_name, spotify_id, has_real_email)
+    response = _put_row(_profile_rows(user["userId"]), user, ReturnConsumedCapacity="TOTAL")
+    record_capacity("write", response)
     return user
 
 
-def get_user(user_id):
-    """Get user by ID"""
-    response = users_table.get_item(Key={"userId": user_id})
-    return response.get("Item")
+@timed("db.get_user")
+def get_user(user_id, cached=True):
+    """
+    Get user by ID
+
+    Args:
+        user_id: User ID
+        cached: Serve it from the in-container cache when possible
+    """
+    if cached:
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+
+    generation = user_cache.generation
+    table, key = _profile_rows(user_id)[0]
+    response = table.get_item(Key=key, ReturnConsumedCapacity="TOTAL")
+    record_capacity("read", response)
+    user = _row_item(response.get("Item"))
+    user_cache.put(user_id, user, generation)
+    return user
 
 
 def get_value_from_db(table, filter, expression_values):
@@ -72,11 +293,13 @@ def get_value_from_db(table, filter, expression_values):
         scan_kwargs = {
             "FilterExpression": filter,
             "ExpressionAttributeValues": expression_values,
+            "ReturnConsumedCapacity": "TOTAL",
         }
         if last_key:
             scan_kwargs["ExclusiveStartKey"] = last_key
 
         response = table.scan(**scan_kwargs)
+        record_capacity("read", response)
 
         items = response.get("Items", [])
         if items:
@@ -86,6 +309,7 @@ def get_value_from_db(table, filter, expression_values):
             return None
 
 
+@timed("db.get_user_by_email")
 def get_user_by_email(email):
     """
     Gets user object by email (requires scanning)
@@ -99,6 +323,7 @@ def get_user_by_email(email):
     return get_value_from_db(users_table, "email = :email", {":email": email})
 
 
+@timed("db.get_user_by_spotify_id")
 def get_user_by_spotify_id(spotify_id):
     """
     Get user by Spotify ID (requires scanning)
@@ -114,6 +339,7 @@ def get_user_by_spotify_id(spotify_id):
     )
 
 
+@timed("db.link_spotify_id_to_user")
 def link_spotify_id_to_user(user_id: str, spotify_id: str) -> None:
     """
     Link a Spotify ID to an existing user
@@ -122,23 +348,17 @@ def link_spotify_id_to_user(user_id: str, spotify_id: str) -> None:
         user_id: User ID
         spotify_id: Spotify user ID
     """
-    users_table.update_item(
-        Key={"userId": user_id},
+    response = _update_row(
+        _profile_rows(user_id),
         UpdateExpression="SET spotifyId = :spotifyId",
         ExpressionAttributeValues={":spotifyId": spotify_id},
+        ReturnConsumedCapacity="TOTAL",
     )
+    record_capacity("write", response)
+    user_cache.invalidate(user_id)
 
 
-def save_platform_connection(user_id, platform, tokens, profile_data):
-    """
-    Save platform connection tokens
-
-    Args:
-        user_id: User ID
-        platform: Platform name
-        tokens: Token data from OAuth
-        profile_data: Optional profile data from platform
-    """
+def _connection_item(user_id, platform, tokens, profile_data):
     if "access_token" not in tokens:
         raise ValueError("tokens must contain 'access_token'")
 
@@ -158,155 +378,1381 @@ def save_platform_connection(user_id, platform, tokens, profile_data):
 
         if profile_data.get("email"):
             item["email"] = profile_data.get("email")
+    return item
 
-    connections_table.put_item(Item=item)
 
+@timed("db.save_platform_connection")
+def save_platform_connection(user_id, platform, tokens, profile_data):
+    """
+    Save platform connection tokens
 
-def get_platform_connection(user_id, platform):
-    """Get platform connection"""
-    response = connections_table.get_item(Key={"userId": user_id, "platform": platform})
-    return response.get("Item")
+    Args:
+        user_id: User ID
+        platform: Platform name
+        tokens: Token data from OAuth
+        profile_data: Optional profile data from platform
+    """
+    item = _connection_item(user_id, platform, tokens, profile_data)
+    response = _put_row(
+        _connection_rows(user_id, platform), item, ReturnConsumedCapacity="TOTAL"
+    )
+    record_capacity("write", response)
+    connection_cache.invalidate((user_id, platform))
 
 
-def update_platform_tokens(user_id, platform, tokens):
+@timed("db.update_platform_connection")
+def update_platform_connection(user_id, platform, tokens, profile_data):
     """
-    Update platform tokens for refresh purposes
+    Store new tokens and profile fields of a connection from a fresh login
+
+    Unlike save_platform_connection, this leaves the rest of the row alone:
+    sync and refresh leases, last sync results and activity survive, so a
+    login neither cancels a running sync nor resets the debounce and the
+    scheduler's staleness ranking.
 
     Args:
         user_id: User ID
-        platform: Platform type
-        tokens: New token data
+        platform: Platform name
+        tokens: Token data from OAuth
+        profile_data: Optional profile data from platform
     """
-    if "access_token" not in tokens:
-        raise ValueError("Tokens must contain 'access_token'")
+    item = _connection_item(user_id, platform, tokens, profile_data)
+    connected_at = item.pop("connectedAt")
+    if item["refreshToken"] is None:
+        # Keep the stored refresh token when the grant did not rotate it
+        item.pop("refreshToken")
 
-    update_parts = ["accessToken = :access", "expiresAt = :expires"]
-    expr_values = {
-        ":access": tokens["access_token"],
-        ":expires": tokens.get("expires_at"),
-    }
-    refresh_token = tokens.get("refresh_token")
-    if refresh_token:
-        update_parts.append("refreshToken = :refresh")
-        expr_values[":refresh"] = refresh_token
+    parts = ["connectedAt = if_not_exists(connectedAt, :connectedAt)"]
+    names = {}
+    values = {":connectedAt": connected_at}
+    fields = {k: v for k, v in item.items() if k not in ("userId", "platform")}
+    for i, (name, value) in enumerate(fields.items()):
+        parts.append(f"#a{i} = :a{i}")
+        names[f"#a{i}"] = name
+        values[f":a{i}"] = value
 
-    connections_table.update_item(
-        Key={"userId": user_id, "platform": platform},
-        UpdateExpression=f"SET {",".join(update_parts)}",
-        ExpressionAttributeValues=expr_values,
+    response = _update_row(
+        _connection_rows(user_id, platform),
+        UpdateExpression=f"SET {', '.join(parts)}",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnConsumedCapacity="TOTAL",
     )
+    record_capacity("write", response)
+    connection_cache.invalidate((user_id, platform))
 
 
-def soft_delete_track(user_id, track_id):
+def identity_id(kind, value):
+    """Key of an Identities item, e.g. ("spotify", "abc") -> "spotify#abc"."""
+    return f"{kind}#{value}"
+
+
+@timed("db.get_identities")
+def get_identities(*keys):
     """
-    Soft-delete a track by setting deletedAt timestamp.
+    Look up the users external identities belong to, in one round trip
 
     Args:
-        user_id: User ID
-        track_id: Track ID
+        keys: (kind, value) pairs such as ("spotify", spotify_id) or
+            ("email", email)
 
     Returns:
-        True if the track existed and was deleted, False otherwise
+        Dict of (kind, value) -> user ID for the identities that exist
+    """
+    ids = {identity_id(kind, value): (kind, value) for kind, value in keys}
+    if not ids:
+        return {}
+
+    request = {identities_table.name: {"Keys": [{"identityId": i} for i in ids]}}
+    found = {}
+    while request:
+        response = dynamodb.batch_get_item(
+            RequestItems=request, ReturnConsumedCapacity="TOTAL"
+        )
+        record_capacity("read", response)
+        for item in response["Responses"].get(identities_table.name, []):
+            found[ids[item["identityId"]]] = item["userId"]
+        request = response.get("UnprocessedKeys")
+    return found
+
+
+def _put(table, item, condition=None, values=None):
+    # The resource's client serializes plain Python values like the tables do
+    put = {"TableName": table.name, "Item": item}
+    if condition:
+        put["ConditionExpression"] = condition
+    if values:
+        put["ExpressionAttributeValues"] = values
+    return {"Put": put}
+
+
+def _row_puts(rows, item, condition=None):
+    """Transaction Puts of a profile or connection to every table of rows, conditional on the first."""
+    item = {**item, "rowVersion": _put_version()}
+    return [
+        _put(table, {**item, **key}, condition if i == 0 else None)
+        for i, (table, key) in enumerate(rows)
+    ]
+
+
+def _identity_puts(user_id, identities, now):
+    # Idempotent: re-linking an identity to the same user succeeds
+    return [
+        _put(
+            identities_table,
+            {"identityId": identity_id(kind, value), "userId": user_id, "linkedAt": now},
+            "attribute_not_exists(identityId) OR userId = :userId",
+            {":userId": user_id},
+        )
+        for kind, value in identities
+    ]
+
+
+def _transact(items):
+    """
+    Run a TransactWriteItems call
+
+    Returns:
+        True if it committed, False if a condition check failed
     """
+    client = dynamodb.meta.client
     try:
-        library_table.update_item(
-            Key={"userId": user_id, "trackId": track_id},
-            UpdateExpression="SET deletedAt = :deletedAt",
-            ConditionExpression="attribute_exists(trackId) AND attribute_not_exists(deletedAt)",
-            ExpressionAttributeValues={
-                ":deletedAt": datetime.now(timezone.utc).isoformat(),
-            },
+        response = client.transact_write_items(
+            TransactItems=items, ReturnConsumedCapacity="TOTAL"
         )
-        return True
-    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
-        return False
+    except client.exceptions.TransactionCanceledException as e:
+        reasons = [r.get("Code") for r in e.response.get("CancellationReasons", [])]
+        if "ConditionalCheckFailed" in reasons:
+            return False
+        raise
+    record_capacity("write", response)
+    return True
 
 
-def save_tracks(user_id, tracks):
+@timed("db.create_spotify_user")
+def create_spotify_user(email, display_name, spotify_id, has_real_email, tokens, profile_data):
     """
-    Batch save tracks to user library.
-    Skips tracks that have been soft-deleted by the user.
+    Create a user together with its identities and Spotify connection, in
+    one transaction
+
+    Identities (the Spotify account, and the email if it is real) are
+    claimed with conditional puts, so concurrent logins of the same account
+    cannot create two users.
+
+    Args:
+        email: User email
+        display_name: Display name
+        spotify_id: Spotify user ID
+        has_real_email: Whether email is real or generated
+        tokens: Token data from OAuth
+        profile_data: Optional profile data from Spotify
+
+    Returns:
+        Created user object, or None if one of the identities already
+        belongs to another user
+    """
+    user = _new_user_item(email, display_name, spotify_id, has_real_email)
+    identities = [("spotify", spotify_id)]
+    if has_real_email:
+        identities.append(("email", email))
+
+    items = _identity_puts(user["userId"], identities, user["createdAt"])
+    items.extend(_row_puts(_profile_rows(user["userId"]), user, "attribute_not_exists(userId)"))
+    items.extend(
+        _row_puts(
+            _connection_rows(user["userId"], "spotify"),
+            _connection_item(user["userId"], "spotify", tokens, profile_data),
+        )
+    )
+    return user if _transact(items) else None
+
+
+@timed("db.link_spotify_user")
+def link_spotify_user(user_id, spotify_id, email, tokens, profile_data):
+    """
+    Link a Spotify account (and email) to an existing user and save the
+    Spotify connection, in one transaction
+
+    Args:
+        user_id: User ID
+        spotify_id: Spotify user ID
+        email: Optional real email to link as well
+        tokens: Token data from OAuth
+        profile_data: Optional profile data from Spotify
+
+    Returns:
+        True if linked, False if an identity belongs to another user or the
+        user does not exist
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    identities = [("spotify", spotify_id)]
+    if email:
+        identities.append(("email", email))
+
+    items = _identity_puts(user_id, identities, now)
+    rows = _profile_rows(user_id)
+    table, key = rows[0]
+    items.append(
+        {
+            "Update": _versioned(
+                {
+                    "TableName": table.name,
+                    "Key": key,
+                    "UpdateExpression": "SET spotifyId = :spotifyId",
+                    "ConditionExpression": "attribute_exists(userId)",
+                    "ExpressionAttributeValues": {":spotifyId": spotify_id},
+                }
+            )
+        }
+    )
+    items.extend(
+        _row_puts(
+            _connection_rows(user_id, "spotify"),
+            _connection_item(user_id, "spotify", tokens, profile_data),
+        )
+    )
+    linked = _transact(items)
+    if linked:
+        _mirror_current(rows)
+    user_cache.invalidate(user_id)
+    connection_cache.invalidate((user_id, "spotify"))
+    return linked
+
+
+@timed("db.get_platform_connection")
+def get_platform_connection(user_id, platform, consistent=False, cached=True):
+    """
+    Get platform connection
+
+    Args:
+        user_id: User ID
+        platform: Platform type
+        consistent: Use a strongly consistent read, never served from cache
+        cached: Serve it from the in-container cache when possible. Tokens
+            of a cached connection may have been refreshed by another
+            container since, use token_manager.get_access_token for those.
+    """
+    key = (user_id, platform)
+    if cached and not consistent:
+        connection = connection_cache.get(key)
+        if connection is not None:
+            return connection
+
+    generation = connection_cache.generation
+    table, row_key = _connection_rows(user_id, platform)[0]
+    response = table.get_item(
+        Key=row_key, ConsistentRead=consistent, ReturnConsumedCapacity="TOTAL"
+    )
+    record_capacity("read", response)
+    connection = _row_item(response.get("Item"))
+    connection_cache.put(key, connection, generation)
+    return connection
+
+
+@timed("db.get_platform_connections")
+def get_platform_connections(user_id):
+    """
+    Get all platform connections of a user
 
     Args:
         user_id: User ID
-        tracks: List of track objects
 
     Returns:
-        Number of saved tracks
+        List of connection items
     """
-    # Query all soft-deleted tracks for this user in one go
-    deleted_track_ids = set()
+    if USER_DATA_LAYOUT == "single":
+        return _query_user_data(
+            user_id,
+            "userId = :userId AND begins_with(sk, :prefix)",
+            {":prefix": CONNECTION_SK_PREFIX},
+        )
+
+    connections = []
     query_kwargs = {
         "KeyConditionExpression": "userId = :userId",
-        "FilterExpression": "attribute_exists(deletedAt)",
         "ExpressionAttributeValues": {":userId": user_id},
-        "ProjectionExpression": "trackId",
+        "ReturnConsumedCapacity": "TOTAL",
     }
     while True:
-        response = library_table.query(**query_kwargs)
-        for item in response.get("Items", []):
-            deleted_track_ids.add(item["trackId"])
+        response = connections_table.query(**query_kwargs)
+        record_capacity("read", response)
+        connections.extend(response.get("Items", []))
         if "LastEvaluatedKey" not in response:
             break
         query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return connections
+
+
+def _query_user_data(user_id, key_condition, values=None):
+    """Items of a user's Melodiary-UserData partition, in sort key order."""
+    items = []
+    query_kwargs = {
+        "KeyConditionExpression": key_condition,
+        "ExpressionAttributeValues": {":userId": user_id, **(values or {})},
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    while True:
+        response = user_data_table.query(**query_kwargs)
+        record_capacity("read", response)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return [_row_item(item) for item in items]
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
 
-    saved_count = 0
-    with library_table.batch_writer() as batch:
-        for track in tracks:
-            if track["trackId"] in deleted_track_ids:
-                continue
-            batch.put_item(
-                Item={
-                    "userId": user_id,
-                    "trackId": track["trackId"],
-                    "trackName": track["trackName"],
-                    "artistName": track["artistName"],
-                    "albumName": track["albumName"],
-                    "platform": track["platform"],
-                    "platformTrackId": track.get("platformTrackId"),
-                    "platformAlbumId": track.get("platformAlbumId"),
-                    "platformArtistId": track.get("platformArtistId"),
-                    "coverArtUrl": track.get("coverArtUrl"),
-                    "addedDate": track.get(
-                        "addedDate", datetime.now(timezone.utc).isoformat()
-                    ),
-                    "duration": track.get("duration"),
-                    "releaseYear": track.get("releaseYear"),
-                    "isManual": track.get("isManual", False),
-                }
-            )
-            saved_count += 1
 
-    return saved_count
+@timed("db.get_user_and_connections")
+def get_user_and_connections(user_id):
+    """
+    Get a user and all of its platform connections
 
+    One Query of the user's partition with the single-table layout, a
+    GetItem and a Query otherwise. Neither is served from the caches.
 
-def get_user_library(user_id, limit=50, last_key=None):
+    Returns:
+        Tuple of (user item or None, list of connection items)
     """
-    Get user library with pagination
+    if USER_DATA_LAYOUT != "single":
+        return get_user(user_id, cached=False), get_platform_connections(user_id)
+
+    # CONNECTION#<platform> items sort before PROFILE
+    items = _query_user_data(user_id, "userId = :userId")
+    user = items.pop() if items and "platform" not in items[-1] else None
+    return user, items
+
+
+@timed("db.acquire_token_refresh_lease")
+def acquire_token_refresh_lease(user_id, platform, owner, refresh_token, lease_seconds):
+    """
+    Try to take the token refresh lease on a platform connection
+
+    The lease is only granted while the stored refresh token is still the one
+    the caller intends to use, so a caller holding a rotated-out token can
+    never refresh.
 
     Args:
         user_id: User ID
-        limit: Max number of items to return
-        last_key: Last evaluated key for pagination
+        platform: Platform type
+        owner: Unique ID of the caller taking the lease
+        refresh_token: Refresh token the caller read from the connection
+        lease_seconds: How long the lease is held before others may take it
 
     Returns:
-        Dict with items and pagination info
+        True if the lease was acquired, False otherwise
     """
+    now = int(time.time())
+    try:
+        response = _update_row(
+            _connection_rows(user_id, platform),
+            UpdateExpression="SET refreshLeaseOwner = :owner, refreshLeaseUntil = :until",
+            ConditionExpression=(
+                "refreshToken = :refresh AND "
+                "(attribute_not_exists(refreshLeaseUntil) OR refreshLeaseUntil < :now)"
+            ),
+            ExpressionAttributeValues={
+                ":owner": owner,
+                ":until": now + lease_seconds,
+                ":refresh": refresh_token,
+                ":now": now,
+            },
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+        connection_cache.invalidate((user_id, platform))
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
 
-    query_params = {
-        "KeyConditionExpression": "userId = :userId",
-        "FilterExpression": "attribute_not_exists(deletedAt)",
-        "ExpressionAttributeValues": {":userId": user_id},
-        "Limit": limit,
-        "ScanIndexForward": False,
-    }
 
-    if last_key:
-        query_params["ExclusiveStartKey"] = last_key
+@timed("db.release_token_refresh_lease")
+def release_token_refresh_lease(user_id, platform, owner):
+    """Give up the token refresh lease, e.g. after a failed refresh, if the caller still holds it."""
+    try:
+        response = _update_row(
+            _connection_rows(user_id, platform),
+            UpdateExpression="REMOVE refreshLeaseOwner, refreshLeaseUntil",
+            ConditionExpression="refreshLeaseOwner = :owner",
+            ExpressionAttributeValues={":owner": owner},
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+        connection_cache.invalidate((user_id, platform))
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
 
-    response = library_table.query(**query_params)
-    return {
-        "items": response.get("Items", []),
-        "lastKey": response.get("LastEvaluatedKey"),
-        "count": response.get("Count", 0),
-    }
+
+@timed("db.update_platform_tokens")
+def update_platform_tokens(user_id, platform, tokens, previous_refresh_token=None):
+    """
+    Update platform tokens for refresh purposes
+
+    Args:
+        user_id: User ID
+        platform: Platform type
+        tokens: New token data
+        previous_refresh_token: Optional refresh token the new tokens were
+            obtained with. When given, the update only applies if that token
+            is still stored (so a newer rotation is never overwritten) and
+            the refresh lease is released.
+
+    Returns:
+        True if the tokens were written, False if the stored refresh token
+        had already been rotated by someone else
+    """
+    if "access_token" not in tokens:
+        raise ValueError("Tokens must contain 'access_token'")
+
+    update_parts = ["accessToken = :access", "expiresAt = :expires"]
+    expr_values = {
+        ":access": tokens["access_token"],
+        ":expires": tokens.get("expires_at"),
+    }
+    refresh_token = tokens.get("refresh_token")
+    if refresh_token:
+        update_parts.append("refreshToken = :refresh")
+        expr_values[":refresh"] = refresh_token
+
+    update_kwargs = {
+        "UpdateExpression": f"SET {",".join(update_parts)}",
+        "ExpressionAttributeValues": expr_values,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    if previous_refresh_token:
+        update_kwargs["UpdateExpression"] += " REMOVE refreshLeaseOwner, refreshLeaseUntil"
+        update_kwargs["ConditionExpression"] = "refreshToken = :previousRefresh"
+        expr_values[":previousRefresh"] = previous_refresh_token
+
+    try:
+        response = _update_row(_connection_rows(user_id, platform), **update_kwargs)
+        record_capacity("write", response)
+        connection_cache.invalidate((user_id, platform))
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+@timed("db.acquire_sync_lease")
+def acquire_sync_lease(user_id, platform, owner, lease_seconds, debounce_seconds):
+    """
+    Try to take the library sync lease on a platform connection
+
+    Not granted while another sync holds an unexpired lease, or while the
+    last sync finished less than debounce_seconds ago.
+
+    Args:
+        user_id: User ID
+        platform: Platform type
+        owner: Unique ID of the caller taking the lease
+        lease_seconds: How long the lease is held before others may take it
+        debounce_seconds: Minimum time between the end of one sync and the
+            start of the next
+
+    Returns:
+        The connection item as of the lease (tokens included, fresher than
+        the cache) if it was acquired, None otherwise
+    """
+    now = int(time.time())
+    try:
+        response = _update_row(
+            _connection_rows(user_id, platform),
+            UpdateExpression="SET syncLeaseOwner = :owner, syncLeaseUntil = :until",
+            ConditionExpression=(
+                "attribute_exists(userId) AND "
+                "(attribute_not_exists(syncLeaseUntil) OR syncLeaseUntil < :now) AND "
+                "(attribute_not_exists(lastSyncedEpoch) OR lastSyncedEpoch <= :debounceCutoff)"
+            ),
+            ExpressionAttributeValues={
+                ":owner": owner,
+                ":until": now + lease_seconds,
+                ":now": now,
+                ":debounceCutoff": now - debounce_seconds,
+            },
+            ReturnValues="ALL_NEW",
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+        connection_cache.invalidate((user_id, platform))
+        return _row_item(response["Attributes"])
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
+
+@timed("db.release_sync_lease")
+def release_sync_lease(user_id, platform, owner):
+    """Give up the sync lease without a result, if the caller still holds it."""
+    try:
+        response = _update_row(
+            _connection_rows(user_id, platform),
+            UpdateExpression="REMOVE syncLeaseOwner, syncLeaseUntil",
+            ConditionExpression="syncLeaseOwner = :owner",
+            ExpressionAttributeValues={":owner": owner},
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+        connection_cache.invalidate((user_id, platform))
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+
+@timed("db.record_sync_result")
+def record_sync_result(
+    user_id, platform, summary, user_initiated=False, lease_owner=None, complete=True
+):
+    """
+    Store the outcome of a library sync on the platform connection
+
+    Args:
+        user_id: User ID
+        platform: Platform type
+        summary: Sync summary returned to the client
+        user_initiated: Whether the user triggered the sync, which also
+            marks the connection as recently active
+        lease_owner: Sync lease to release in the same write, if still held
+        complete: False if some tracks could not be stored. The connection
+            then keeps its last complete sync time, so the scheduler still
+            sees it as stale, and is not debounced, so the next request
+            syncs again.
+    """
+    now = datetime.now(timezone.utc)
+    values = {
+        ":count": summary.get("synced", 0),
+        ":summary": summary,
+    }
+    update_parts = ["lastSyncCount = :count", "lastSyncResult = :summary"]
+    removed = []
+    if complete:
+        update_parts += ["lastSyncedAt = :now", "lastSyncedEpoch = :epoch"]
+        values[":epoch"] = int(now.timestamp())
+    else:
+        removed.append("lastSyncedEpoch")
+    if complete or user_initiated:
+        values[":now"] = now.isoformat()
+    if user_initiated:
+        update_parts.append("lastActiveAt = :now")
+
+    def expression(removed):
+        remove = f" REMOVE {", ".join(removed)}" if removed else ""
+        return f"SET {", ".join(update_parts)}{remove}"
+
+    update_kwargs = {
+        "UpdateExpression": expression(removed),
+        "ExpressionAttributeValues": values,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    if lease_owner:
+        release_kwargs = {
+            **update_kwargs,
+            "UpdateExpression": expression(removed + ["syncLeaseOwner", "syncLeaseUntil"]),
+            "ConditionExpression": "syncLeaseOwner = :owner",
+            "ExpressionAttributeValues": {
+                **update_kwargs["ExpressionAttributeValues"],
+                ":owner": lease_owner,
+            },
+        }
+        try:
+            response = _update_row(_connection_rows(user_id, platform), **release_kwargs)
+            record_capacity("write", response)
+            connection_cache.invalidate((user_id, platform))
+            return
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            # The lease expired and was taken over, leave it to the new holder
+            pass
+
+    response = _update_row(_connection_rows(user_id, platform), **update_kwargs)
+    record_capacity("write", response)
+    connection_cache.invalidate((user_id, platform))
+
+
+@timed("db.soft_delete_track")
+def soft_delete_track(user_id, track_id):
+    """
+    Soft-delete a track by setting deletedAt timestamp.
+
+    Args:
+        user_id: User ID
+        track_id: Track ID
+
+    Returns:
+        True if the track existed and was deleted, False otherwise
+    """
+    try:
+        response = library_table.update_item(
+            Key={"userId": user_id, "trackId": track_id},
+            UpdateExpression="SET deletedAt = :deletedAt",
+            ConditionExpression="attribute_exists(trackId) AND attribute_not_exists(deletedAt)",
+            ExpressionAttributeValues={
+                ":deletedAt": datetime.now(timezone.utc).isoformat(),
+            },
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    # Logged once it happened: missing or already deleted tracks log nothing
+    log_library_changes(user_id, [("delete", track_id, None)])
+    return True
+
+
+@timed("db.soft_delete_tracks")
+def soft_delete_tracks(user_id, track_ids):
+    """
+    Soft-delete several tracks, logging the ones deleted as one change log
+    update
+
+    Args:
+        user_id: User ID
+        track_ids: IDs of tracks that exist and are not deleted yet
+
+    Returns:
+        List of the track IDs that were deleted
+    """
+    if not track_ids:
+        return []
+    deleted_at = datetime.now(timezone.utc).isoformat()
+    deleted = []
+    for track_id in track_ids:
+        try:
+            response = library_table.update_item(
+                Key={"userId": user_id, "trackId": track_id},
+                UpdateExpression="SET deletedAt = :deletedAt",
+                ConditionExpression="attribute_exists(trackId) AND attribute_not_exists(deletedAt)",
+                ExpressionAttributeValues={":deletedAt": deleted_at},
+                ReturnConsumedCapacity="TOTAL",
+            )
+            record_capacity("write", response)
+            deleted.append(track_id)
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+    log_library_changes(user_id, [("delete", track_id, None) for track_id in deleted])
+    return deleted
+
+
+@timed("db.batch_get")
+def batch_get(keys_by_table, projections=None):
+    """
+    Read items from several tables in as few BatchGetItem calls as possible
+
+    Args:
+        keys_by_table: Dict of table -> list of key dicts
+        projections: Optional dict of table -> ProjectionExpression (the
+            key attributes must be part of it)
+
+    Returns:
+        Dict of table name -> list of the items that exist
+    """
+    pending = [
+        (table.name, key) for table, keys in keys_by_table.items() for key in keys
+    ]
+    projections = {table.name: projection for table, projection in (projections or {}).items()}
+    found = {table.name: [] for table in keys_by_table}
+    for start in range(0, len(pending), 100):
+        request = {}
+        for table_name, key in pending[start : start + 100]:
+            entry = request.setdefault(table_name, {"Keys": []})
+            entry["Keys"].append(key)
+            if table_name in projections:
+                entry["ProjectionExpression"] = projections[table_name]
+        while request:
+            response = dynamodb.batch_get_item(
+                RequestItems=request, ReturnConsumedCapacity="TOTAL"
+            )
+            record_capacity("read", response)
+            for table_name, items in response["Responses"].items():
+                found[table_name].extend(items)
+            request = response.get("UnprocessedKeys")
+    return found
+
+
+def user_data_keys(user_id, platforms=(), profile=True):
+    """
+    batch_get keys of a user's profile and connections, wherever
+    USER_DATA_LAYOUT reads them from
+
+    Returns:
+        Dict of table -> list of key dicts, read back with split_user_data
+    """
+    rows = (_profile_rows(user_id)[:1] if profile else []) + [
+        _connection_rows(user_id, platform)[0] for platform in platforms
+    ]
+    keys = {}
+    for table, key in rows:
+        keys.setdefault(table, []).append(key)
+    return keys
+
+
+def split_user_data(found):
+    """
+    Profile and connections in batch_get results of user_data_keys
+
+    Returns:
+        Tuple of (user item or None, list of connection items)
+    """
+    users = list(found.get(users_table.name, []))
+    connections = list(found.get(connections_table.name, []))
+    for item in found.get(user_data_table.name, []):
+        if item.pop("sk") == PROFILE_SK:
+            users.append(item)
+        else:
+            connections.append(item)
+    return (users[0] if users else None), connections
+
+
+@timed("db.get_audio_features")
+def get_audio_features(track_ids):
+    """
+    Look up audio features in the table shared by all users
+
+    Args:
+        track_ids: Library track IDs, e.g. "spotify:<id>"
+
+    Returns:
+        Dict of track ID -> encoded features ("" if the platform has none)
+        for the tracks that were looked up before
+    """
+    track_ids = list(dict.fromkeys(track_ids))
+    found = {}
+    for start in range(0, len(track_ids), 100):
+        keys = [{"trackId": track_id} for track_id in track_ids[start : start + 100]]
+        request = {
+            audio_features_table.name: {"Keys": keys, "ProjectionExpression": "trackId, f"}
+        }
+        while request:
+            response = dynamodb.batch_get_item(
+                RequestItems=request, ReturnConsumedCapacity="TOTAL"
+            )
+            record_capacity("read", response)
+            for item in response["Responses"].get(audio_features_table.name, []):
+                found[item["trackId"]] = item["f"]
+            request = response.get("UnprocessedKeys")
+    return found
+
+
+@timed("db.put_audio_features")
+def put_audio_features(features):
+    """
+    Store audio features for all users
+
+    Args:
+        features: Dict of track ID -> encoded features ("" if the platform has none)
+
+    Returns:
+        Number of items written
+    """
+    now = int(time.time())
+    stats = audio_features_writer.put_items(
+        [{"trackId": track_id, "f": f, "fetchedAt": now} for track_id, f in features.items()]
+    )
+    if stats["failed"]:
+        logger.error("Failed to store audio features of %d tracks", stats["failed"])
+    return stats["written"]
+
+
+@timed("db.get_library_state")
+def get_library_state(user_id):
+    """
+    Get the content hash, deletion state and audio features of every track
+    in a library
+
+    Args:
+        user_id: User ID
+
+    Returns:
+        Dict of track ID to (contentHash or None, whether soft-deleted,
+        audioFeatures or None)
+    """
+    state = {}
+    query_kwargs = {
+        "KeyConditionExpression": "userId = :userId",
+        "ExpressionAttributeValues": {":userId": user_id},
+        "ProjectionExpression": "trackId, contentHash, deletedAt, audioFeatures",
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    while True:
+        response = library_table.query(**query_kwargs)
+        record_capacity("read", response)
+        for item in response.get("Items", []):
+            state[item["trackId"]] = (
+                item.get("contentHash"),
+                "deletedAt" in item,
+                item.get("audioFeatures"),
+            )
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return state
+
+
+@timed("db.store_tracks")
+def store_tracks(user_id, tracks, state=None):
+    """
+    Write new and changed tracks to the user library and log the changes.
+    Skips tracks that have been soft-deleted by the user and tracks whose
+    content did not change since they were last written.
+
+    Args:
+        user_id: User ID
+        tracks: TrackBatch, or list of track objects
+        state: get_library_state of the library, if the caller already read it
+
+    Returns:
+        Dict with the written items, their change log seq range
+        (firstSeq, lastSeq) and written, failed and unchanged counts
+    """
+    if state is None:
+        state = get_library_state(user_id)
+
+    if not isinstance(tracks, TrackBatch):
+        tracks = TrackBatch.from_tracks(tracks)
+
+    items = []
+    changes = []
+    unchanged = 0
+    for item in tracks.to_items(user_id):
+        known_hash, deleted, _ = state.get(item["trackId"], (None, False, None))
+        if deleted:
+            continue
+        if known_hash == item["contentHash"]:
+            unchanged += 1
+            continue
+        op = "update" if item["trackId"] in state else "insert"
+        items.append(item)
+        changes.append((op, item["trackId"], item))
+
+    # Logged before writing, so a change is never applied without its entry
+    first_seq, last_seq = log_library_changes(user_id, changes)
+    stats = library_writer.put_items(items)
+    logger.info(
+        "Saved %d/%d tracks for user %s, %d unchanged (%.1f WCU, %d retries, %d throttle events)",
+        stats["written"],
+        len(items),
+        user_id,
+        unchanged,
+        stats["consumedCapacity"],
+        stats["retries"],
+        stats["throttleEvents"],
+    )
+    return {
+        "items": items,
+        "firstSeq": first_seq,
+        "lastSeq": last_seq,
+        "written": stats["written"],
+        "failed": stats["failed"],
+        "unchanged": unchanged,
+    }
+
+
+@timed("db.save_tracks")
+def save_tracks(user_id, tracks):
+    """
+    Batch save tracks to user library.
+    Skips tracks that have been soft-deleted by the user.
+
+    Args:
+        user_id: User ID
+        tracks: TrackBatch, or list of track objects
+
+    Returns:
+        Number of saved tracks (written now or already up to date)
+    """
+    result = store_tracks(user_id, tracks)
+    return result["written"] + result["unchanged"]
+
+
+@timed("db.log_library_changes")
+def log_library_changes(user_id, changes):
+    """
+    Append library mutations to the user's change log
+
+    Sequence numbers come from an atomic counter on the user row, one
+    update per call however many changes are logged. More than
+    CHANGE_LOG_MAX_ENTRIES changes are logged as a single "reset" entry.
+
+    Args:
+        user_id: User ID
+        changes: List of (op, track ID, library item or None) tuples, op is
+            "insert", "update" or "delete"
+
+    Returns:
+        Tuple of (first seq, last seq), (None, None) if there was nothing to log
+    """
+    if not changes:
+        return None, None
+    if len(changes) > CHANGE_LOG_MAX_ENTRIES:
+        changes = [("reset", None, None)]
+
+    now = int(time.time())
+    response = _update_row(
+        _profile_rows(user_id),
+        UpdateExpression="SET librarySeqAt = :now ADD librarySeq :count",
+        ExpressionAttributeValues={":now": now, ":count": len(changes)},
+        ReturnValues="UPDATED_NEW",
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("write", response)
+    user_cache.invalidate(user_id)
+    last_seq = int(response["Attributes"]["librarySeq"])
+    first_seq = last_seq - len(changes) + 1
+
+    entries = []
+    for seq, (op, track_id, item) in enumerate(changes, start=first_seq):
+        entry = {
+            "userId": user_id,
+            "seq": seq,
+            "op": op,
+            "changedAt": now,
+            "expiresAt": now + CHANGE_LOG_TTL_SECONDS,
+        }
+        if track_id is not None:
+            entry["trackId"] = track_id
+        if item is not None:
+            entry["track"] = {
+                k: v for k, v in item.items() if k not in _INTERNAL_TRACK_ATTRIBUTES
+            }
+        entries.append(entry)
+
+    stats = changes_writer.put_items(entries)
+    if stats["failed"]:
+        logger.error(
+            "Failed to log %d of %d library changes for user %s",
+            stats["failed"],
+            len(entries),
+            user_id,
+        )
+    return first_seq, last_seq
+
+
+@timed("db.get_library_seq")
+def get_library_seq(user_id):
+    """
+    Get the last allocated change log seq and when it was allocated
+
+    Returns:
+        Tuple of (seq, epoch seconds), (0, None) if nothing was logged yet
+    """
+    table, key = _profile_rows(user_id)[0]
+    response = table.get_item(
+        Key=key,
+        ProjectionExpression="librarySeq, librarySeqAt",
+        ConsistentRead=True,
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("read", response)
+    item = response.get("Item", {})
+    seq_at = item.get("librarySeqAt")
+    return int(item.get("librarySeq", 0)), int(seq_at) if seq_at is not None else None
+
+
+@timed("db.get_library_changes")
+def get_library_changes(user_id, after_seq, limit=500):
+    """
+    Get change log entries in seq order
+
+    Args:
+        user_id: User ID
+        after_seq: Only entries with a higher seq are returned
+        limit: Max number of entries
+
+    Returns:
+        List of change log entries
+    """
+    response = changes_table.query(
+        KeyConditionExpression="userId = :userId AND seq > :after",
+        ExpressionAttributeValues={":userId": user_id, ":after": after_seq},
+        Limit=limit,
+        ConsistentRead=True,
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("read", response)
+    return response.get("Items", [])
+
+
+@timed("db.get_user_library")
+def get_user_library(user_id, limit=50, last_key=None):
+    """
+    Get user library with pagination
+
+    Args:
+        user_id: User ID
+        limit: Max number of items to return
+        last_key: Last evaluated key for pagination
+
+    Returns:
+        Dict with items and pagination info
+    """
+
+    query_params = {
+        "KeyConditionExpression": "userId = :userId",
+        "FilterExpression": "attribute_not_exists(deletedAt)",
+        "ExpressionAttributeValues": {":userId": user_id},
+        "Limit": limit,
+        "ScanIndexForward": False,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+
+    if last_key:
+        query_params["ExclusiveStartKey"] = last_key
+
+    response = library_table.query(**query_params)
+    record_capacity("read", response)
+    return {
+        "items": response.get("Items", []),
+        "lastKey": response.get("LastEvaluatedKey"),
+        "count": response.get("Count", 0),
+    }
+
+
+@timed("db.iter_user_library")
+def iter_user_library(user_id, consistent=False):
+    """
+    Iterate over a user's whole library (soft-deleted tracks excluded)
+
+    Yields tracks in the same order as get_user_library pages.
+
+    Args:
+        user_id: User ID
+        consistent: Use strongly consistent reads, e.g. right after a sync
+
+    Yields:
+        Library items
+    """
+    query_kwargs = {
+        "KeyConditionExpression": "userId = :userId",
+        "FilterExpression": "attribute_not_exists(deletedAt)",
+        "ExpressionAttributeValues": {":userId": user_id},
+        "ScanIndexForward": False,
+        "ConsistentRead": consistent,
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    while True:
+        response = library_table.query(**query_kwargs)
+        record_capacity("read", response)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+@timed("db.get_library_snapshot")
+def get_library_snapshot(user_id, consistent=False):
+    """
+    Get the pointer to the user's current library snapshot object
+
+    Returns:
+        Snapshot dict (version, key, previousKey, count, generatedAt) or None
+    """
+    table, key = _profile_rows(user_id)[0]
+    response = table.get_item(
+        Key=key,
+        ProjectionExpression="librarySnapshot",
+        ConsistentRead=consistent,
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("read", response)
+    return response.get("Item", {}).get("librarySnapshot")
+
+
+@timed("db.set_library_snapshot")
+def set_library_snapshot(user_id, snapshot, expected_version=None):
+    """
+    Point the user at a new library snapshot object
+
+    The swap only succeeds if the current snapshot still has the expected
+    version, so concurrent publishers cannot overwrite each other.
+
+    Args:
+        user_id: User ID
+        snapshot: New snapshot dict
+        expected_version: Version of the snapshot being replaced, or None
+            if there was none
+
+    Returns:
+        True if the pointer was swapped, False if another snapshot won
+    """
+    if expected_version is None:
+        condition = "attribute_exists(userId) AND attribute_not_exists(librarySnapshot)"
+        values = {":snapshot": snapshot}
+    else:
+        condition = "librarySnapshot.version = :expected"
+        values = {":snapshot": snapshot, ":expected": expected_version}
+
+    try:
+        response = _update_row(
+            _profile_rows(user_id),
+            UpdateExpression="SET librarySnapshot = :snapshot",
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+        user_cache.invalidate(user_id)
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+@timed("db.clear_library_snapshot")
+def clear_library_snapshot(user_id):
+    """Drop the snapshot pointer so the next request rebuilds it."""
+    response = _update_row(
+        _profile_rows(user_id),
+        UpdateExpression="REMOVE librarySnapshot",
+        ConditionExpression="attribute_exists(userId)",
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("write", response)
+    user_cache.invalidate(user_id)
+
+
+@timed("db.iter_library_track_ids")
+def iter_library_track_ids(user_id):
+    """
+    Iterate over the IDs of a user's tracks (soft-deleted ones excluded) in
+    ascending order, reading only the keys
+
+    Args:
+        user_id: User ID
+
+    Yields:
+        Track IDs
+    """
+    query_kwargs = {
+        "KeyConditionExpression": "userId = :userId",
+        "FilterExpression": "attribute_not_exists(deletedAt)",
+        "ExpressionAttributeValues": {":userId": user_id},
+        "ProjectionExpression": "trackId",
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    while True:
+        response = library_table.query(**query_kwargs)
+        record_capacity("read", response)
+        for item in response.get("Items", []):
+            yield item["trackId"]
+        if "LastEvaluatedKey" not in response:
+            return
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+@timed("db.get_library_sketch")
+def get_library_sketch(user_id, consistent=False):
+    """
+    Get the similarity sketch of the user's library
+
+    Returns:
+        Sketch dict (version, count, hashes) or None
+    """
+    table, key = _profile_rows(user_id)[0]
+    response = table.get_item(
+        Key=key,
+        ProjectionExpression="librarySketch",
+        ConsistentRead=consistent,
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("read", response)
+    return response.get("Item", {}).get("librarySketch")
+
+
+@timed("db.get_library_sketches")
+def get_library_sketches(user_ids):
+    """
+    Get the library sketches and display names of several users
+
+    Args:
+        user_ids: User IDs
+
+    Returns:
+        Dict of user ID -> {"displayName", "librarySketch"} for the users
+        that exist, librarySketch missing if they have none yet
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    found = {}
+    for start in range(0, len(user_ids), 100):
+        rows = [_profile_rows(user_id)[0] for user_id in user_ids[start : start + 100]]
+        table = rows[0][0]
+        request = {
+            table.name: {
+                "Keys": [key for _, key in rows],
+                "ProjectionExpression": "userId, displayName, librarySketch",
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(
+                RequestItems=request, ReturnConsumedCapacity="TOTAL"
+            )
+            record_capacity("read", response)
+            for item in response["Responses"].get(table.name, []):
+                found[item.pop("userId")] = item
+            request = response.get("UnprocessedKeys")
+    return found
+
+
+@timed("db.set_library_sketch")
+def set_library_sketch(user_id, sketch, expected_version=None):
+    """
+    Replace the user's library sketch
+
+    Like set_library_snapshot, the write only succeeds if the current
+    sketch still has the expected version.
+
+    Args:
+        user_id: User ID
+        sketch: New sketch dict
+        expected_version: Version of the sketch being replaced, or None if
+            there was none
+
+    Returns:
+        True if the sketch was replaced, False if another update won
+    """
+    if expected_version is None:
+        condition = "attribute_exists(userId) AND attribute_not_exists(librarySketch)"
+        values = {":sketch": sketch}
+    else:
+        condition = "librarySketch.version = :expected"
+        values = {":sketch": sketch, ":expected": expected_version}
+
+    try:
+        response = _update_row(
+            _profile_rows(user_id),
+            UpdateExpression="SET librarySketch = :sketch",
+            ConditionExpression=condition,
+            ExpressionAttributeValues=values,
+            ReturnConsumedCapacity="TOTAL",
+        )
+        record_capacity("write", response)
+        user_cache.invalidate(user_id)
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+@timed("db.clear_library_sketch")
+def clear_library_sketch(user_id):
+    """Drop the library sketch so the next read rebuilds it."""
+    response = _update_row(
+        _profile_rows(user_id),
+        UpdateExpression="REMOVE librarySketch",
+        ConditionExpression="attribute_exists(userId)",
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("write", response)
+    user_cache.invalidate(user_id)
+
+
+@timed("db.add_friend")
+def add_friend(user_id, friend_id):
+    """Record a friendship, in both directions."""
+    now = datetime.now(timezone.utc).isoformat()
+    _transact(
+        [
+            _put(friends_table, {"userId": user_id, "friendId": friend_id, "since": now}),
+            _put(friends_table, {"userId": friend_id, "friendId": user_id, "since": now}),
+        ]
+    )
+
+
+@timed("db.remove_friend")
+def remove_friend(user_id, friend_id):
+    """Remove a friendship, in both directions."""
+    client = dynamodb.meta.client
+    response = client.transact_write_items(
+        TransactItems=[
+            {"Delete": {"TableName": friends_table.name, "Key": {"userId": a, "friendId": b}}}
+            for a, b in ((user_id, friend_id), (friend_id, user_id))
+        ],
+        ReturnConsumedCapacity="TOTAL",
+    )
+    record_capacity("write", response)
+
+
+@timed("db.get_friend_ids")
+def get_friend_ids(user_id):
+    """
+    Get the IDs of a user's friends
+
+    Returns:
+        List of user IDs
+    """
+    friend_ids = []
+    query_kwargs = {
+        "KeyConditionExpression": "userId = :userId",
+        "ExpressionAttributeValues": {":userId": user_id},
+        "ProjectionExpression": "friendId",
+        "ReturnConsumedCapacity": "TOTAL",
+    }
+    while True:
+        response = friends_table.query(**query_kwargs)
+        record_capacity("read", response)
+        friend_ids.extend(item["friendId"] for item in response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return friend_ids
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+@timed("db.take_request_token")
+def take_request_token(bucket_id, interval, burst, now, known_refilled_at=None, tokens=1):
+    """
+    Take requests from a token bucket in Melodiary-RateLimits
+
+    The bucket is stored as the time it is full again (`refilledAt`): every
+    request moves it `interval` seconds further, and requests are refused
+    if that would put it more than `burst` intervals after now. This is one
+    conditional write, and a second one only when the bucket changed state
+    since known_refilled_at because another container used it.
+
+    Args:
+        bucket_id: Bucket key
+        interval: Seconds per request at the sustained rate
+        burst: Requests allowed at once
+        now: Current time in epoch seconds
+        known_refilled_at: refilledAt this container last saw, if any
+        tokens: Requests to take at once
+
+    Returns:
+        (allowed, refilledAt after the call); refilledAt is None if both
+        writes lost a race with another container, the requests are then
+        let through
+    """
+    cost = tokens * interval
+    # Latest refilledAt that still leaves the requests in the bucket
+    latest = now + burst * interval - cost
+    values = {
+        ":now": Decimal(str(round(now, 3))),
+        ":expires": int(now + burst * interval) + 1,
+    }
+    updates = {
+        # Bucket full (or never used): start from now
+        "reset": (
+            "SET refilledAt = :next, expiresAt = :expires",
+            "attribute_not_exists(refilledAt) OR refilledAt <= :now",
+            {":next": Decimal(str(round(now + cost, 3)))},
+        ),
+        "take": (
+            "SET refilledAt = refilledAt + :cost, expiresAt = :expires",
+            "refilledAt > :now AND refilledAt <= :latest",
+            {
+                ":cost": Decimal(str(round(cost, 3))),
+                ":latest": Decimal(str(round(latest, 3))),
+            },
+        ),
+    }
+    order = ["take", "reset"] if (known_refilled_at or 0) > now else ["reset", "take"]
+    for name in order:
+        update_expression, condition, extra_values = updates[name]
+        try:
+            response = rate_limits_table.update_item(
+                Key={"bucketId": bucket_id},
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeValues={**values, **extra_values},
+                ReturnValues="UPDATED_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                ReturnConsumedCapacity="TOTAL",
+            )
+        except dynamodb.meta.client.exceptions.ConditionalCheckFailedException as e:
+            # The old item comes back in the low-level attribute format
+            old = (e.response.get("Item") or {}).get("refilledAt")
+            refilled_at = float(old["N"]) if old else None
+            if refilled_at is not None and refilled_at > latest:
+                return False, refilled_at
+            continue
+        record_capacity("write", response)
+        return True, float(response["Attributes"]["refilledAt"])
+    return True, None
@@ -0,0 +1,152 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.config import get_logger
+from shared.instrumentation import increment, span
+from shared.providers import get_provider
+from shared.token_manager import get_access_token, invalidate_if_rejected
+from shared.track_batch import TrackBatch
+
+logger = get_logger(__name__)
+
+# One pool per provider, kept for the life of the container so a slow or
+# throttled service can only ever occupy its own threads
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class FetchError(Exception):
+    """A provider's library could not be fetched, with the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _executor(provider):
+    with _executors_lock:
+        executor = _executors.get(provider)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=provider.pool_size, thread_name_prefix=f"fetch-{provider.name}"
+            )
+            _executors[provider] = executor
+        return executor
+
+
+async def _call(provider, func, *args):
+    """Run a blocking call on the provider's pool, reporting to the caller's invocation."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await loop.run_in_executor(_executor(provider), call)
+
+
+async def fetch_library(provider, user_id, connection=None):
+    """
+    Fetch and parse a user's whole library from one provider
+
+    The first page tells the library size, the remaining pages are then
+    requested concurrently (up to the provider's pool size) and parsed in
+    order as they arrive. A track repeated on two pages, because the
+    library shifted during the crawl, is kept once, at its first position. A connection item read uncached saves the token
+    manager's read.
+
+    Returns:
+        TrackBatch of the library
+
+    Raises:
+        FetchError if the token or a page could not be fetched
+    """
+    access_token, error = await _call(
+        provider, get_access_token, user_id, provider.name, connection
+    )
+    if error:
+        logger.error("Token refresh failed for user %s on %s: %s", user_id, provider.name, error)
+        raise FetchError(f"Failed to refresh {provider.display_name} token", 401)
+
+    limit = provider.page_size
+    batch = TrackBatch()
+    pending = []
+    try:
+        with span(f"fetch.{provider.name}"):
+            items, total, has_next = await _call(provider, provider.fetch_page, access_token, 0, limit)
+            provider.parse_page(items, batch)
+            offset = limit
+
+            if has_next and total is not None:
+                pending = [
+                    asyncio.ensure_future(
+                        _call(provider, provider.fetch_page, access_token, page_offset, limit)
+                    )
+                    for page_offset in range(offset, total, limit)
+                ]
+                offset = max(offset, total)
+                for page in pending:
+                    items, _, has_next = await page
+                    provider.parse_page(items, batch)
+
+            # Unknown size, or the library grew during the crawl
+            while has_next:
+                items, _, has_next = await _call(
+                    provider, provider.fetch_page, access_token, offset, limit
+                )
+                provider.parse_page(items, batch)
+                offset += limit
+    except Exception as e:
+        for page in pending:
+            page.cancel()
+        if invalidate_if_rejected(user_id, provider.name, e):
+            raise FetchError(f"{provider.display_name} rejected the access token", 401) from e
+        logger.error("Track fetch failed for user %s on %s: %s", user_id, provider.name, e)
+        raise FetchError(f"Failed to fetch tracks from {provider.display_name}", 500) from e
+
+    # Pages fetched by offset overlap when the library shifts during the
+    # crawl; one write batch must not hold the same key twice
+    duplicates = batch.drop_duplicates()
+    if duplicates:
+        logger.info("Dropped %d repeated %s tracks of user %s", duplicates, provider.name, user_id)
+        increment(f"fetch.{provider.name}.duplicates", duplicates)
+    increment(f"fetch.{provider.name}.tracks", len(batch))
+    return batch
+
+
+async def _fetch_all(user_id, providers, connections):
+    return await asyncio.gather(
+        *(
+            fetch_library(provider, user_id, connections.get(provider.name))
+            for provider in providers
+        ),
+        return_exceptions=True,
+    )
+
+
+def fetch_libraries(user_id, platforms, connections=None):
+    """
+    Fetch a user's libraries from several providers concurrently
+
+    Each provider runs on its own pool, so the total time is that of the
+    slowest provider rather than the sum.
+
+    Args:
+        user_id: User ID
+        platforms: Names of registered providers
+        connections: Optional dict of platform -> connection item read
+            uncached, such as the sync lease returns
+
+    Returns:
+        Dict of platform -> TrackBatch, or the FetchError it failed with
+    """
+    providers = [get_provider(platform) for platform in platforms]
+    unknown = [platform for platform, provider in zip(platforms, providers) if provider is None]
+    if unknown:
+        raise ValueError(f"No provider registered for {', '.join(unknown)}")
+
+    results = asyncio.run(_fetch_all(user_id, providers, connections or {}))
+    for platform, result in zip(platforms, results):
+        if isinstance(result, BaseException) and not isinstance(result, FetchError):
+            raise result
+    return dict(zip(platforms, results))
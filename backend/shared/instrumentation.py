@@ -0,0 +1,260 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+from shared.config import get_logger
+
+logger = get_logger(__name__)
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() != "false"
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "Melodiary")
+# Opt-in sampling profiler, e.g. PROFILE_SAMPLE_INTERVAL_MS=5
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "0"))
+PROFILE_TOP_STACKS = 15
+
+_NULL_SPAN = nullcontext()
+_current = contextvars.ContextVar("melodiary_invocation", default=None)
+_cold_start = True
+
+
+class Invocation:
+    """Timings, capacity and counters collected during one handler call."""
+
+    def __init__(self, function_name, cold_start=False):
+        self.function_name = function_name
+        self.cold_start = cold_start
+        self.started_at = time.perf_counter()
+        self.spans = {}
+        self.capacity = {"read": 0.0, "write": 0.0}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, elapsed_ms):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [1, elapsed_ms]
+            else:
+                span[0] += 1
+                span[1] += elapsed_ms
+
+    def add_capacity(self, kind, units):
+        with self._lock:
+            self.capacity[kind] += units
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+
+class _Span:
+    __slots__ = ("invocation", "name", "started_at")
+
+    def __init__(self, invocation, name):
+        self.invocation = invocation
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.invocation.add_span(self.name, (time.perf_counter() - self.started_at) * 1000)
+        return False
+
+
+def current_invocation():
+    """The Invocation being recorded, or None outside an instrumented handler."""
+    return _current.get()
+
+
+def span(name):
+    """
+    Time a block of code as a named span of the current invocation
+
+    Usage:
+        with span("spotify.me"):
+            ...
+    """
+    invocation = _current.get()
+    if invocation is None:
+        return _NULL_SPAN
+    return _Span(invocation, name)
+
+
+def timed(name):
+    """Decorator form of span()."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            invocation = _current.get()
+            if invocation is None:
+                return func(*args, **kwargs)
+            with _Span(invocation, name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_capacity(kind, response):
+    """
+    Add the ConsumedCapacity of a DynamoDB response to the current invocation
+
+    Args:
+        kind: "read" or "write"
+        response: DynamoDB response made with ReturnConsumedCapacity="TOTAL"
+    """
+    invocation = _current.get()
+    if invocation is None or not response:
+        return
+    consumed = response.get("ConsumedCapacity")
+    if not consumed:
+        return
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    invocation.add_capacity(kind, sum(c.get("CapacityUnits", 0.0) for c in consumed))
+
+
+def increment(name, value=1):
+    """Add to a named counter of the current invocation."""
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.increment(name, value)
+
+
+def build_emf_record(invocation, status_code=None):
+    """
+    Build one CloudWatch Embedded Metric Format record for an invocation
+
+    Returns:
+        Dict ready to be written as a single JSON log line
+    """
+    duration_ms = (time.perf_counter() - invocation.started_at) * 1000
+    metrics = [{"Name": "Duration", "Unit": "Milliseconds"}]
+    record = {
+        "Function": invocation.function_name,
+        "Duration": round(duration_ms, 3),
+        "ColdStart": invocation.cold_start,
+    }
+    if status_code is not None:
+        record["StatusCode"] = status_code
+
+    for name, (count, total_ms) in sorted(invocation.spans.items()):
+        record[f"{name}.ms"] = round(total_ms, 3)
+        record[f"{name}.count"] = count
+        metrics.append({"Name": f"{name}.ms", "Unit": "Milliseconds"})
+        metrics.append({"Name": f"{name}.count", "Unit": "Count"})
+
+    record["ConsumedRCU"] = invocation.capacity["read"]
+    record["ConsumedWCU"] = invocation.capacity["write"]
+    metrics.append({"Name": "ConsumedRCU", "Unit": "Count"})
+    metrics.append({"Name": "ConsumedWCU", "Unit": "Count"})
+
+    for name, value in sorted(invocation.counters.items()):
+        record[name] = value
+        metrics.append({"Name": name, "Unit": "Count"})
+
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [
+            {
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Function"]],
+                "Metrics": metrics,
+            }
+        ],
+    }
+    return record
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval from a daemon thread.
+
+    Only started when PROFILE_SAMPLE_INTERVAL_MS is set, so it costs nothing
+    otherwise. Results are collapsed stacks ("outer;inner") with hit counts.
+    """
+
+    def __init__(self, thread_id, interval_ms):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                location = f"{os.path.basename(code.co_filename)}:{frame.f_lineno}"
+                stack.append(f"{code.co_name} ({location})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+def instrument_handler(lambda_handler):
+    """
+    Decorator that records spans, DynamoDB capacity and counters for one
+    Lambda invocation and emits them as a single EMF log line.
+
+    Usage:
+        @instrument_handler
+        @require_auth
+        def lambda_handler(event, context):
+            ...
+    """
+    function_name = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", lambda_handler.__module__)
+
+    @functools.wraps(lambda_handler)
+    def wrapper(event, context):
+        global _cold_start
+        if not METRICS_ENABLED:
+            return lambda_handler(event, context)
+
+        invocation = Invocation(function_name, cold_start=_cold_start)
+        _cold_start = False
+        token = _current.set(invocation)
+        profiler = None
+        if PROFILE_SAMPLE_INTERVAL_MS > 0:
+            profiler = SamplingProfiler(
+                threading.get_ident(), PROFILE_SAMPLE_INTERVAL_MS
+            ).start()
+
+        response = None
+        try:
+            response = lambda_handler(event, context)
+            return response
+        finally:
+            _current.reset(token)
+            samples = profiler.stop() if profiler is not None else None
+            status_code = response.get("statusCode") if isinstance(response, dict) else None
+            try:
+                record = build_emf_record(invocation, status_code)
+                if samples is not None:
+                    record["profile"] = dict(samples.most_common(PROFILE_TOP_STACKS))
+                sys.stdout.write(json.dumps(record) + "\n")
+            except Exception as e:
+                logger.warning("Failed to emit metrics: %s", e)
+
+    return wrapper
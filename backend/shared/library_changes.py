@@ -0,0 +1,152 @@
+import os
+import time
+
+from shared.config import get_logger
+from shared.cover_art import add_cover_art_url
+from shared.db import CHANGE_LOG_RETENTION_SECONDS, get_library_changes, get_library_seq
+from shared.instrumentation import increment, timed
+
+logger = get_logger(__name__)
+
+# Seqs are allocated before their entries are written, so a missing seq is
+# usually a write still in flight. Missing for longer than this, the writer
+# died before logging anything (changes are logged before they are applied),
+# so there is nothing to wait for.
+CHANGE_LOG_GAP_TIMEOUT_SECONDS = int(os.environ.get("CHANGE_LOG_GAP_TIMEOUT_SECONDS", "120"))
+MAX_CHANGES_PER_PAGE = 1000
+
+
+class CursorExpired(Exception):
+    """The cursor is older than the change log, the client must resync fully."""
+
+
+def encode_cursor(seq, issued_at=None):
+    """
+    Opaque cursor for a position in the change log
+
+    Args:
+        seq: Last change the client has seen
+        issued_at: Epoch seconds the client's state was current at (now)
+    """
+    return f"{int(seq)}-{int(issued_at if issued_at is not None else time.time())}"
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        Tuple of (seq, issued at epoch seconds)
+
+    Raises:
+        ValueError if the cursor is malformed
+    """
+    seq, issued_at = cursor.split("-")
+    seq, issued_at = int(seq), int(issued_at)
+    if seq < 0 or issued_at < 0:
+        raise ValueError(f"Invalid cursor {cursor!r}")
+    return seq, issued_at
+
+
+def cursor_expired(cursor, now=None):
+    """Whether changes after this cursor may already have been dropped."""
+    _, issued_at = decode_cursor(cursor)
+    return (now or time.time()) - issued_at > CHANGE_LOG_RETENTION_SECONDS
+
+
+def _compact(entries):
+    """
+    Collapse entries to the final state of each touched track
+
+    A track inserted and deleted within the range is left out entirely,
+    one inserted and then updated is reported as an insert.
+    """
+    first_op = {}
+    last = {}
+    for entry in entries:
+        first_op.setdefault(entry["trackId"], entry["op"])
+        last.pop(entry["trackId"], None)
+        last[entry["trackId"]] = entry
+
+    inserted, updated, deleted = [], [], []
+    for track_id, entry in last.items():
+        if entry["op"] == "delete":
+            if first_op[track_id] != "insert":
+                deleted.append(track_id)
+        elif first_op[track_id] == "insert":
+            inserted.append(add_cover_art_url(entry["track"]))
+        else:
+            updated.append(add_cover_art_url(entry["track"]))
+    return inserted, updated, deleted
+
+
+@timed("changes.since")
+def get_changes_since(user_id, cursor, limit=MAX_CHANGES_PER_PAGE, now=None):
+    """
+    Library changes after a cursor
+
+    Args:
+        user_id: User ID
+        cursor: Cursor from a snapshot or an earlier call
+        limit: Max change log entries to read
+        now: Reference time in epoch seconds (defaults to now)
+
+    Returns:
+        Dict with inserted (tracks), updated (tracks), deleted (track IDs),
+        the next cursor and whether more changes are waiting (hasMore)
+
+    Raises:
+        CursorExpired if changes after the cursor may be gone, or a change
+            too large to log track by track happened since
+        ValueError if the cursor is malformed
+    """
+    now = int(now or time.time())
+    since, issued_at = decode_cursor(cursor)
+    if cursor_expired(cursor, now):
+        increment("changes.expired")
+        raise CursorExpired(f"Cursor {cursor} is older than the change log")
+
+    head, head_at = get_library_seq(user_id)
+    if since > head:
+        # Issued for a log that has since been reset
+        raise CursorExpired(f"Cursor {cursor} is ahead of the change log ({head})")
+
+    entries = get_library_changes(user_id, since, limit) if since < head else []
+
+    # Only hand out a gap-free prefix, so an entry still being written is
+    # never skipped past
+    expected = since + 1
+    contiguous = []
+    for entry in entries:
+        seq = int(entry["seq"])
+        if seq != expected:
+            if now - int(entry["changedAt"]) <= CHANGE_LOG_GAP_TIMEOUT_SECONDS:
+                break
+            logger.warning(
+                "Skipping abandoned change log seqs %d-%d of user %s", expected, seq - 1, user_id
+            )
+        contiguous.append(entry)
+        expected = seq + 1
+    last_seen = expected - 1
+
+    if any(entry["op"] == "reset" for entry in contiguous):
+        increment("changes.reset")
+        raise CursorExpired(f"Library of user {user_id} changed too much since {cursor}")
+
+    if not entries and since < head and head_at is not None:
+        # Nothing written after the cursor yet, skip it once abandoned
+        if now - head_at > CHANGE_LOG_GAP_TIMEOUT_SECONDS:
+            last_seen = head
+
+    # The next cursor is as old as the oldest change the client still lacks
+    if last_seen >= head:
+        issued_at = now
+    elif contiguous:
+        issued_at = int(contiguous[-1]["changedAt"])
+
+    inserted, updated, deleted = _compact(contiguous)
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": deleted,
+        "cursor": encode_cursor(last_seen, issued_at),
+        "hasMore": last_seen < head and len(entries) == limit == len(contiguous),
+    }
@@ -0,0 +1,316 @@
+import hashlib
+import heapq
+import os
+import struct
+
+from shared.config import get_logger
+from shared.db import (
+    clear_library_sketch,
+    get_friend_ids,
+    get_library_sketch,
+    get_library_sketches,
+    get_library_state,
+    iter_library_track_ids,
+    set_library_sketch,
+)
+from shared.instrumentation import increment, timed
+
+logger = get_logger(__name__)
+
+# Hashes kept per library; estimates are within about 1/sqrt(size) of the
+# Jaccard similarity, and libraries up to this size are represented exactly
+LIBRARY_SKETCH_SIZE = int(os.environ.get("LIBRARY_SKETCH_SIZE", "256"))
+MAX_UPDATE_ATTEMPTS = 3
+
+_HASH = struct.Struct(">Q")
+
+
+def track_hash(track_id):
+    """64-bit hash of a library track ID."""
+    return int.from_bytes(
+        hashlib.blake2b(track_id.encode("utf-8"), digest_size=8).digest(), "big"
+    )
+
+
+def _pack(hashes):
+    return b"".join(_HASH.pack(value) for value in hashes)
+
+
+def _unpack(data):
+    # DynamoDB returns binary attributes wrapped in a Binary object
+    data = bytes(data)
+    return [value for (value,) in _HASH.iter_unpack(data)]
+
+
+def build_sketch(track_ids, size=LIBRARY_SKETCH_SIZE):
+    """
+    Bottom-k MinHash sketch of a library: the size smallest track hashes
+    and the number of tracks
+
+    Args:
+        track_ids: Iterable of distinct track IDs
+        size: Number of hashes to keep
+
+    Returns:
+        Sketch dict ({"count", "hashes"}, hashes packed as sorted 8-byte
+        big-endian integers)
+    """
+    count = 0
+
+    def hashes():
+        nonlocal count
+        for track_id in track_ids:
+            count += 1
+            yield track_hash(track_id)
+
+    smallest = heapq.nsmallest(size, hashes())
+    return {"count": count, "hashes": _pack(smallest)}
+
+
+def add_to_sketch(sketch, track_ids, size=LIBRARY_SKETCH_SIZE):
+    """Sketch with tracks that were not in the library added."""
+    hashes = set(_unpack(sketch["hashes"]))
+    hashes.update(track_hash(track_id) for track_id in track_ids)
+    return {
+        "count": int(sketch["count"]) + len(track_ids),
+        "hashes": _pack(heapq.nsmallest(size, hashes)),
+    }
+
+
+def remove_from_sketch(sketch, track_ids):
+    """
+    Sketch with library tracks removed
+
+    Returns:
+        The new sketch dict, or None if a removed track was one of the kept
+        hashes of a sketch that does not hold the whole library: its
+        replacement is unknown and the sketch must be rebuilt
+    """
+    hashes = _unpack(sketch["hashes"])
+    count = int(sketch["count"])
+    removed = {track_hash(track_id) for track_id in track_ids}
+    if count > len(hashes) and hashes and min(removed) <= hashes[-1]:
+        return None
+    return {
+        "count": max(0, count - len(track_ids)),
+        "hashes": _pack(value for value in hashes if value not in removed),
+    }
+
+
+def estimate_overlap(sketch, other):
+    """
+    Estimate how many tracks two libraries share from their sketches
+
+    The k smallest hashes of the union are the k smallest of both sketches
+    combined; the fraction of them present in both estimates the Jaccard
+    similarity J, and the track counts turn it into an intersection size,
+    J * (|A| + |B|) / (1 + J). Sketches holding whole libraries are
+    compared exactly.
+
+    Returns:
+        Dict with sharedTracks, jaccard and whether the result is exact
+    """
+    hashes, other_hashes = _unpack(sketch["hashes"]), _unpack(other["hashes"])
+    count, other_count = int(sketch["count"]), int(other["count"])
+    exact = len(hashes) == count and len(other_hashes) == other_count
+    if not hashes or not other_hashes:
+        return {"sharedTracks": 0, "jaccard": 0.0, "exact": exact}
+
+    mine, theirs = set(hashes), set(other_hashes)
+    if exact:
+        shared = len(mine & theirs)
+        union = count + other_count - shared
+        return {"sharedTracks": shared, "jaccard": round(shared / union, 4), "exact": True}
+
+    union_sample = heapq.nsmallest(min(len(hashes), len(other_hashes)), mine | theirs)
+    in_both = sum(1 for value in union_sample if value in mine and value in theirs)
+    jaccard = in_both / len(union_sample)
+    shared = jaccard * (count + other_count) / (1 + jaccard)
+    return {
+        "sharedTracks": min(round(shared), count, other_count),
+        "jaccard": round(jaccard, 4),
+        "exact": False,
+    }
+
+
+@timed("sketch.rebuild")
+def rebuild_sketch(user_id):
+    """
+    Compute a user's sketch from the library table and store it
+
+    Returns:
+        The stored sketch dict
+    """
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        current = get_library_sketch(user_id, consistent=True)
+        version = int(current["version"]) if current else None
+        state = get_library_state(user_id)
+        sketch = build_sketch(
+            track_id for track_id, (_, deleted, _) in state.items() if not deleted
+        )
+        sketch["version"] = (version or 0) + 1
+        if set_library_sketch(user_id, sketch, expected_version=version):
+            increment("sketch.rebuilds")
+            return sketch
+    raise RuntimeError(f"Sketch for user {user_id} kept changing during rebuild")
+
+
+def get_sketch(user_id):
+    """A user's sketch, built on first use."""
+    return get_library_sketch(user_id) or rebuild_sketch(user_id)
+
+
+def _update(user_id, change, library_track_ids=None):
+    """
+    Apply a change to the stored sketch without reading the library. Falls
+    back to a rebuild if the change cannot be applied incrementally or
+    other updates keep winning. A missing sketch is built from
+    library_track_ids if given.
+    """
+    for _ in range(MAX_UPDATE_ATTEMPTS):
+        current = get_library_sketch(user_id, consistent=True)
+        if not current:
+            if library_track_ids is None:
+                return None
+            return _build_missing(user_id, library_track_ids)
+        sketch = change(current)
+        if sketch is None:
+            break
+        sketch["version"] = int(current["version"]) + 1
+        if set_library_sketch(user_id, sketch, expected_version=current["version"]):
+            increment("sketch.updates")
+            return sketch
+    return rebuild_sketch(user_id)
+
+
+def _build_missing(user_id, library_track_ids):
+    """First sketch of a user from track IDs the caller holds in memory."""
+    sketch = build_sketch(library_track_ids)
+    sketch["version"] = 1
+    if set_library_sketch(user_id, sketch, expected_version=None):
+        increment("sketch.builds")
+        return sketch
+    # Someone else stored one meanwhile; it is as new as ours or gets our
+    # tracks from the sync that wrote them
+    return None
+
+
+def refresh_sketch(
+    user_id, added_track_ids=(), removed_track_ids=(), rebuild=False, library_track_ids=None
+):
+    """
+    Bring the sketch up to date after a library change, best effort
+
+    Args:
+        user_id: User ID
+        added_track_ids: Tracks that were added to the library
+        removed_track_ids: Tracks that were deleted from the library
+        rebuild: Recompute the sketch from the library table instead, e.g.
+            when it is unknown which writes went through
+        library_track_ids: Iterable of every track ID in the library after
+            the change, if the caller holds them (a sync does); a user
+            without a sketch gets one built from them
+
+    Users without a sketch get theirs built by their next sync that adds
+    tracks (or their own first overlap query). A failure never fails the
+    caller: the sketch is dropped instead, so it is rebuilt rather than
+    used stale.
+    """
+    try:
+        if rebuild:
+            rebuild_sketch(user_id)
+        elif added_track_ids:
+            _update(
+                user_id,
+                lambda sketch: add_to_sketch(sketch, added_track_ids),
+                library_track_ids=library_track_ids,
+            )
+        elif removed_track_ids:
+            _update(user_id, lambda sketch: remove_from_sketch(sketch, removed_track_ids))
+    except Exception as e:
+        logger.warning("Library sketch refresh failed for user %s: %s", user_id, e)
+        try:
+            clear_library_sketch(user_id)
+        except Exception as clear_error:
+            logger.error("Could not drop sketch for user %s: %s", user_id, clear_error)
+
+
+@timed("sketch.rank_friends")
+def rank_friends_by_overlap(user_id):
+    """
+    Rank a user's friends by how many tracks their libraries share, from
+    sketches alone
+
+    Friends without a sketch yet are not read here (a rebuild scans their
+    whole library); they are listed last as pending until their next sync
+    builds it.
+
+    Returns:
+        List of {"friendId", "displayName", "sharedTracks", "jaccard",
+        "libraryTracks", "exact"} dicts, most shared tracks first, followed
+        by {"friendId", "displayName", "pending": True} dicts
+    """
+    friend_ids = get_friend_ids(user_id)
+    if not friend_ids:
+        return []
+
+    sketch = get_sketch(user_id)
+    ranking, pending = [], []
+    for friend_id, friend in get_library_sketches(friend_ids).items():
+        friend_sketch = friend.get("librarySketch")
+        if not friend_sketch:
+            pending.append(
+                {"friendId": friend_id, "displayName": friend.get("displayName"), "pending": True}
+            )
+            continue
+        ranking.append(
+            {
+                "friendId": friend_id,
+                "displayName": friend.get("displayName"),
+                **estimate_overlap(sketch, friend_sketch),
+                "libraryTracks": int(friend_sketch["count"]),
+            }
+        )
+    ranking.sort(key=lambda entry: (-entry["sharedTracks"], -entry["jaccard"]))
+    if pending:
+        increment("sketch.pending_friends", len(pending))
+    return ranking + pending
+
+
+@timed("sketch.exact_overlap")
+def exact_overlap(user_id, other_user_id):
+    """
+    Count the tracks two libraries share exactly
+
+    Both libraries are read key-only in track ID order and merged like
+    sorted lists, so memory stays constant whatever their size.
+
+    Returns:
+        Dict with sharedTracks, jaccard, libraryTracks (of the other user)
+        and exact
+    """
+    mine, theirs = iter_library_track_ids(user_id), iter_library_track_ids(other_user_id)
+    count = other_count = shared = 0
+    a, b = next(mine, None), next(theirs, None)
+    while a is not None and b is not None:
+        if a == b:
+            shared += 1
+            count += 1
+            other_count += 1
+            a, b = next(mine, None), next(theirs, None)
+        elif a < b:
+            count += 1
+            a = next(mine, None)
+        else:
+            other_count += 1
+            b = next(theirs, None)
+    count += (a is not None) + sum(1 for _ in mine)
+    other_count += (b is not None) + sum(1 for _ in theirs)
+
+    union = count + other_count - shared
+    return {
+        "sharedTracks": shared,
+        "jaccard": round(shared / union, 4) if union else 0.0,
+        "libraryTracks": other_count,
+        "exact": True,
+    }
@@ -0,0 +1,312 @@
+import boto3
+import gzip
+import json
+import os
+import secrets
+import time
+from datetime import datetime, timezone
+
+from shared.config import get_logger
+from shared.cover_art import add_cover_art_url
+from shared.db import (
+    CHANGE_LOG_RETENTION_SECONDS,
+    clear_library_snapshot,
+    get_library_seq,
+    get_library_snapshot,
+    iter_user_library,
+    set_library_snapshot,
+)
+from shared.instrumentation import increment, span, timed
+from shared.library_changes import decode_cursor, encode_cursor
+from shared.responses import DecimalEncoder
+
+logger = get_logger(__name__)
+
+SNAPSHOT_BUCKET = os.environ.get("LIBRARY_SNAPSHOT_BUCKET", "melodiary-library-snapshots")
+# Optional CDN origin serving the bucket (e.g. CloudFront); presigned S3 URLs otherwise
+SNAPSHOT_CDN_URL = os.environ.get("LIBRARY_SNAPSHOT_CDN_URL", "").rstrip("/")
+SNAPSHOT_URL_TTL_SECONDS = int(os.environ.get("LIBRARY_SNAPSHOT_URL_TTL_SECONDS", "900"))
+# Object keys are unique per version, so the content behind a URL never changes
+SNAPSHOT_CACHE_CONTROL = "max-age=31536000, immutable"
+MAX_PUBLISH_ATTEMPTS = 3
+
+# Only what the frontend renders, the owner is implied by the snapshot
+_SKIPPED_ATTRIBUTES = ("userId", "contentHash")
+
+_s3_client = None
+
+
+def _get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            "s3",
+            region_name=os.environ.get("AWS_REGION", "eu-central-1"),
+            endpoint_url=os.environ.get("S3_ENDPOINT") or None,
+        )
+    return _s3_client
+
+
+def _object_key(user_id, version):
+    # The random part makes the key unguessable, which keeps CDN URLs private
+    return f"libraries/{user_id}/v{version}-{secrets.token_urlsafe(12)}.json.gz"
+
+
+def encode_snapshot(version, generated_at, items, cursor=None):
+    """Gzipped JSON body of a snapshot object."""
+    document = {
+        "version": version,
+        "generatedAt": generated_at,
+        "cursor": cursor,
+        "count": len(items),
+        "items": items,
+    }
+    with span("snapshot.encode"):
+        body = json.dumps(document, cls=DecimalEncoder, separators=(",", ":"))
+        return gzip.compress(body.encode("utf-8"), compresslevel=6)
+
+
+def decode_snapshot(body):
+    """Inverse of encode_snapshot."""
+    return json.loads(gzip.decompress(body))
+
+
+def _strip(item):
+    return add_cover_art_url({k: v for k, v in item.items() if k not in _SKIPPED_ATTRIBUTES})
+
+
+def _publish(user_id, current, items, cursor):
+    """
+    Upload a new snapshot version and swap the user's pointer to it
+
+    Args:
+        user_id: User ID
+        current: Snapshot being replaced, or None
+        items: Library items of the new snapshot
+        cursor: Change feed cursor the items are up to date with
+
+    Returns:
+        The new snapshot dict, or None if a concurrent publisher won
+    """
+    version = int(current["version"]) + 1 if current else 1
+    generated_at = datetime.now(timezone.utc).isoformat()
+    key = _object_key(user_id, version)
+    body = encode_snapshot(version, generated_at, items, cursor)
+
+    s3 = _get_s3_client()
+    with span("s3.put_object"):
+        s3.put_object(
+            Bucket=SNAPSHOT_BUCKET,
+            Key=key,
+            Body=body,
+            ContentType="application/json",
+            ContentEncoding="gzip",
+            CacheControl=SNAPSHOT_CACHE_CONTROL,
+        )
+
+    snapshot = {
+        "version": version,
+        "key": key,
+        "count": len(items),
+        "size": len(body),
+        "generatedAt": generated_at,
+        "cursor": cursor,
+    }
+    if current:
+        snapshot["previousKey"] = current["key"]
+
+    if not set_library_snapshot(user_id, snapshot, current["version"] if current else None):
+        with span("s3.delete_object"):
+            s3.delete_object(Bucket=SNAPSHOT_BUCKET, Key=key)
+        return None
+
+    # Keep one older version around for clients still holding its URL
+    stale_key = current.get("previousKey") if current else None
+    if stale_key:
+        with span("s3.delete_object"):
+            s3.delete_object(Bucket=SNAPSHOT_BUCKET, Key=stale_key)
+    return snapshot
+
+
+@timed("snapshot.rebuild")
+def rebuild_snapshot(user_id):
+    """
+    Regenerate a user's snapshot from the library table
+
+    A rebuild that loses the pointer swap to a concurrent one returns the
+    winner's snapshot when that is at least as new as its own would have
+    been, so concurrent first requests share one rebuild's result.
+
+    Returns:
+        The published snapshot dict
+    """
+    for _ in range(MAX_PUBLISH_ATTEMPTS):
+        current = get_library_snapshot(user_id, consistent=True)
+        # Read before the library, so changes racing the read are replayed
+        # by the client instead of missed
+        seq, _ = get_library_seq(user_id)
+        cursor = encode_cursor(seq)
+        items = [_strip(item) for item in iter_user_library(user_id, consistent=True)]
+        snapshot = _publish(user_id, current, items, cursor)
+        if snapshot:
+            increment("snapshot.rebuilds")
+            logger.info(
+                "Published library snapshot v%d for user %s (%d tracks, %d bytes)",
+                snapshot["version"],
+                user_id,
+                snapshot["count"],
+                snapshot["size"],
+            )
+            return snapshot
+
+        winner = get_library_snapshot(user_id, consistent=True)
+        if winner and winner.get("cursor") and decode_cursor(winner["cursor"])[0] >= seq:
+            increment("snapshot.rebuild_races")
+            return winner
+    raise RuntimeError(f"Snapshot for user {user_id} kept changing during rebuild")
+
+
+def _patch(user_id, change, change_seqs=None):
+    """
+    Apply a change to the current snapshot's items without re-reading the
+    library. Falls back to a rebuild if the snapshot changed meanwhile.
+
+    Args:
+        user_id: User ID
+        change: Function mapping the snapshot's items to the new items
+        change_seqs: (first, last) change log seqs of the change, advances
+            the snapshot's cursor if they directly follow it
+
+    Returns:
+        The published snapshot dict, or None if the user has no snapshot yet
+    """
+    current = get_library_snapshot(user_id, consistent=True)
+    if not current:
+        return None
+
+    s3 = _get_s3_client()
+    with span("s3.get_object"):
+        body = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=current["key"])["Body"].read()
+    items = change(decode_snapshot(body)["items"])
+
+    # Otherwise keep the old cursor, replaying changes already applied is harmless
+    cursor = current.get("cursor")
+    if cursor and change_seqs and change_seqs[0] == decode_cursor(cursor)[0] + 1:
+        cursor = encode_cursor(change_seqs[1])
+
+    snapshot = _publish(user_id, current, items, cursor)
+    if snapshot:
+        increment("snapshot.patches")
+        return snapshot
+    return rebuild_snapshot(user_id)
+
+
+@timed("snapshot.add_tracks")
+def add_tracks_to_snapshot(user_id, items, change_seqs=None):
+    """
+    Merge written library items (new or updated) into the current snapshot
+
+    Args:
+        user_id: User ID
+        items: Library items
+        change_seqs: (first, last) change log seqs the items were logged under
+
+    Returns:
+        The published snapshot dict, or None if the user has no snapshot yet
+    """
+    def change(existing):
+        merged = {item["trackId"]: item for item in existing}
+        merged.update((item["trackId"], _strip(item)) for item in items)
+        # Same order as the library table returns them (sort key descending)
+        return sorted(merged.values(), key=lambda item: item["trackId"], reverse=True)
+
+    return _patch(user_id, change, change_seqs)
+
+
+@timed("snapshot.remove_tracks")
+def remove_tracks_from_snapshot(user_id, track_ids):
+    """
+    Patch deleted tracks out of the current snapshot
+
+    Returns:
+        The published snapshot dict, or None if the user has no snapshot yet
+    """
+    removed = set(track_ids)
+    return _patch(
+        user_id, lambda existing: [item for item in existing if item["trackId"] not in removed]
+    )
+
+
+def refresh_snapshot(user_id, added_items=None, removed_track_ids=None, change_seqs=None):
+    """
+    Bring the snapshot up to date after a library change, best effort
+
+    Args:
+        user_id: User ID
+        added_items: Library items that were just written, merged into the
+            existing snapshot
+        removed_track_ids: Track IDs that were deleted, patched out of the
+            existing snapshot
+        change_seqs: (first, last) change log seqs of the added items
+
+    Without either the snapshot is rebuilt from the library table. Users
+    without a snapshot get theirs built by their first snapshot request.
+    A failure never fails the caller: the pointer is dropped instead, so the
+    next snapshot request rebuilds it rather than serving stale data.
+    """
+    try:
+        if added_items is not None:
+            add_tracks_to_snapshot(user_id, added_items, change_seqs)
+        elif removed_track_ids:
+            remove_tracks_from_snapshot(user_id, removed_track_ids)
+        else:
+            rebuild_snapshot(user_id)
+    except Exception as e:
+        logger.warning("Library snapshot refresh failed for user %s: %s", user_id, e)
+        try:
+            clear_library_snapshot(user_id)
+        except Exception as clear_error:
+            logger.error("Could not drop snapshot for user %s: %s", user_id, clear_error)
+
+
+def _cursor_age(cursor):
+    return time.time() - decode_cursor(cursor)[1]
+
+
+def snapshot_url(snapshot):
+    """URL the client downloads a snapshot object from."""
+    if SNAPSHOT_CDN_URL:
+        return f"{SNAPSHOT_CDN_URL}/{snapshot['key']}"
+    with span("s3.presign"):
+        return _get_s3_client().generate_presigned_url(
+            "get_object",
+            Params={"Bucket": SNAPSHOT_BUCKET, "Key": snapshot["key"]},
+            ExpiresIn=SNAPSHOT_URL_TTL_SECONDS,
+        )
+
+
+@timed("snapshot.get_download")
+def get_snapshot_download(user_id):
+    """
+    Get the download descriptor for a user's snapshot, building it on first use
+
+    Snapshots whose cursor is halfway to leaving the change log are rebuilt,
+    so a client starting from one can always follow the change feed.
+
+    Returns:
+        Dict with url, version, count, generatedAt, cursor and expiresIn
+    """
+    snapshot = get_library_snapshot(user_id)
+    if not snapshot or not snapshot.get("cursor") or _cursor_age(snapshot["cursor"]) > (
+        CHANGE_LOG_RETENTION_SECONDS / 2
+    ):
+        snapshot = rebuild_snapshot(user_id)
+
+    return {
+        "url": snapshot_url(snapshot),
+        "version": snapshot["version"],
+        "count": snapshot["count"],
+        "generatedAt": snapshot["generatedAt"],
+        "cursor": snapshot["cursor"],
+        "expiresIn": None if SNAPSHOT_CDN_URL else SNAPSHOT_URL_TTL_SECONDS,
+    }
@@ -0,0 +1,265 @@
+import os
+import time
+import uuid
+
+from shared.audio_features import AUDIO_FEATURES_ENABLED, enrich_batch
+from shared.config import get_logger
+from shared.db import (
+    acquire_sync_lease,
+    get_library_state,
+    get_platform_connection,
+    get_platform_connections,
+    record_sync_result,
+    release_sync_lease,
+    store_tracks,
+)
+from shared.fetch_engine import FetchError, fetch_libraries
+from shared.instrumentation import increment
+from shared.library_sketch import refresh_sketch
+from shared.library_snapshot import refresh_snapshot
+from shared.providers import get_provider
+
+logger = get_logger(__name__)
+
+# Upper bound on one sync; a crashed sync blocks others for at most this long
+SYNC_LEASE_SECONDS = int(os.environ.get("SYNC_LEASE_SECONDS", "120"))
+# Sync requests this soon after a finished sync get its result instead
+SYNC_DEBOUNCE_SECONDS = int(os.environ.get("SYNC_DEBOUNCE_SECONDS", "60"))
+# How long a user-initiated request waits for a sync already in flight,
+# kept below the API Gateway timeout
+SYNC_WAIT_SECONDS = float(os.environ.get("SYNC_WAIT_SECONDS", "25"))
+SYNC_POLL_INTERVAL = 1.0
+
+
+class SyncError(Exception):
+    """A sync that could not complete, with the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _recent_result(connection):
+    """The last sync's summary if it finished within the debounce window."""
+    finished = connection.get("lastSyncedEpoch")
+    if finished is None or "lastSyncResult" not in connection:
+        return None
+    if int(finished) <= time.time() - SYNC_DEBOUNCE_SECONDS:
+        return None
+    return connection["lastSyncResult"]
+
+
+def _claim(user_id, platform, user_initiated):
+    """
+    Take the sync lease of one connection, or find the result to answer with
+
+    Returns:
+        Tuple of (lease owner, connection, None) if the caller should sync,
+        or (None, None, summary) if another sync's result answers the request
+
+    Raises:
+        SyncError if the platform is not connected
+    """
+    owner = str(uuid.uuid4())
+    deadline = time.monotonic() + (SYNC_WAIT_SECONDS if user_initiated else 0)
+    # No upfront connection read: the lease is only granted on an existing
+    # connection, and returns it with the tokens for the token manager
+    while not (
+        leased := acquire_sync_lease(
+            user_id, platform, owner, SYNC_LEASE_SECONDS, SYNC_DEBOUNCE_SECONDS
+        )
+    ):
+        connection = get_platform_connection(user_id, platform, consistent=True)
+        if not connection:
+            raise SyncError(f"{get_provider(platform).display_name} not connected", 400)
+
+        recent = _recent_result(connection)
+        if recent is not None:
+            increment("sync.coalesced")
+            logger.info("Returning the result of a recent %s sync for user %s", platform, user_id)
+            return None, None, dict(recent, coalesced=True)
+
+        if time.monotonic() >= deadline:
+            increment("sync.in_progress")
+            return None, None, {
+                "synced": 0,
+                "inProgress": True,
+                "message": "A sync is already in progress",
+            }
+        time.sleep(SYNC_POLL_INTERVAL)
+    return owner, leased, None
+
+
+def _store(user_id, platform, batch, user_initiated, lease_owner):
+    """Write a fetched library and record the sync result on its connection."""
+    if not len(batch) and not batch.malformed:
+        summary = {"synced": 0, "message": "No tracks found in library"}
+        record_sync_result(user_id, platform, summary, user_initiated, lease_owner)
+        return summary
+
+    state = get_library_state(user_id)
+    if AUDIO_FEATURES_ENABLED:
+        enrich_batch(user_id, batch, state)
+
+    logger.info("Saving %d %s tracks to DB...", len(batch), platform)
+    result = store_tracks(user_id, batch, state=state)
+    saved_count = result["written"] + result["unchanged"]
+
+    summary = {
+        "synced": saved_count,
+        "changed": result["written"],
+        "malformed": batch.malformed,
+        "message": f"Synced {saved_count} tracks from {get_provider(platform).display_name}",
+    }
+    if result["failed"]:
+        # Recorded as incomplete, so the next sync is not debounced and
+        # writes the missing tracks (they are not in the library state)
+        increment("sync.partial")
+        summary["failed"] = result["failed"]
+        summary["partial"] = True
+        summary["message"] += f", {result['failed']} could not be saved"
+    record_sync_result(
+        user_id, platform, summary, user_initiated, lease_owner, complete=not result["failed"]
+    )
+
+    if result["failed"]:
+        # Some writes failed, only the table knows what was stored
+        refresh_snapshot(user_id)
+        refresh_sketch(user_id, rebuild=True)
+    elif result["items"]:
+        refresh_snapshot(
+            user_id,
+            added_items=result["items"],
+            change_seqs=(result["firstSeq"], result["lastSeq"]),
+        )
+        # The whole library is in memory, enough to build a missing sketch
+        # for friends' rankings without reading it again
+        refresh_sketch(
+            user_id,
+            added_track_ids=[
+                item["trackId"] for item in result["items"] if item["trackId"] not in state
+            ],
+            library_track_ids=_library_track_ids(state, result["items"]),
+        )
+    return summary
+
+
+def _library_track_ids(state, written_items):
+    """Track IDs in a library after a sync, from its state before and the written items."""
+    for track_id, (_, deleted, _) in state.items():
+        if not deleted:
+            yield track_id
+    # Soft-deleted tracks are never written again
+    for item in written_items:
+        if item["trackId"] not in state:
+            yield item["trackId"]
+
+
+def _combine(summaries):
+    """One summary for a multi-platform sync, each platform's under "platforms"."""
+    succeeded = [summary for summary in summaries.values() if "error" not in summary]
+    synced = sum(summary.get("synced", 0) for summary in succeeded)
+    names = ", ".join(
+        get_provider(platform).display_name
+        for platform, summary in summaries.items()
+        if "error" not in summary
+    )
+    combined = {
+        "synced": synced,
+        "changed": sum(summary.get("changed", 0) for summary in succeeded),
+        "malformed": sum(summary.get("malformed", 0) for summary in succeeded),
+        "message": f"Synced {synced} tracks from {names}",
+        "platforms": summaries,
+    }
+    failed = sum(summary.get("failed", 0) for summary in succeeded)
+    if failed:
+        combined["failed"] = failed
+        combined["partial"] = True
+    if any(summary.get("inProgress") for summary in succeeded):
+        combined["inProgress"] = True
+    return combined
+
+
+def sync_library(user_id, user_initiated=False, platforms=None):
+    """
+    Fetch a user's saved tracks from their streaming services and store
+    them in the library
+
+    Shared by the fetch_library endpoint and the scheduled sync worker.
+    The fetch engine downloads every platform concurrently, so a sync takes
+    as long as the slowest one. Syncs are coalesced per connection through
+    a lease: a request arriving while a sync is in flight waits for its
+    result (user-initiated requests only), and one arriving within
+    SYNC_DEBOUNCE_SECONDS of a finished sync gets that sync's summary.
+
+    Args:
+        user_id: User ID
+        user_initiated: Whether the user asked for this sync (counts as activity)
+        platforms: Platforms to sync, all connected ones with a provider by default
+
+    Returns:
+        Sync summary dict ({"synced", "changed", "malformed", "message"}),
+        with "failed" and "partial" set if some tracks could not be saved,
+        "coalesced" set if it is the result of another request's sync,
+        or {"inProgress": True, ...} if that sync did not finish in time.
+        Syncs of several platforms put each one's summary under "platforms",
+        failed ones with an "error".
+
+    Raises:
+        SyncError if nothing is connected, or every platform failed
+    """
+    if platforms is None:
+        platforms = [
+            connection["platform"]
+            for connection in get_platform_connections(user_id)
+            if get_provider(connection["platform"])
+        ]
+        if not platforms:
+            raise SyncError("No streaming service connected", 400)
+    for platform in platforms:
+        if get_provider(platform) is None:
+            raise SyncError(f"Syncing {platform} is not supported", 400)
+
+    summaries, owners, connections, errors = {}, {}, {}, {}
+    try:
+        for platform in platforms:
+            owner, connection, summary = _claim(user_id, platform, user_initiated)
+            if owner:
+                owners[platform] = owner
+                connections[platform] = connection
+            else:
+                summaries[platform] = summary
+
+        if owners:
+            logger.info("Fetching saved tracks for user %s from %s...", user_id, ", ".join(owners))
+            fetched = fetch_libraries(user_id, list(owners), connections)
+            for platform in list(owners):
+                if isinstance(fetched[platform], FetchError):
+                    errors[platform] = fetched[platform]
+                    continue
+                summaries[platform] = _store(
+                    user_id, platform, fetched[platform], user_initiated, owners[platform]
+                )
+                # Released by record_sync_result
+                del owners[platform]
+    finally:
+        # Failed or crashed before storing, let the next request retry right away
+        for platform, owner in owners.items():
+            release_sync_lease(user_id, platform, owner)
+
+    if len(platforms) == 1:
+        if errors:
+            raise SyncError(errors[platforms[0]].message, errors[platforms[0]].status_code)
+        return summaries[platforms[0]]
+
+    if len(errors) == len(platforms):
+        raise SyncError("Failed to sync any streaming service", 502)
+    for platform, error in errors.items():
+        summaries[platform] = {"synced": 0, "error": error.message}
+    return _combine({platform: summaries[platform] for platform in platforms})
+
+
+def sync_spotify_library(user_id, user_initiated=False):
+    """sync_library of the Spotify connection alone."""
+    return sync_library(user_id, user_initiated, ["spotify"])
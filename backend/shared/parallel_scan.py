@@ -0,0 +1,82 @@
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.instrumentation import record_capacity
+
+_DONE = object()
+
+
+def scan_segment(table, segment, total_segments, start_key=None, **scan_kwargs):
+    """
+    Scan one segment of a table page by page
+
+    Args:
+        table: boto3 Table resource
+        segment: Segment number (0-based)
+        total_segments: Total number of segments the table is split into
+        start_key: Optional ExclusiveStartKey to resume from
+        **scan_kwargs: Extra Scan parameters (ProjectionExpression, ...)
+
+    Yields:
+        Tuple of (items of one page, LastEvaluatedKey or None when done,
+        consumed read capacity of the page)
+    """
+    kwargs = dict(scan_kwargs)
+    kwargs["Segment"] = segment
+    kwargs["TotalSegments"] = total_segments
+    kwargs["ReturnConsumedCapacity"] = "TOTAL"
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+
+    while True:
+        response = table.scan(**kwargs)
+        record_capacity("read", response)
+        last_key = response.get("LastEvaluatedKey")
+        consumed = response.get("ConsumedCapacity", {}).get("CapacityUnits", 0.0)
+        yield response.get("Items", []), last_key, consumed
+        if not last_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def parallel_scan(table, total_segments, max_workers=None, **scan_kwargs):
+    """
+    Scan a whole table with one thread per segment
+
+    Items are streamed back as soon as any segment returns a page, so memory
+    stays bounded by the number of pages in flight rather than the table size.
+
+    Args:
+        table: boto3 Table resource
+        total_segments: Number of segments to split the scan into
+        max_workers: Thread count (defaults to total_segments)
+        **scan_kwargs: Extra Scan parameters
+
+    Yields:
+        Items from all segments, in no particular order
+    """
+    pages = queue.Queue(maxsize=(max_workers or total_segments) * 2)
+
+    def run(segment):
+        try:
+            for items, _, _ in scan_segment(table, segment, total_segments, **scan_kwargs):
+                pages.put(items)
+        finally:
+            pages.put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=max_workers or total_segments) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, run, segment)
+            for segment in range(total_segments)
+        ]
+        remaining = total_segments
+        while remaining:
+            page = pages.get()
+            if page is _DONE:
+                remaining -= 1
+                continue
+            yield from page
+        for future in futures:
+            future.result()
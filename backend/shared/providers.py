@@ -0,0 +1,118 @@
+import os
+from abc import ABC, abstractmethod
+
+from shared.spotify_utils import (
+    get_audio_features,
+    get_saved_tracks_page,
+    parse_tracks_page,
+    refresh_access_token,
+)
+
+# Concurrent page requests per Spotify sync, within the app-wide rate limit
+SPOTIFY_FETCH_CONCURRENCY = int(os.environ.get("SPOTIFY_FETCH_CONCURRENCY", "4"))
+
+
+class LibraryProvider(ABC):
+    """
+    A streaming service libraries can be synced from
+
+    Subclasses implement blocking calls; the fetch engine runs them on a
+    thread pool of pool_size threads owned by the provider, so providers
+    never wait on each other. fetch_page is responsible for the service's
+    rate limit and retries (e.g. through a token bucket), the engine only
+    bounds how many pages are in flight.
+    """
+
+    name = None
+    display_name = None
+    page_size = 50
+    pool_size = 4
+    # Tracks per fetch_audio_features call, 0 if the service has no audio features
+    features_batch_size = 0
+
+    @abstractmethod
+    def refresh_tokens(self, refresh_token):
+        """
+        Exchange a refresh token for new tokens
+
+        Returns:
+            Tuple of (tokens dict with access_token and expires_at, error message)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def fetch_page(self, access_token, offset, limit):
+        """
+        Fetch one page of the user's saved tracks
+
+        Returns:
+            Tuple of (raw items, total saved tracks or None if unknown,
+            whether another page follows)
+
+        Raises:
+            Any exception if the page cannot be fetched
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def parse_page(self, items, batch):
+        """
+        Append a page of raw items to a TrackBatch, counting unparseable
+        ones in batch.malformed
+
+        Returns:
+            The batch
+        """
+        raise NotImplementedError
+
+    def fetch_audio_features(self, access_token, platform_track_ids):
+        """
+        Fetch audio features of up to features_batch_size tracks
+
+        Only called when features_batch_size is set.
+
+        Returns:
+            Dict of platform track ID -> features object ({"tempo",
+            "energy", "key", ...}), or None if the service has none
+
+        Raises:
+            Any exception if the call fails
+        """
+        return None
+
+
+class SpotifyProvider(LibraryProvider):
+    name = "spotify"
+    display_name = "Spotify"
+    page_size = 50
+    pool_size = SPOTIFY_FETCH_CONCURRENCY
+    features_batch_size = 100
+
+    def refresh_tokens(self, refresh_token):
+        return refresh_access_token(refresh_token)
+
+    def fetch_page(self, access_token, offset, limit):
+        return get_saved_tracks_page(access_token, offset, limit)
+
+    def parse_page(self, items, batch):
+        return parse_tracks_page(items, batch)
+
+    def fetch_audio_features(self, access_token, platform_track_ids):
+        return get_audio_features(access_token, platform_track_ids)
+
+
+_PROVIDERS = {"spotify": SpotifyProvider()}
+
+
+def register_provider(provider):
+    """Make a provider available to syncs, replacing one with the same name."""
+    _PROVIDERS[provider.name] = provider
+
+
+def get_provider(name):
+    """Registered provider by platform name, or None."""
+    return _PROVIDERS.get(name)
+
+
+def provider_names():
+    return list(_PROVIDERS)
@@ -0,0 +1,100 @@
+import boto3
+import json
+import os
+import threading
+
+from shared.config import get_logger
+
+logger = get_logger(__name__)
+
+SQS_MAX_BATCH_SIZE = 10
+
+_local_queues = {}
+_lock = threading.Lock()
+
+
+class SqsQueue:
+    """Sends JSON messages to an SQS queue in batches of 10."""
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client(
+            "sqs", region_name=os.environ.get("AWS_REGION", "eu-central-1")
+        )
+
+    def send_messages(self, bodies):
+        """
+        Send messages
+
+        Args:
+            bodies: List of JSON-serializable message bodies
+
+        Returns:
+            Number of messages accepted by SQS
+        """
+        sent = 0
+        for start in range(0, len(bodies), SQS_MAX_BATCH_SIZE):
+            chunk = bodies[start : start + SQS_MAX_BATCH_SIZE]
+            entries = [
+                {"Id": str(i), "MessageBody": json.dumps(body)}
+                for i, body in enumerate(chunk)
+            ]
+            response = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            failed = response.get("Failed", [])
+            if failed:
+                logger.error(
+                    "Failed to enqueue %d messages to %s: %s",
+                    len(failed),
+                    self.queue_url,
+                    failed[0].get("Message"),
+                )
+            sent += len(chunk) - len(failed)
+        return sent
+
+
+class LocalQueue:
+    """In-memory stand-in for SqsQueue, for local runs and tests."""
+
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def send_messages(self, bodies):
+        # Round-trip through JSON so local runs see exactly what SQS would carry
+        with self._lock:
+            self.messages.extend(json.loads(json.dumps(body)) for body in bodies)
+        return len(bodies)
+
+    def drain(self):
+        """Remove and return all queued messages."""
+        with self._lock:
+            messages, self.messages = self.messages, []
+        return messages
+
+
+def get_queue(url_env_name):
+    """
+    Get the queue configured by an environment variable
+
+    Args:
+        url_env_name: Name of the env var holding the SQS queue URL
+
+    Returns:
+        SqsQueue if the variable is set, otherwise a process-wide LocalQueue
+    """
+    queue_url = os.environ.get(url_env_name)
+    if queue_url:
+        return SqsQueue(queue_url)
+    with _lock:
+        return _local_queues.setdefault(url_env_name, LocalQueue())
+
+
+def sqs_messages(event):
+    """
+    Decode the JSON bodies of an SQS-triggered Lambda event
+
+    Yields:
+        Tuple of (message ID, decoded body)
+    """
+    for record in event.get("Records", []):
+        yield record["messageId"], json.loads(record["body"])
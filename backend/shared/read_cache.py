@@ -0,0 +1,104 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from shared.instrumentation import increment
+
+
+class TTLCache:
+    """
+    Bounded in-container cache: least recently used entries are evicted
+    first, and every entry expires ttl_seconds after it was stored.
+
+    Values are deep-copied in and out, so callers may mutate what they get.
+    Hits and misses are counted as cache.<name>.hits / cache.<name>.misses
+    in the current invocation's metrics, and in totals for the container.
+
+    Usage:
+        generation = cache.generation
+        value = cache.get(key)
+        if value is None:
+            value = load(key)
+            cache.put(key, value, generation)
+    """
+
+    def __init__(self, name, max_entries, ttl_seconds, clock=time.monotonic):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # Bumped by every invalidation, so loads that started before one
+        # never store what they read
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key):
+        """
+        Returns:
+            A copy of the cached value, or None if missing or expired
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        increment(f"cache.{self.name}.{'misses' if entry is None else 'hits'}")
+        return copy.deepcopy(entry[1]) if entry is not None else None
+
+    def put(self, key, value, generation=None):
+        """
+        Store a value
+
+        Args:
+            key: Cache key
+            value: Value to store, None is never cached
+            generation: self.generation read before the value was loaded;
+                the value is dropped if anything was invalidated since
+        """
+        if value is None or not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Totals since the container started (or the last clear)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from shared.config import get_logger
+from shared.db import take_request_token
+from shared.instrumentation import increment
+from shared.spotify_client import LocalTokenBucket
+
+logger = get_logger(__name__)
+
+# "dynamodb" shares each user's buckets between containers, "local" keeps
+# them per container and "off" disables the limits
+REQUEST_RATE_LIMITER = os.environ.get("REQUEST_RATE_LIMITER", "dynamodb")
+# Limit of every route without its own, per user
+REQUEST_RATE_PER_SECOND = float(os.environ.get("REQUEST_RATE_PER_SECOND", "5"))
+REQUEST_BURST = int(os.environ.get("REQUEST_BURST", "30"))
+# Buckets whose state a container remembers, least recently used dropped first
+REQUEST_LIMITER_MAX_KEYS = int(os.environ.get("REQUEST_LIMITER_MAX_KEYS", "10000"))
+
+# Routes that cost more than a page read: (requests per second, burst).
+# REQUEST_LIMITS, JSON of route -> {"perSecond", "burst"} or null for no
+# limit, overrides and extends these.
+ROUTE_LIMITS = {
+    "POST /library/sync": (1 / 30, 5),
+    "POST /library/sync/{platform}": (1 / 30, 5),
+    "POST /batch": (1, 10),
+    "GET /friends/overlap": (0.2, 10),
+    "GET /friends/{friendId}/overlap": (0.2, 10),
+    # Public, limited per source IP: a library page loads a burst of covers
+    "GET /cover-art/{imageId}/{size}": (20, 200),
+}
+
+_limiter = None
+_limiter_created = False
+_lock = threading.Lock()
+
+
+def _load_route_limits():
+    limits = dict(ROUTE_LIMITS)
+    configured = os.environ.get("REQUEST_LIMITS")
+    if not configured:
+        return limits
+    try:
+        for route, limit in json.loads(configured).items():
+            limits[route] = (float(limit["perSecond"]), int(limit["burst"])) if limit else None
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        logger.error("Ignoring invalid REQUEST_LIMITS: %s", e)
+    return limits
+
+
+route_limits = _load_route_limits()
+
+
+# Routes of the API, matched against the request path of events that carry
+# no route template (HTTP API $default or proxy integrations)
+ROUTE_TEMPLATES = (
+    "GET /library",
+    "GET /library/snapshot",
+    "GET /library/changes",
+    "DELETE /library/{trackId}",
+    "POST /library/sync",
+    "POST /library/sync/{platform}",
+    "POST /batch",
+    "GET /friends/overlap",
+    "GET /friends/{friendId}/overlap",
+    "GET /cover-art/{imageId}/{size}",
+)
+
+_PARAM = re.compile(r"^\{[^/]+\}$")
+
+
+def route_key(event):
+    """
+    Route of an API Gateway event as "METHOD /resource"
+
+    HTTP API (v2) events carry it as routeKey, REST API (v1) events as the
+    resource template. Without either, the request path is matched against
+    ROUTE_TEMPLATES, so the path parameters never become part of the key;
+    a path matching no route is keyed "METHOD *".
+    """
+    route = event.get("routeKey")
+    if route and route != "$default":
+        return route
+    method = event.get("httpMethod") or (
+        event.get("requestContext", {}).get("http", {}).get("method", "")
+    )
+    resource = event.get("resource")
+    if resource and "+}" not in resource:
+        return f"{method} {resource}"
+    path = event.get("path") or event.get("rawPath") or "/"
+    return _match_template(method, path)
+
+
+def _match_template(method, path):
+    segments = [s for s in path.split("/") if s]
+    for template in ROUTE_TEMPLATES:
+        template_method, template_path = template.split(" ", 1)
+        parts = [s for s in template_path.split("/") if s]
+        if template_method != method or len(parts) != len(segments):
+            continue
+        if all(p == s or _PARAM.match(p) for p, s in zip(parts, segments)):
+            return template
+    return f"{method} *"
+
+
+def route_limit(route):
+    """
+    Returns:
+        (requests per second, burst) of a route, None if it is not limited
+    """
+    if route in route_limits:
+        return route_limits[route]
+    return (REQUEST_RATE_PER_SECOND, REQUEST_BURST)
+
+
+class LocalRequestLimiter:
+    """
+    Token buckets per key in this container.
+
+    Used for local runs and as the fallback when the shared buckets are
+    unavailable; each container then enforces the limits on its own.
+    """
+
+    def __init__(self, max_keys=REQUEST_LIMITER_MAX_KEYS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key, rate, burst):
+        """
+        Take one request from a key's bucket
+
+        Returns:
+            0 if it was taken, otherwise seconds until it would be
+        """
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or (bucket.rate, bucket.capacity) != (rate, burst):
+                bucket = LocalTokenBucket(rate, burst, clock=self._clock)
+                self._buckets[key] = bucket
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return bucket.try_acquire()
+
+
+class DynamoDBRequestLimiter:
+    """
+    Token buckets per key in Melodiary-RateLimits, shared by all containers.
+
+    An admitted request costs one conditional write. The container keeps
+    the last state it saw of every bucket: while that shows the bucket
+    empty, requests are refused without calling DynamoDB, which is safe
+    because refilledAt never moves back.
+    """
+
+    def __init__(self, max_keys=REQUEST_LIMITER_MAX_KEYS, fallback=None, clock=time.time):
+        self.max_keys = max_keys
+        self.fallback = fallback or LocalRequestLimiter(max_keys)
+        self._clock = clock
+        self._refilled_at = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key, rate, burst):
+        """
+        Take one request from a key's shared bucket
+
+        Returns:
+            0 if it was taken, otherwise seconds until it would be
+        """
+        interval = 1 / rate
+        now = self._clock()
+        # Latest refill time at which the bucket still has a request left
+        latest = now + (burst - 1) * interval
+        with self._lock:
+            known = self._refilled_at.get(key)
+        if known is not None and known > latest:
+            increment("ratelimit.local_rejected")
+            return known - latest
+
+        try:
+            allowed, refilled_at = take_request_token(key, interval, burst, now, known)
+        except Exception as e:
+            # Never fail a request because the limiter table is unreachable
+            logger.warning("Shared request limiter unavailable, using local buckets: %s", e)
+            return self.fallback.check(key, rate, burst)
+
+        if refilled_at is not None:
+            with self._lock:
+                self._refilled_at[key] = max(refilled_at, self._refilled_at.get(key, 0))
+                self._refilled_at.move_to_end(key)
+                while len(self._refilled_at) > self.max_keys:
+                    self._refilled_at.popitem(last=False)
+        return 0.0 if allowed else refilled_at - latest
+
+
+def get_request_limiter():
+    """Get the request limiter configured by REQUEST_RATE_LIMITER, None when off."""
+    global _limiter, _limiter_created
+    if not _limiter_created:
+        with _lock:
+            if not _limiter_created:
+                _limiter = _create_request_limiter()
+                _limiter_created = True
+    return _limiter
+
+
+def set_request_limiter(limiter):
+    """Replace the request limiter (e.g. with a LocalRequestLimiter in tests), None disables it."""
+    global _limiter, _limiter_created
+    _limiter = limiter
+    _limiter_created = True
+
+
+def _create_request_limiter():
+    if REQUEST_RATE_LIMITER == "off":
+        return None
+    if REQUEST_RATE_LIMITER == "local":
+        return LocalRequestLimiter()
+    return DynamoDBRequestLimiter()
+
+
+def _check(caller, event):
+    limiter = get_request_limiter()
+    if limiter is None:
+        return 0.0
+    route = route_key(event)
+    limit = route_limit(route)
+    if limit is None:
+        return 0.0
+    rate, burst = limit
+    return limiter.check(f"{caller}#{route}", rate, burst)
+
+
+def check_request(user_id, event):
+    """
+    Count a request of a user against the limit of its route
+
+    Returns:
+        0 if the request is within the limit, otherwise seconds until it
+        would be
+    """
+    return _check(f"user#{user_id}", event)
+
+
+def source_ip(event):
+    """Client address of an API Gateway event, None if it has none."""
+    context = event.get("requestContext") or {}
+    return (context.get("identity") or {}).get("sourceIp") or (
+        context.get("http") or {}
+    ).get("sourceIp")
+
+
+def check_public_request(event):
+    """
+    Count a request to a public route against the limit of its source IP
+
+    Returns:
+        0 if the request is within the limit, otherwise seconds until it
+        would be
+    """
+    return _check(f"ip#{source_ip(event) or 'unknown'}", event)
@@ -1,6 +1,9 @@
 import json
+import math
 from decimal import Decimal
 
+from shared.instrumentation import span
+
 
 class DecimalEncoder(json.JSONEncoder):
     """Handles DynamoDB Decimal types during JSON serialization."""
@@ -24,11 +27,9 @@ def get_standard_cors_headers():
 
 def success_response(data, status_code=200):
     """Return a successful API response"""
-    return create_response(
-        status_code,
-        get_standard_cors_headers(),
-        json.dumps(data, cls=DecimalEncoder) if not isinstance(data, str) else data,
-    )
+    with span("serialize"):
+        body = json.dumps(data, cls=DecimalEncoder) if not isinstance(data, str) else data
+    return create_response(status_code, get_standard_cors_headers(), body)
 
 
 def error_response(message, status_code=400, details=None):
@@ -37,9 +38,18 @@ def error_response(message, status_code=400, details=None):
     if details:
         error_body["details"] = details
 
-    return create_response(
-        status_code, get_standard_cors_headers(), json.dumps(error_body, cls=DecimalEncoder)
-    )
+    with span("serialize"):
+        body = json.dumps(error_body, cls=DecimalEncoder)
+    return create_response(status_code, get_standard_cors_headers(), body)
+
+
+def rate_limited_response(retry_after):
+    """Return a 429 response telling the client when to retry"""
+    seconds = max(1, math.ceil(retry_after))
+    response = error_response("Too many requests", 429, {"retryAfter": seconds})
+    response["headers"]["Retry-After"] = str(seconds)
+    response["headers"]["Access-Control-Expose-Headers"] = "Retry-After"
+    return response
 
 
 def create_response(status_code, headers, body):
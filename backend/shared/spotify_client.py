@@ -0,0 +1,389 @@
+import math
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.config import get_logger
+from shared.db import take_request_token
+from shared.instrumentation import increment
+
+logger = get_logger(__name__)
+
+DEFAULT_TIMEOUT = 10
+RETRYABLE_STATUS_CODES = frozenset({500, 502, 503, 504})
+
+SPOTIFY_POOL_SIZE = int(os.environ.get("SPOTIFY_POOL_SIZE", "10"))
+SPOTIFY_MAX_RETRIES = int(os.environ.get("SPOTIFY_MAX_RETRIES", "4"))
+SPOTIFY_BACKOFF_BASE = float(os.environ.get("SPOTIFY_BACKOFF_BASE", "0.5"))
+SPOTIFY_BACKOFF_CAP = float(os.environ.get("SPOTIFY_BACKOFF_CAP", "8"))
+SPOTIFY_MAX_RETRY_AFTER = float(os.environ.get("SPOTIFY_MAX_RETRY_AFTER", "30"))
+
+# App-wide Web API budget, shared by every Lambda container
+SPOTIFY_RATE_LIMIT_PER_SECOND = float(os.environ.get("SPOTIFY_RATE_LIMIT_PER_SECOND", "10"))
+SPOTIFY_RATE_LIMIT_BURST = int(os.environ.get("SPOTIFY_RATE_LIMIT_BURST", "20"))
+SPOTIFY_RATE_LIMITER = os.environ.get("SPOTIFY_RATE_LIMITER", "dynamodb")
+SPOTIFY_BUCKET_ID = "spotify-web-api"
+
+_session = None
+_rate_limiter = None
+_lock = threading.Lock()
+
+
+class LocalTokenBucket:
+    """
+    In-process token bucket.
+
+    Used as the limiter for local runs and tests, and as the fallback when
+    the shared bucket is unavailable.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _try_take(self, tokens):
+        """Take tokens if available, otherwise return seconds to wait."""
+        with self._lock:
+            now = self._clock()
+            elapsed = max(0.0, now - self._updated_at)
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens without waiting
+
+        Returns:
+            0 if they were taken, otherwise seconds until they would be
+        """
+        return self._try_take(tokens)
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            wait = self._try_take(tokens)
+            if not wait:
+                return waited
+            self._sleep(wait)
+            waited += wait
+
+
+class DynamoDBTokenBucket:
+    """
+    Token bucket stored in a DynamoDB item, shared by all containers.
+
+    Each container claims a small lease of tokens per round trip and spends it
+    locally, so a busy sync costs one conditional write per `lease_size` calls
+    rather than one per call. Unused leases lapse after `lease_size / rate`
+    seconds so an idle container cannot hoard budget.
+
+    The item in Melodiary-RateLimits holds the time the bucket is full again
+    (`refilledAt`), so a claim is a single conditional UpdateItem
+    (db.take_request_token, as for the request limits) that moves it forward
+    by the claimed tokens' refill time. A refused claim returns the stored time,
+    which sizes the next claim or how long to sleep; that time only ever
+    moves forward, so a bucket seen empty is empty without asking again.
+    """
+
+    def __init__(
+        self,
+        bucket_id,
+        rate,
+        capacity,
+        lease_size=5,
+        fallback=None,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        self.bucket_id = bucket_id
+        self.rate = rate
+        self.capacity = capacity
+        self.lease_size = max(1, min(lease_size, capacity))
+        self.fallback = fallback or LocalTokenBucket(rate, capacity, sleep=sleep)
+        self._clock = clock
+        self._sleep = sleep
+        self._reserve = 0
+        self._reserve_expires_at = 0.0
+        # Last refilledAt seen in the table, None until the first claim
+        self._refilled_at = None
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available in the shared bucket
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                if self._reserve >= tokens and now < self._reserve_expires_at:
+                    self._reserve -= tokens
+                    return waited
+                try:
+                    wait = self._claim(max(tokens, self.lease_size), tokens, now)
+                except Exception as e:
+                    # Never fail a sync because the limiter table is unreachable
+                    logger.warning("Shared rate limiter unavailable, using local bucket: %s", e)
+                    wait = None
+            if wait is None:
+                return waited + self.fallback.acquire(tokens)
+            # Sleep without the lock, so other threads can spend a new reserve
+            if wait:
+                self._sleep(wait)
+                waited += wait
+
+    def _claim(self, wanted, needed, now):
+        """
+        Move up to `wanted` (at least `needed`) tokens from the shared bucket
+        into the local reserve
+
+        Returns:
+            0 if tokens were claimed (or a write race was lost), otherwise
+            seconds to wait before the bucket refills enough
+        """
+        interval = 1 / self.rate
+        # refilledAt of a bucket emptied now
+        empty_at = now + self.capacity * interval
+        known = self._refilled_at
+        if known is None or known <= now:
+            available = self.capacity
+        else:
+            # Times are stored to the millisecond, epoch floats are coarser
+            available = math.floor((empty_at - known) / interval + 1e-6)
+        if available < needed:
+            return max(known - (empty_at - needed * interval), 0.001)
+
+        granted = min(wanted, available)
+        allowed, refilled_at = take_request_token(
+            self.bucket_id, interval, self.capacity, now, known, tokens=granted
+        )
+        if refilled_at is None:
+            # Another container changed the bucket meanwhile, size the claim again
+            return 0.0
+        if not allowed:
+            # Emptier than we knew, the stored time sizes the next claim
+            self._refilled_at = max(refilled_at, known or 0.0)
+            return 0.0
+        self._refilled_at = refilled_at
+        self._reserve = granted
+        self._reserve_expires_at = now + granted * interval
+        return 0.0
+
+
+class ClientStats:
+    """Per-endpoint call, latency and throttle counters for this container."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _entry(self, endpoint):
+        entry = self._endpoints.get(endpoint)
+        if entry is None:
+            entry = {
+                "calls": 0,
+                "errors": 0,
+                "retries": 0,
+                "throttled": 0,
+                "latencyMsTotal": 0.0,
+                "latencyMsMax": 0.0,
+                "rateLimitWaitMs": 0.0,
+            }
+            self._endpoints[endpoint] = entry
+        return entry
+
+    def record_call(self, endpoint, latency_ms, error=False, throttled=False):
+        with self._lock:
+            entry = self._entry(endpoint)
+            entry["calls"] += 1
+            entry["latencyMsTotal"] += latency_ms
+            entry["latencyMsMax"] = max(entry["latencyMsMax"], latency_ms)
+            if error:
+                entry["errors"] += 1
+            if throttled:
+                entry["throttled"] += 1
+
+    def record_retry(self, endpoint):
+        with self._lock:
+            self._entry(endpoint)["retries"] += 1
+
+    def record_wait(self, endpoint, wait_seconds):
+        with self._lock:
+            self._entry(endpoint)["rateLimitWaitMs"] += wait_seconds * 1000
+
+    def snapshot(self):
+        """Copy of the counters with the average latency filled in."""
+        with self._lock:
+            result = {}
+            for endpoint, entry in self._endpoints.items():
+                stats = dict(entry)
+                stats["latencyMsAvg"] = (
+                    entry["latencyMsTotal"] / entry["calls"] if entry["calls"] else 0.0
+                )
+                result[endpoint] = stats
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+stats = ClientStats()
+
+
+def get_session():
+    """
+    Get the pooled HTTP session for this container.
+
+    Keeping the session alive across invocations reuses TCP+TLS connections
+    to Spotify for as long as the Lambda container stays warm.
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=SPOTIFY_POOL_SIZE,
+                    pool_maxsize=SPOTIFY_POOL_SIZE,
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_rate_limiter():
+    """Get the Spotify Web API rate limiter configured by SPOTIFY_RATE_LIMITER."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _lock:
+            if _rate_limiter is None:
+                _rate_limiter = _create_rate_limiter()
+    return _rate_limiter
+
+
+def set_rate_limiter(limiter):
+    """Replace the rate limiter (e.g. with a LocalTokenBucket in tests)."""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def _create_rate_limiter():
+    if SPOTIFY_RATE_LIMITER == "local":
+        return LocalTokenBucket(SPOTIFY_RATE_LIMIT_PER_SECOND, SPOTIFY_RATE_LIMIT_BURST)
+
+    return DynamoDBTokenBucket(
+        SPOTIFY_BUCKET_ID,
+        SPOTIFY_RATE_LIMIT_PER_SECOND,
+        SPOTIFY_RATE_LIMIT_BURST,
+    )
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(SPOTIFY_BACKOFF_CAP, SPOTIFY_BACKOFF_BASE * 2**attempt))
+
+
+def _retry_after_delay(response, attempt):
+    """Honour Spotify's Retry-After header, falling back to backoff."""
+    retry_after = response.headers.get("Retry-After")
+    try:
+        return min(float(retry_after), SPOTIFY_MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return _backoff_delay(attempt)
+
+
+def request(method, url, endpoint, rate_limited=True, idempotent=True, **kwargs):
+    """
+    Send a request to Spotify through the pooled session
+
+    Connection errors, timeouts, 429 and 5xx responses are retried up to
+    SPOTIFY_MAX_RETRIES times. Calls to the Web API also draw from the
+    shared token bucket before every attempt.
+
+    Args:
+        method: HTTP method
+        url: Full request URL
+        endpoint: Short endpoint name used for stats (e.g. "me/tracks")
+        rate_limited: Whether the call counts against the Web API rate limit
+        idempotent: False for calls that must not reach Spotify twice, like
+            the authorization code exchange (a code is single use, so a
+            retry of an exchange that went through fails with
+            invalid_grant). Only 429 responses, which Spotify did not
+            process, are retried then.
+        **kwargs: Passed through to requests.Session.request
+
+    Returns:
+        Successful requests.Response
+
+    Raises:
+        requests.exceptions.RequestException once retries are exhausted
+        or on a non-retryable error response
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    session = get_session()
+    attempt = 0
+
+    while True:
+        if rate_limited:
+            waited = get_rate_limiter().acquire()
+            if waited:
+                stats.record_wait(endpoint, waited)
+
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            stats.record_call(endpoint, (time.perf_counter() - start) * 1000, error=True)
+            if not idempotent or attempt >= SPOTIFY_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt)
+            logger.warning("Spotify %s failed (%s), retrying in %.2fs", endpoint, e, delay)
+        else:
+            latency_ms = (time.perf_counter() - start) * 1000
+            status = response.status_code
+            throttled = status == 429
+            retryable = throttled or (idempotent and status in RETRYABLE_STATUS_CODES)
+            stats.record_call(
+                endpoint, latency_ms, error=status >= 400, throttled=throttled
+            )
+            if not retryable or attempt >= SPOTIFY_MAX_RETRIES:
+                response.raise_for_status()
+                return response
+            if throttled:
+                increment("spotify.throttled")
+                delay = _retry_after_delay(response, attempt)
+            else:
+                delay = _backoff_delay(attempt)
+            logger.warning(
+                "Spotify %s returned %d, retrying in %.2fs", endpoint, status, delay
+            )
+
+        attempt += 1
+        stats.record_retry(endpoint)
+        increment("spotify.retries")
+        time.sleep(delay)
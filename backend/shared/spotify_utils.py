@@ -1,16 +1,25 @@
 import requests
 import os
 import base64
+import sys
 from datetime import datetime, timedelta, timezone
 
+from shared import spotify_client
 from shared.config import get_secret, get_logger
+from shared.cover_art import encode_images
+from shared.instrumentation import timed
+from shared.track_batch import TrackBatch
 
 logger = get_logger(__name__)
 
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_API_BASE = "https://api.spotify.com/v1"
+# Overridable so local runs and benchmarks can point at a stand-in server
+SPOTIFY_TOKEN_URL = os.environ.get(
+    "SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token"
+)
+SPOTIFY_API_BASE = os.environ.get("SPOTIFY_API_BASE", "https://api.spotify.com/v1")
 
 
+@timed("spotify.token_exchange")
 def exchange_code_for_tokens(code):
     """
     Exchange auth code for access and refresh tokens
@@ -45,10 +54,15 @@ def exchange_code_for_tokens(code):
     }
 
     try:
-        response = requests.post(
-            SPOTIFY_TOKEN_URL, headers=headers, data=data, timeout=10
+        response = spotify_client.request(
+            "POST",
+            SPOTIFY_TOKEN_URL,
+            endpoint="token",
+            rate_limited=False,
+            idempotent=False,
+            headers=headers,
+            data=data,
         )
-        response.raise_for_status()
 
         tokens = response.json()
 
@@ -65,6 +79,7 @@ def exchange_code_for_tokens(code):
         return {}, error_msg
 
 
+@timed("spotify.token_refresh")
 def refresh_access_token(refresh_token):
     """
     Refresh an expired access token
@@ -96,10 +111,14 @@ def refresh_access_token(refresh_token):
     }
 
     try:
-        response = requests.post(
-            SPOTIFY_TOKEN_URL, headers=headers, data=data, timeout=10
+        response = spotify_client.request(
+            "POST",
+            SPOTIFY_TOKEN_URL,
+            endpoint="token",
+            rate_limited=False,
+            headers=headers,
+            data=data,
         )
-        response.raise_for_status()
 
         tokens = response.json()
 
@@ -116,6 +135,7 @@ def refresh_access_token(refresh_token):
         return {}, f"Failed to refresh token: {str(e)}"
 
 
+@timed("spotify.profile")
 def get_user_profile(access_token):
     """
     Get Spotify user profile
@@ -129,8 +149,9 @@ def get_user_profile(access_token):
     headers = {"Authorization": f"Bearer {access_token}"}
 
     try:
-        response = requests.get(f"{SPOTIFY_API_BASE}/me", headers=headers, timeout=10)
-        response.raise_for_status()
+        response = spotify_client.request(
+            "GET", f"{SPOTIFY_API_BASE}/me", endpoint="me", headers=headers
+        )
         return response.json(), None
     except requests.exceptions.RequestException as e:
         return None, f"Failed to get user profile: {str(e)}"
@@ -173,21 +194,165 @@ def parse_track(track):
             "platformTrackId": track["id"],
             "platformAlbumId": album.get("id"),
             "platformArtistId": (artists[0].get("id") if artists else None),
-            "coverArtUrl": (
-                album.get("images", [{}])[0].get("url") if album.get("images") else None
-            ),
+            "coverArt": encode_images(album.get("images")),
             "addedDate": track.get("added_at", datetime.now(timezone.utc).isoformat()),
             "isManual": False,
             "duration": track.get("duration_ms"),
             "releaseYear": (
                 album.get("release_date", "")[:4] if album.get("release_date") else None
             ),
+            "audioFeatures": None,
         }
     except (KeyError, IndexError) as fmt_error:
         logger.warning("Skipping malformed track: %s", fmt_error)
     return None
 
 
+def parse_tracks_page(items, batch=None):
+    """
+    Map a whole /me/tracks page into a column-oriented TrackBatch
+
+    Produces the same fields as parse_track, but evaluates the default
+    added date once per page, parses each album once, and interns repeated
+    artist/album strings so they are shared across the whole library.
+
+    Args:
+        items: "items" of a /me/tracks response ({"added_at", "track"})
+        batch: Optional batch to append to (e.g. the previous pages)
+
+    Returns:
+        The TrackBatch, with unparseable tracks counted in batch.malformed
+    """
+    if batch is None:
+        batch = TrackBatch()
+    intern = sys.intern
+    now = datetime.now(timezone.utc).isoformat()
+    albums = batch.album_cache
+    columns = batch.columns
+    track_ids = columns["trackId"]
+    track_names = columns["trackName"]
+    artist_names = columns["artistName"]
+    album_names = columns["albumName"]
+    platforms = columns["platform"]
+    platform_track_ids = columns["platformTrackId"]
+    platform_album_ids = columns["platformAlbumId"]
+    platform_artist_ids = columns["platformArtistId"]
+    cover_arts = columns["coverArt"]
+    added_dates = columns["addedDate"]
+    durations = columns["duration"]
+    release_years = columns["releaseYear"]
+    is_manual = columns["isManual"]
+    audio_features = columns["audioFeatures"]
+    cover_art_urls = columns["coverArtUrl"]
+
+    for item in items:
+        track = item.get("track")
+        if not track:
+            continue
+        try:
+            platform_track_id = track["id"]
+            album = track.get("album", {})
+            album_id = album.get("id")
+            parsed_album = albums.get(album_id) if album_id else None
+            if parsed_album is None:
+                cover_art = encode_images(album.get("images"))
+                release_date = album.get("release_date")
+                parsed_album = (
+                    intern(album.get("name", "Unknown")),
+                    intern(album_id) if album_id else None,
+                    intern(cover_art) if cover_art else None,
+                    intern(release_date[:4]) if release_date else None,
+                )
+                if album_id:
+                    albums[album_id] = parsed_album
+            artists = track.get("artists", [])
+            artist_name = intern(", ".join(artist.get("name", "") for artist in artists))
+            artist_id = artists[0].get("id") if artists else None
+        except (KeyError, IndexError, AttributeError, TypeError) as fmt_error:
+            logger.warning("Skipping malformed track: %s", fmt_error)
+            batch.malformed += 1
+            continue
+
+        track_ids.append(f"spotify:{platform_track_id}")
+        track_names.append(track.get("name", "Unknown"))
+        artist_names.append(artist_name)
+        album_names.append(parsed_album[0])
+        platforms.append("spotify")
+        platform_track_ids.append(platform_track_id)
+        platform_album_ids.append(parsed_album[1])
+        platform_artist_ids.append(intern(artist_id) if artist_id else None)
+        cover_arts.append(parsed_album[2])
+        added_dates.append(item.get("added_at") or now)
+        durations.append(track.get("duration_ms"))
+        release_years.append(parsed_album[3])
+        is_manual.append(False)
+        audio_features.append(None)
+        cover_art_urls.append(None)
+
+    return batch
+
+
+def get_saved_tracks_page(access_token, offset, limit=50):
+    """
+    Fetch one /me/tracks page
+
+    Returns:
+        Tuple of (items, total saved tracks, whether another page follows)
+
+    Raises:
+        requests.exceptions.RequestException if the page cannot be fetched
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    url = f"{SPOTIFY_API_BASE}/me/tracks?limit={limit}&offset={offset}"
+    response = spotify_client.request("GET", url, endpoint="me/tracks", headers=headers)
+
+    data = response.json()
+    return data.get("items", []), data.get("total"), data.get("next") is not None
+
+
+def get_audio_features(access_token, track_ids):
+    """
+    Fetch audio features of up to 100 tracks in one /audio-features call
+
+    Args:
+        access_token: Spotify access token
+        track_ids: Spotify track IDs
+
+    Returns:
+        Dict of track ID -> features object, or None if Spotify has none
+
+    Raises:
+        requests.exceptions.RequestException if the call fails
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    url = f"{SPOTIFY_API_BASE}/audio-features?ids={','.join(track_ids)}"
+    response = spotify_client.request("GET", url, endpoint="audio-features", headers=headers)
+
+    features = {track_id: None for track_id in track_ids}
+    for entry in response.json().get("audio_features") or []:
+        if entry and entry.get("id") in features:
+            features[entry["id"]] = entry
+    return features
+
+
+def _iter_saved_track_pages(access_token, limit):
+    """
+    Yield the "items" of each /me/tracks page
+
+    Raises:
+        requests.exceptions.RequestException if a page cannot be fetched
+    """
+    offset = 0
+    while True:
+        items, _, has_next = get_saved_tracks_page(access_token, offset, limit)
+        yield items
+
+        if not has_next:
+            return
+        offset += limit
+
+
+@timed("spotify.saved_tracks")
 def get_user_saved_tracks(access_token, limit=50):
     """
     Get user saved tracks from Spotify
@@ -199,31 +364,16 @@ def get_user_saved_tracks(access_token, limit=50):
     Returns:
         Tuple of (list of tracks, error message)
     """
-    headers = {"Authorization": f"Bearer {access_token}"}
-
     all_tracks = []
-    offset = 0
 
     # TODO: Set up a maximum page count / track cap to avoid timeouts for huge libraries (thousands of songs)
     try:
-        while True:
-            url = f"{SPOTIFY_API_BASE}/me/tracks?limit={limit}&offset={offset}"
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            data = response.json()
-            items = data.get("items", [])
-
+        for items in _iter_saved_track_pages(access_token, limit):
             for item in items:
                 track = item.get("track")
                 if track:
                     track["added_at"] = item.get("added_at", "")
                     all_tracks.append(track)
-
-            if data.get("next") is None:
-                break
-
-            offset += limit
             logger.info("Fetched %d tracks so far...", len(all_tracks))
         return all_tracks, None
     except requests.exceptions.RequestException as e:
@@ -0,0 +1,221 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from shared.config import get_logger
+from shared.db import connections_table
+from shared.library_sync import SyncError, sync_spotify_library
+from shared.parallel_scan import scan_segment
+from shared.queues import get_queue
+from shared.spotify_client import SPOTIFY_RATE_LIMIT_PER_SECOND
+
+logger = get_logger(__name__)
+
+SCAN_QUEUE_ENV = "SYNC_SCAN_QUEUE_URL"
+SYNC_QUEUE_ENV = "SYNC_QUEUE_URL"
+
+# How often the schedule fires; each run plans one interval's worth of syncs
+SYNC_INTERVAL_SECONDS = int(os.environ.get("SYNC_SCHEDULE_INTERVAL_SECONDS", "3600"))
+# Connections synced more recently than this are never picked
+SYNC_MIN_STALENESS_SECONDS = int(os.environ.get("SYNC_MIN_STALENESS_SECONDS", str(6 * 3600)))
+# Share of the app-wide Spotify budget scheduled syncs may use, the rest is
+# left for user-initiated requests
+SYNC_RATE_LIMIT_SHARE = float(os.environ.get("SYNC_RATE_LIMIT_SHARE", "0.5"))
+# Connections per scan segment, so each segment worker does a fixed amount of work
+SYNC_ITEMS_PER_SEGMENT = int(os.environ.get("SYNC_ITEMS_PER_SEGMENT", "2000"))
+MAX_SEGMENTS = 1000
+
+ACTIVE_WINDOW = timedelta(days=7)
+ACTIVE_BOOST = 4.0
+NEVER_SYNCED_STALENESS_SECONDS = 365 * 24 * 3600
+TRACKS_PER_PAGE = 50
+# Page estimate for connections that were never synced
+DEFAULT_SYNC_PAGES = 20
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def plan_segments(item_count):
+    """Number of scan segments for a connections table of this size."""
+    return max(1, min(MAX_SEGMENTS, math.ceil(item_count / SYNC_ITEMS_PER_SEGMENT)))
+
+
+def sync_call_budget():
+    """Spotify calls the scheduled syncs of one interval may spend."""
+    return int(SPOTIFY_RATE_LIMIT_PER_SECOND * SYNC_INTERVAL_SECONDS * SYNC_RATE_LIMIT_SHARE)
+
+
+def estimate_sync_calls(connection):
+    """Spotify calls one sync of this connection is expected to make."""
+    last_count = connection.get("lastSyncCount")
+    if last_count is None:
+        return DEFAULT_SYNC_PAGES
+    return 1 + math.ceil(int(last_count) / TRACKS_PER_PAGE)
+
+
+def sync_priority(connection, now):
+    """
+    Rank a connection for scheduled sync
+
+    Returns:
+        Priority score (higher first), or None if it was synced too recently
+    """
+    last_synced = _parse_time(connection.get("lastSyncedAt"))
+    if last_synced is None:
+        staleness = NEVER_SYNCED_STALENESS_SECONDS
+    else:
+        staleness = (now - last_synced).total_seconds()
+    if staleness < SYNC_MIN_STALENESS_SECONDS:
+        return None
+
+    last_active = _parse_time(connection.get("lastActiveAt"))
+    if last_active and now - last_active <= ACTIVE_WINDOW:
+        return staleness * ACTIVE_BOOST
+    return staleness
+
+
+def start_scheduled_run(scan_queue=None, now=None):
+    """
+    Fan out one scheduled run across scan segments
+
+    Only enqueues one message per segment, so the coordinator's runtime
+    depends on the segment count, not on the number of users.
+
+    Returns:
+        Dict with the segment count and the call budget per segment
+    """
+    now = now or datetime.now(timezone.utc)
+    scan_queue = scan_queue or get_queue(SCAN_QUEUE_ENV)
+
+    # DescribeTable's ItemCount is refreshed roughly every 6 hours, plenty for sizing
+    total_segments = plan_segments(connections_table.item_count)
+    segment_budget = sync_call_budget() // total_segments
+
+    scan_queue.send_messages(
+        [
+            {
+                "segment": segment,
+                "totalSegments": total_segments,
+                "callBudget": segment_budget,
+                "scheduledAt": now.isoformat(),
+            }
+            for segment in range(total_segments)
+        ]
+    )
+    logger.info(
+        "Scheduled sync run over %d segments, %d calls each", total_segments, segment_budget
+    )
+    return {"segments": total_segments, "callBudgetPerSegment": segment_budget}
+
+
+def schedule_segment(segment, total_segments, call_budget, sync_queue=None, now=None):
+    """
+    Pick the stalest connections of one scan segment and enqueue their syncs
+
+    Args:
+        segment: Segment number
+        total_segments: Total segments of this run
+        call_budget: Spotify calls this segment's syncs may spend
+        sync_queue: Queue to send sync jobs to
+        now: Reference time (defaults to now)
+
+    Returns:
+        Dict with scanned, candidate and enqueued counts and planned calls
+    """
+    now = now or datetime.now(timezone.utc)
+    sync_queue = sync_queue or get_queue(SYNC_QUEUE_ENV)
+
+    scanned = 0
+    candidates = []
+    for items, _, _ in scan_segment(
+        connections_table,
+        segment,
+        total_segments,
+        FilterExpression="platform = :platform",
+        ProjectionExpression="userId, platform, lastSyncedAt, lastActiveAt, lastSyncCount",
+        ExpressionAttributeValues={":platform": "spotify"},
+    ):
+        scanned += len(items)
+        for connection in items:
+            priority = sync_priority(connection, now)
+            if priority is not None:
+                candidates.append((priority, connection["userId"], connection))
+
+    candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+
+    jobs = []
+    planned_calls = 0
+    for _, user_id, connection in candidates:
+        cost = estimate_sync_calls(connection)
+        if planned_calls + cost > call_budget:
+            continue
+        planned_calls += cost
+        jobs.append({"userId": user_id, "platform": "spotify"})
+
+    enqueued = sync_queue.send_messages(jobs) if jobs else 0
+    logger.info(
+        "Segment %d/%d: scanned %d, %d stale, enqueued %d syncs (%d calls)",
+        segment,
+        total_segments,
+        scanned,
+        len(candidates),
+        enqueued,
+        planned_calls,
+    )
+    return {
+        "scanned": scanned,
+        "candidates": len(candidates),
+        "enqueued": enqueued,
+        "plannedCalls": planned_calls,
+    }
+
+
+def run_sync_job(job):
+    """
+    Run one scheduled sync
+
+    Returns:
+        True if the job is done (synced, or permanently failing such as a
+        revoked connection), False if it should be retried
+    """
+    try:
+        sync_spotify_library(job["userId"])
+        return True
+    except SyncError as e:
+        logger.warning("Scheduled sync failed for user %s: %s", job["userId"], e.message)
+        return e.status_code < 500
+
+
+def run_locally(max_concurrency=4, now=None):
+    """
+    Run a whole scheduled cycle in-process against the local stand-in queues
+
+    Returns:
+        Dict with segment results and the number of completed sync jobs
+    """
+    scan_queue = get_queue(SCAN_QUEUE_ENV)
+    sync_queue = get_queue(SYNC_QUEUE_ENV)
+    start_scheduled_run(scan_queue, now)
+
+    segments = [
+        schedule_segment(
+            message["segment"],
+            message["totalSegments"],
+            message["callBudget"],
+            sync_queue,
+            now,
+        )
+        for message in scan_queue.drain()
+    ]
+    jobs = sync_queue.drain()
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        completed = sum(executor.map(run_sync_job, jobs))
+    return {"segments": segments, "jobs": len(jobs), "completed": completed}
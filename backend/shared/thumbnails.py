@@ -0,0 +1,145 @@
+import boto3
+import io
+import os
+
+import requests
+from botocore.exceptions import ClientError
+from PIL import Image
+
+from shared.config import get_logger
+from shared.instrumentation import increment, span, timed
+
+logger = get_logger(__name__)
+
+COVER_ART_BUCKET = os.environ.get("COVER_ART_BUCKET", "melodiary-cover-art")
+# Where source images are fetched from by image ID; tests point it at a local stand-in
+COVER_ART_ORIGIN = os.environ.get("COVER_ART_ORIGIN", "https://i.scdn.co/image").rstrip("/")
+# An image ID never changes content, so neither do its thumbnails
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+THUMBNAIL_QUALITY = 85
+MAX_SOURCE_BYTES = 5 * 1024 * 1024
+ORIGIN_TIMEOUT_SECONDS = 5
+
+_s3_client = None
+_session = None
+
+
+class ThumbnailError(Exception):
+    """A thumbnail could not be made, with the HTTP status to report."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client(
+            "s3",
+            region_name=os.environ.get("AWS_REGION", "eu-central-1"),
+            endpoint_url=os.environ.get("S3_ENDPOINT") or None,
+        )
+    return _s3_client
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def thumbnail_key(image_id, size):
+    """
+    S3 key of a thumbnail, shared by every user with the album
+
+    Keyed by the origin image alone: an album's art has one image ID per
+    size, and nothing the client sends beyond it can add objects.
+    """
+    return f"covers/{image_id}/{size}.jpg"
+
+
+def _fetch_source(image_id):
+    """
+    Download a source image from the origin
+
+    Raises:
+        ThumbnailError 404 if the origin has no such image, 502 otherwise
+    """
+    try:
+        with span("cover_art.fetch"):
+            with _get_session().get(
+                f"{COVER_ART_ORIGIN}/{image_id}", timeout=ORIGIN_TIMEOUT_SECONDS, stream=True
+            ) as response:
+                if response.status_code == 404:
+                    raise ThumbnailError("Image not found", 404)
+                response.raise_for_status()
+                body = response.raw.read(MAX_SOURCE_BYTES + 1, decode_content=True)
+    except requests.exceptions.RequestException as e:
+        logger.error("Failed to fetch cover art %s: %s", image_id, e)
+        raise ThumbnailError("Failed to fetch image", 502) from e
+    if len(body) > MAX_SOURCE_BYTES:
+        raise ThumbnailError("Image too large", 502)
+    return body
+
+
+def resize(body, size):
+    """
+    Scale an image to fit a size x size box, as JPEG
+
+    Raises:
+        ThumbnailError 502 if the source is not a readable image
+    """
+    with span("cover_art.resize"):
+        try:
+            image = Image.open(io.BytesIO(body))
+            image.draft("RGB", (size, size))
+            image = image.convert("RGB")
+        except (OSError, Image.DecompressionBombError) as e:
+            raise ThumbnailError("Unreadable image", 502) from e
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+@timed("cover_art.thumbnail")
+def get_thumbnail(image_id, size):
+    """
+    An album thumbnail, made and cached in S3 on first request
+
+    Args:
+        image_id: Origin image ID of the album art to scale down
+        size: Edge length in pixels
+
+    Returns:
+        JPEG bytes
+
+    Raises:
+        ThumbnailError if the source image could not be fetched or read
+    """
+    s3 = _get_s3_client()
+    key = thumbnail_key(image_id, size)
+    try:
+        with span("s3.get_object"):
+            body = s3.get_object(Bucket=COVER_ART_BUCKET, Key=key)["Body"].read()
+        increment("cover_art.hits")
+        return body
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise
+
+    increment("cover_art.misses")
+    body = resize(_fetch_source(image_id), size)
+    # Concurrent first requests write the same bytes, last one wins harmlessly
+    with span("s3.put_object"):
+        s3.put_object(
+            Bucket=COVER_ART_BUCKET,
+            Key=key,
+            Body=body,
+            ContentType="image/jpeg",
+            CacheControl=THUMBNAIL_CACHE_CONTROL,
+        )
+    return body
@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from shared.config import get_logger
+from shared.db import (
+    acquire_token_refresh_lease,
+    connection_cache,
+    get_platform_connection,
+    release_token_refresh_lease,
+    update_platform_tokens,
+)
+from shared.instrumentation import increment
+from shared.providers import get_provider
+from shared.spotify_utils import is_token_expired
+
+logger = get_logger(__name__)
+
+REFRESH_LEASE_SECONDS = int(os.environ.get("TOKEN_REFRESH_LEASE_SECONDS", "15"))
+REFRESH_WAIT_SECONDS = float(os.environ.get("TOKEN_REFRESH_WAIT_SECONDS", "10"))
+REFRESH_POLL_INTERVAL = 0.25
+
+# (user_id, platform) -> (access_token, expires_at), kept until shortly before expiry
+_token_cache = {}
+# (user_id, platform) -> [lock, callers using it], dropped when the last one is done
+_key_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _key_lock(key):
+    with _locks_guard:
+        entry = _key_locks.get(key)
+        if entry is None:
+            entry = _key_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[key]
+
+
+def _cached_token(key):
+    cached = _token_cache.get(key)
+    if cached is None:
+        return None
+    if is_token_expired(cached[1]):
+        _token_cache.pop(key, None)
+        return None
+    return cached[0]
+
+
+def _remember(key, access_token, expires_at):
+    _token_cache[key] = (access_token, expires_at)
+    return access_token
+
+
+def invalidate_access_token(user_id, platform):
+    """Drop the cached access token, e.g. after the platform rejected it."""
+    _token_cache.pop((user_id, platform), None)
+    connection_cache.invalidate((user_id, platform))
+
+
+def invalidate_if_rejected(user_id, platform, error):
+    """
+    Drop the cached access token if a platform call failed with 401
+
+    A token revoked before its expiry would otherwise be served from the
+    cache until then; the next call reads the connection again instead.
+
+    Returns:
+        True if the error was the platform rejecting the token
+    """
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) != 401:
+        return False
+    logger.warning("%s rejected the access token of user %s", platform, user_id)
+    increment("token.rejected")
+    invalidate_access_token(user_id, platform)
+    return True
+
+
+def get_access_token(user_id, platform, connection=None):
+    """
+    Get a valid access token for a platform connection
+
+    Valid tokens are cached in-process until shortly before expiry. Expired
+    tokens are refreshed single-flight: threads in this container share one
+    refresh, and across containers only the holder of the connection's
+    refresh lease calls the platform while the others wait for its result.
+
+    Args:
+        user_id: User ID
+        platform: Platform type
+        connection: Optional connection item that was already loaded with
+            cached=False; the connection cache may hold rotated-out tokens
+
+    Returns:
+        Tuple of (access token, error message)
+    """
+    key = (user_id, platform)
+    token = _cached_token(key)
+    if token:
+        return token, None
+
+    with _key_lock(key):
+        token = _cached_token(key)
+        if token:
+            return token, None
+
+        if connection is None:
+            connection = get_platform_connection(user_id, platform, cached=False)
+        if not connection:
+            return None, f"{platform} not connected"
+
+        if not is_token_expired(connection.get("expiresAt") or ""):
+            return _remember(key, connection["accessToken"], connection["expiresAt"]), None
+
+        return _refresh_single_flight(key, connection)
+
+
+def _refresh_single_flight(key, connection):
+    user_id, platform = key
+    provider = get_provider(platform)
+    if provider is None:
+        return None, f"Token refresh not supported for {platform}"
+
+    deadline = time.monotonic() + REFRESH_WAIT_SECONDS
+    while True:
+        refresh_token = connection.get("refreshToken")
+        if not refresh_token:
+            return None, "No refresh token stored"
+
+        owner = str(uuid.uuid4())
+        if acquire_token_refresh_lease(
+            user_id, platform, owner, refresh_token, REFRESH_LEASE_SECONDS
+        ):
+            return _refresh_with_lease(key, provider, refresh_token, owner)
+
+        # Someone else is refreshing (or already rotated the token), wait for it
+        logger.info("Waiting for concurrent token refresh for user %s", user_id)
+        time.sleep(REFRESH_POLL_INTERVAL)
+        connection = get_platform_connection(user_id, platform, consistent=True)
+        if not connection:
+            return None, f"{platform} not connected"
+        if not is_token_expired(connection.get("expiresAt") or ""):
+            return _remember(key, connection["accessToken"], connection["expiresAt"]), None
+        if time.monotonic() >= deadline:
+            return None, "Timed out waiting for concurrent token refresh"
+
+
+def _refresh_with_lease(key, provider, refresh_token, owner):
+    user_id, platform = key
+    logger.info("Refreshing %s token for user %s", platform, user_id)
+    try:
+        new_tokens, error = provider.refresh_tokens(refresh_token)
+    except Exception as e:
+        new_tokens, error = None, str(e)
+    if error:
+        # Released right away: waiters give up before the lease would lapse,
+        # and the next caller should retry rather than wait for it
+        release_token_refresh_lease(user_id, platform, owner)
+        return None, error
+
+    stored = update_platform_tokens(
+        user_id, platform, new_tokens, previous_refresh_token=refresh_token
+    )
+    if not stored:
+        # A newer rotation is already stored, ours is still usable for this call
+        logger.warning("Refresh token for user %s was rotated concurrently", user_id)
+    return _remember(key, new_tokens["access_token"], new_tokens["expires_at"]), None
@@ -0,0 +1,136 @@
+import hashlib
+from datetime import datetime, timezone
+
+# Library row attributes, in the order the columns are stored
+LIBRARY_COLUMNS = (
+    "trackId",
+    "trackName",
+    "artistName",
+    "albumName",
+    "platform",
+    "platformTrackId",
+    "platformAlbumId",
+    "platformArtistId",
+    "coverArt",
+    "addedDate",
+    "duration",
+    "releaseYear",
+    "isManual",
+    "audioFeatures",
+    "coverArtUrl",
+)
+# Columns most tracks leave unset (coverArtUrl: a manual track's own cover
+# image). Rows only carry them, and their hash only covers them, when set,
+# so rows written before a column was added keep their contentHash.
+OPTIONAL_COLUMNS = ("coverArtUrl",)
+_REQUIRED_COUNT = len(LIBRARY_COLUMNS) - len(OPTIONAL_COLUMNS)
+
+
+class TrackBatch:
+    """
+    Column-oriented set of library tracks.
+
+    Tracks are stored as one list per attribute instead of one dict per
+    track, so a page of parsed tracks costs a few list slots per track and
+    repeated strings (artists, albums, cover URLs) can be shared. Rows are
+    only materialized as dicts when they are written.
+    """
+
+    __slots__ = ("columns", "malformed", "album_cache")
+
+    def __init__(self):
+        self.columns = {name: [] for name in LIBRARY_COLUMNS}
+        self.malformed = 0
+        # Parsed album fields by platform album ID, shared across pages
+        self.album_cache = {}
+
+    def __len__(self):
+        return len(self.columns["trackId"])
+
+    @classmethod
+    def from_tracks(cls, tracks):
+        """
+        Build a batch from per-track dicts (parse_track output, manual tracks)
+
+        Args:
+            tracks: Iterable of track dicts with at least trackId, trackName,
+                artistName, albumName and platform
+        """
+        batch = cls()
+        now = datetime.now(timezone.utc).isoformat()
+        columns = batch.columns
+        for track in tracks:
+            for name in LIBRARY_COLUMNS:
+                columns[name].append(track.get(name))
+            if columns["addedDate"][-1] is None:
+                columns["addedDate"][-1] = now
+            if columns["isManual"][-1] is None:
+                columns["isManual"][-1] = False
+        return batch
+
+    def track_ids(self):
+        return self.columns["trackId"]
+
+    def drop_duplicates(self):
+        """
+        Remove repeated track IDs, keeping the first row of each
+
+        Returns:
+            Number of rows removed
+        """
+        seen = set()
+        keep = []
+        for i, track_id in enumerate(self.columns["trackId"]):
+            if track_id not in seen:
+                seen.add(track_id)
+                keep.append(i)
+        removed = len(self) - len(keep)
+        if removed:
+            self.columns = {
+                name: [values[i] for i in keep] for name, values in self.columns.items()
+            }
+        return removed
+
+    def iter_tracks(self):
+        """Yield each track as a dict keyed by library attribute name."""
+        for row in zip(*self.columns.values()):
+            yield _row_dict(row)
+
+    def to_items(self, user_id, skip_track_ids=()):
+        """
+        Materialize library rows for writing
+
+        Args:
+            user_id: Owner of the rows
+            skip_track_ids: Track IDs to leave out (e.g. soft-deleted tracks)
+
+        Returns:
+            List of DynamoDB items, each with a contentHash of its columns
+        """
+        items = []
+        for row in zip(*self.columns.values()):
+            if row[0] in skip_track_ids:
+                continue
+            item = _row_dict(row)
+            item["userId"] = user_id
+            item["contentHash"] = content_hash(row)
+            items.append(item)
+        return items
+
+
+def _row_dict(row):
+    item = dict(zip(LIBRARY_COLUMNS[:_REQUIRED_COUNT], row))
+    for name, value in zip(OPTIONAL_COLUMNS, row[_REQUIRED_COUNT:]):
+        if value is not None:
+            item[name] = value
+    return item
+
+
+def content_hash(row):
+    """Short digest of a track's column values, to detect unchanged tracks."""
+    row = row[:_REQUIRED_COUNT] + tuple(
+        (name, value)
+        for name, value in zip(OPTIONAL_COLUMNS, row[_REQUIRED_COUNT:])
+        if value is not None
+    )
+    return hashlib.blake2b(repr(row).encode("utf-8"), digest_size=8).hexdigest()
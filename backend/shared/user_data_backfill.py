@@ -0,0 +1,105 @@
+import os
+from itertools import islice
+
+from shared import db
+from shared.config import get_logger
+from shared.instrumentation import increment
+from shared.parallel_scan import parallel_scan
+
+logger = get_logger(__name__)
+
+USER_DATA_BACKFILL_SEGMENTS = int(os.environ.get("USER_DATA_BACKFILL_SEGMENTS", "8"))
+# Items compared per BatchGetItem
+COMPARE_BATCH_SIZE = 100
+
+
+def user_data_item(table, item):
+    """Melodiary-UserData copy of a Users or PlatformConnections item."""
+    if table is db.users_table:
+        return {**item, "sk": db.PROFILE_SK}
+    return {**item, "sk": db.CONNECTION_SK_PREFIX + item["platform"]}
+
+
+def _batches(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def _backfill_table(table, overwrite, dry_run, total_segments):
+    counts = {
+        "scanned": 0,
+        "missing": 0,
+        "different": 0,
+        "written": 0,
+        "stale": 0,
+        "failed": 0,
+    }
+    for batch in _batches(parallel_scan(table, total_segments), COMPARE_BATCH_SIZE):
+        copies = [user_data_item(table, item) for item in batch]
+        found = db.batch_get(
+            {db.user_data_table: [{"userId": c["userId"], "sk": c["sk"]} for c in copies]}
+        )[db.user_data_table.name]
+        existing = {(item["userId"], item["sk"]): item for item in found}
+
+        writes = []
+        for copy in copies:
+            current = existing.get((copy["userId"], copy["sk"]))
+            if current is None:
+                counts["missing"] += 1
+                writes.append(copy)
+            elif current != copy:
+                counts["different"] += 1
+                if overwrite:
+                    writes.append(copy)
+        counts["scanned"] += len(copies)
+
+        if dry_run:
+            continue
+        for copy in writes:
+            # Conditional on rowVersion: a live write copied meanwhile is newer
+            try:
+                if db.put_if_newer(db.user_data_table, copy):
+                    counts["written"] += 1
+                else:
+                    counts["stale"] += 1
+            except Exception as e:
+                logger.error("Failed to copy %s/%s: %s", copy["userId"], copy["sk"], e)
+                counts["failed"] += 1
+    return counts
+
+
+def backfill_user_data(overwrite=False, dry_run=False, total_segments=None):
+    """
+    Copy profiles and connections from Melodiary-Users and
+    Melodiary-PlatformConnections into Melodiary-UserData
+
+    Run with USER_DATA_LAYOUT=dual, so rows written meanwhile are copied by
+    the writes themselves: a first run fills in the missing items, a
+    second with overwrite repairs items that differ (copies that failed),
+    and a dry run should then find nothing before reads switch to
+    USER_DATA_LAYOUT=single. Items are only written over an older
+    rowVersion, so a copy scanned before a live write never replaces it.
+
+    Args:
+        overwrite: Also rewrite items whose copy differs
+        dry_run: Only count missing and differing items
+        total_segments: Parallel scan segments of each table
+
+    Returns:
+        Dict of table name -> scanned, missing, different, written, stale
+        (newer copy found) and failed counts
+    """
+    if overwrite and db.USER_DATA_LAYOUT == "single":
+        # Melodiary-UserData is the primary copy then, the old tables may lag
+        raise ValueError("Overwriting needs USER_DATA_LAYOUT=dual")
+
+    summary = {}
+    for table in (db.users_table, db.connections_table):
+        counts = _backfill_table(
+            table, overwrite, dry_run, total_segments or USER_DATA_BACKFILL_SEGMENTS
+        )
+        logger.info("Backfilled %s: %s", table.name, counts)
+        increment("user_data.backfill.written", counts["written"])
+        summary[table.name] = counts
+    return summary
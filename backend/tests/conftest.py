@@ -0,0 +1,31 @@
+import os
+import sys
+
+import boto3
+import pytest
+
+# Make 'shared', 'benchmarks' and the lambda packages importable from tests
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+sys.path.insert(0, os.path.join(backend_dir, "lambda"))
+
+os.environ.setdefault("AWS_REGION", "eu-central-1")
+os.environ.setdefault("SPOTIFY_RATE_LIMITER", "local")
+# Tests calling a handler many times opt in with set_request_limiter
+os.environ.setdefault("REQUEST_RATE_LIMITER", "off")
+
+# shared.db creates its boto3 resource at import time, so moto (imported by
+# the harness) and dummy credentials must exist before that for the
+# in-memory AWS to work
+if boto3.session.Session().get_credentials() is None:
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+
+from benchmarks.harness import local_aws  # noqa: E402
+
+
+@pytest.fixture
+def aws():
+    """In-memory AWS (moto) with every table from infrastructure/ created."""
+    with local_aws() as dynamodb:
+        yield dynamodb
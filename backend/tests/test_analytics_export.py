@@ -0,0 +1,156 @@
+"""
+Tests for the parallel-scan analytics export
+"""
+
+import time
+
+import pytest
+
+from shared import analytics_export, db
+from shared.analytics_export import run_export
+
+# user -> (spotify tracks, manual tracks, deleted spotify tracks)
+LIBRARIES = {"small": (3, 0, 0), "medium": (20, 2, 5), "large": (40, 0, 30)}
+
+
+@pytest.fixture
+def libraries(aws, mocker):
+    mocker.patch.object(analytics_export, "ANALYTICS_PART_ROWS", 10)
+    mocker.patch.object(analytics_export, "ANALYTICS_SCAN_PAGE_ITEMS", 5)
+    for user_id, (spotify, manual, deleted) in LIBRARIES.items():
+        tracks = [
+            {
+                "trackId": f"spotify:{user_id}{i}",
+                "trackName": f"Track {i}",
+                "artistName": "Artist",
+                "albumName": "Album",
+                "platform": "spotify",
+            }
+            for i in range(spotify)
+        ] + [
+            {
+                "trackId": f"manual:{user_id}{i}",
+                "trackName": f"Manual {i}",
+                "artistName": "Artist",
+                "albumName": "Album",
+                "platform": "manual",
+                "isManual": True,
+            }
+            for i in range(manual)
+        ]
+        db.store_tracks(user_id, tracks)
+        for i in range(deleted):
+            db.soft_delete_track(user_id, f"spotify:{user_id}{i}")
+
+
+def exported_rows(run_id):
+    s3 = analytics_export._get_s3_client()
+    listing = s3.list_objects_v2(
+        Bucket=analytics_export.ANALYTICS_BUCKET, Prefix=f"analytics/{run_id}/tracks/"
+    )
+    rows = []
+    for entry in listing.get("Contents", []):
+        part = analytics_export._get_json(entry["Key"])
+        columns = part["columns"]
+        rows.extend(zip(*(columns[name] for name in analytics_export.EXPORT_COLUMNS)))
+    return rows
+
+
+def test_export_aggregates_and_dumps_every_row(libraries):
+    result = run_export(total_segments=4, max_workers=2)
+
+    assert result["complete"] is True
+    summary = result["summary"]
+    assert summary["users"] == 3
+    assert summary["tracks"] == 3 + 17 + 10
+    assert summary["deletedTracks"] == 35
+    assert summary["platforms"] == {"spotify": 28, "manual": 2}
+    assert summary["librarySize"]["max"] == 17
+    assert summary["librarySize"]["histogram"]["0-9"] == 1
+    assert summary["tombstoneRatio"]["usersOverHalf"] == 1
+
+    rows = exported_rows(result["runId"])
+    assert len(rows) == 3 + 22 + 40
+    assert sum(1 for row in rows if row[-1]) == 35
+
+
+def test_users_spanning_segments_are_merged(aws, mocker):
+    segments = [
+        {"u1": {"tracks": 2, "deleted": 1, "platforms": {"spotify": 2}}},
+        {
+            "u1": {"tracks": 3, "deleted": 0, "platforms": {"spotify": 1, "manual": 2}},
+            "u2": {"tracks": 1, "deleted": 0, "platforms": {"spotify": 1}},
+        },
+    ]
+    mocker.patch.object(
+        analytics_export,
+        "export_segment",
+        side_effect=lambda run_id, segment, *args: segments[segment],
+    )
+
+    summary = run_export(total_segments=2, max_workers=1)["summary"]
+
+    assert summary["users"] == 2
+    assert summary["tracks"] == 6
+    assert summary["deletedTracks"] == 1
+    assert summary["platforms"] == {"spotify": 4, "manual": 2}
+    assert summary["librarySize"]["max"] == 5
+
+
+def test_interrupted_export_resumes_from_checkpoints(libraries, mocker):
+    flush = analytics_export._flush_part
+    calls = []
+
+    def crash_on_third_part(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise RuntimeError("worker died")
+        return flush(*args)
+
+    mocker.patch.object(analytics_export, "_flush_part", side_effect=crash_on_third_part)
+    run_id = analytics_export.new_run_id()
+    with pytest.raises(RuntimeError):
+        run_export(run_id, total_segments=1, max_workers=1)
+    mocker.patch.object(analytics_export, "_flush_part", flush)
+
+    result = run_export(run_id)
+
+    assert result["complete"] is True
+    assert result["summary"]["tracks"] == 30
+    # Nothing exported twice, nothing lost
+    rows = exported_rows(run_id)
+    assert len(rows) == 65
+    assert len({row[1] for row in rows}) == 65
+
+
+def test_deadline_is_checked_per_page_not_per_part(libraries, mocker):
+    mocker.patch.object(analytics_export, "ANALYTICS_PART_ROWS", 1_000)
+    scan = analytics_export.scan_segment
+
+    def slow_scan(*args, **kwargs):
+        for page in scan(*args, **kwargs):
+            yield page
+            time.sleep(0.2)
+
+    mocker.patch.object(analytics_export, "scan_segment", side_effect=slow_scan)
+    run_id = analytics_export.new_run_id()
+
+    result = run_export(run_id, total_segments=1, time_budget_seconds=0.1)
+
+    assert result["complete"] is False
+    # Stopped long before a whole part was read, with what it had written
+    assert 0 < len(exported_rows(run_id)) < 65
+
+    mocker.patch.object(analytics_export, "scan_segment", scan)
+    result = run_export(run_id)
+    assert result["complete"] is True
+    rows = exported_rows(run_id)
+    assert len(rows) == 65
+    assert len({row[1] for row in rows}) == 65
+
+
+def test_export_stops_within_its_time_budget(libraries):
+    result = run_export(total_segments=2, time_budget_seconds=0)
+
+    assert result == {"runId": result["runId"], "complete": False, "segmentsLeft": 2}
+    assert run_export(result["runId"])["complete"] is True
@@ -0,0 +1,100 @@
+"""
+Tests for audio features enrichment during library sync
+"""
+
+import pytest
+
+from benchmarks.bench_sync import configure_spotify, seed_connection
+from benchmarks.fake_spotify import FakeSpotify, generate_library
+from shared import db, providers
+from shared.audio_features import decode_features, encode_features
+from shared.library_sync import sync_spotify_library
+
+
+@pytest.fixture
+def spotify(aws):
+    with FakeSpotify(generate_library(250, seed=3)) as fake:
+        configure_spotify(fake, 1_000_000)
+        yield fake
+
+
+def stored_features(user_id):
+    return {
+        track_id: features
+        for track_id, (_, _, features) in db.get_library_state(user_id).items()
+    }
+
+
+def test_encoded_features_round_trip():
+    features = {
+        "tempo": 120.0512,
+        "energy": 0.734,
+        "key": 5,
+        "mode": 1,
+        "danceability": 0.5,
+        "valence": 0.404,
+        "acousticness": 0.0123,
+        "instrumentalness": 0,
+        "loudness": -5.23,
+        "time_signature": 4,
+    }
+
+    encoded = encode_features(features)
+
+    assert encoded == "120.1,0.73,5,1,0.5,0.4,0.01,0,-5.2,4"
+    assert decode_features(encoded) == {
+        "tempo": 120.1,
+        "energy": 0.73,
+        "key": 5,
+        "mode": 1,
+        "danceability": 0.5,
+        "valence": 0.4,
+        "acousticness": 0.01,
+        "instrumentalness": 0.0,
+        "loudness": -5.2,
+        "time_signature": 4,
+    }
+    assert encode_features(None) == ""
+    assert decode_features("") is None
+
+
+def test_sync_fetches_features_in_full_batches(spotify):
+    seed_connection("first-user")
+
+    sync_spotify_library("first-user")
+
+    assert spotify.requests["/v1/audio-features"] == 3
+    features = stored_features("first-user")
+    assert len(features) == 250
+    assert all(value is not None for value in features.values())
+    # Tracks the platform has no features for are remembered as such
+    assert 0 < list(features.values()).count("") < 250
+
+
+def test_overlapping_library_is_enriched_from_the_shared_table(spotify):
+    seed_connection("first-user")
+    sync_spotify_library("first-user")
+    first = stored_features("first-user")
+
+    spotify.requests.clear()
+    spotify.library = spotify.library[:200] + generate_library(260, seed=3)[250:]
+    seed_connection("second-user")
+    sync_spotify_library("second-user")
+
+    # Only the 10 tracks the first user does not have are fetched
+    assert spotify.requests["/v1/audio-features"] == 1
+    second = stored_features("second-user")
+    assert all(second[track_id] == first[track_id] for track_id in list(second)[:200])
+
+
+def test_failed_feature_fetch_does_not_fail_the_sync(spotify, mocker):
+    seed_connection("first-user")
+    mocker.patch.object(
+        providers.SpotifyProvider, "fetch_audio_features", side_effect=RuntimeError("forbidden")
+    )
+
+    summary = sync_spotify_library("first-user")
+
+    assert summary["synced"] == 250
+    assert set(stored_features("first-user").values()) == {None}
+    assert db.get_audio_features(list(stored_features("first-user"))) == {}
@@ -0,0 +1,128 @@
+"""
+Tests for the POST /batch multi-operation endpoint
+"""
+
+import json
+
+from benchmarks.harness import CallCounter, make_event
+from service.batch import lambda_handler as batch_handler
+from shared import db
+
+USER_ID = "batch-user"
+
+
+def seed_library(count):
+    db.users_table.put_item(Item={"userId": USER_ID, "email": "batch@example.com"})
+    db.store_tracks(
+        USER_ID,
+        [
+            {
+                "trackId": f"spotify:{i:03d}",
+                "trackName": f"Track {i}",
+                "artistName": "Artist",
+                "albumName": "Album",
+                "platform": "spotify",
+            }
+            for i in range(count)
+        ],
+    )
+    db.save_platform_connection(
+        USER_ID, "spotify", {"access_token": "token", "refresh_token": "refresh"}, None
+    )
+    db.record_sync_result(USER_ID, "spotify", {"synced": count, "message": "Synced"})
+
+
+def post(operations):
+    response = batch_handler(
+        make_event("POST", "/batch", user_id=USER_ID, body={"operations": operations}), None
+    )
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_operations_are_answered_in_order_with_merged_reads(aws):
+    seed_library(30)
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        status, body = post(
+            [
+                {"id": "first", "op": "library.page", "limit": 10},
+                {
+                    "id": "second",
+                    "op": "library.page",
+                    "limit": 10,
+                    "lastKey": {"userId": USER_ID, "trackId": "spotify:020"},
+                },
+                {"id": "stats", "op": "library.stats"},
+                {"id": "sync", "op": "sync.status"},
+                {"id": "other", "op": "sync.status", "platform": "deezer"},
+                {"id": "gone", "op": "library.delete", "trackId": "spotify:000"},
+                {"id": "missing", "op": "library.delete", "trackId": "spotify:999"},
+            ]
+        )
+        calls = dict(counter.calls)
+    finally:
+        counter.close()
+
+    assert status == 200
+    results = {result["id"]: result for result in body["results"]}
+    assert list(results) == ["first", "second", "stats", "sync", "other", "gone", "missing"]
+    assert results["first"]["body"]["count"] == 10
+    assert results["first"]["body"]["items"][0]["trackId"] == "spotify:029"
+    assert results["second"]["body"]["items"][0]["trackId"] == "spotify:019"
+    assert results["stats"]["status"] == 200
+    assert results["stats"]["body"]["lastChangedAt"] is not None
+    assert results["sync"]["body"]["connected"] is True
+    assert results["sync"]["body"]["syncing"] is False
+    assert results["sync"]["body"]["lastSyncResult"]["synced"] == 30
+    assert results["other"]["body"] == {"platform": "deezer", "connected": False}
+    assert results["gone"]["status"] == 200
+    assert results["missing"]["status"] == 404
+    # Stats, sync status and delete lookups share one BatchGetItem
+    assert calls["BatchGetItem"] == 1
+    assert calls["Query"] == 2
+    assert db.get_library_state(USER_ID)["spotify:000"][1] is True
+
+
+def test_deletes_are_logged_together(aws):
+    seed_library(5)
+    seq, _ = db.get_library_seq(USER_ID)
+
+    status, body = post(
+        [{"op": "library.delete", "trackId": f"spotify:{i:03d}"} for i in (1, 2, 2, 3)]
+    )
+
+    assert status == 200
+    assert [result["status"] for result in body["results"]] == [200, 200, 404, 200]
+    assert [result["id"] for result in body["results"]] == [0, 1, 2, 3]
+    changes = db.get_library_changes(USER_ID, seq)
+    assert [(change["op"], change["trackId"]) for change in changes] == [
+        ("delete", "spotify:001"),
+        ("delete", "spotify:002"),
+        ("delete", "spotify:003"),
+    ]
+
+
+def test_invalid_operations_fail_alone(aws):
+    seed_library(3)
+
+    status, body = post(
+        [
+            {"op": "library.page", "limit": "many"},
+            {"op": "library.drop"},
+            "library.stats",
+            {"op": "library.stats"},
+        ]
+    )
+
+    assert status == 200
+    assert [result["status"] for result in body["results"]] == [400, 400, 400, 200]
+    assert body["results"][3]["body"]["tracks"] is None
+
+
+def test_batch_limits(aws):
+    seed_library(1)
+
+    assert post([])[0] == 400
+    assert post([{"op": "library.stats"}] * 26)[0] == 400
+    response = batch_handler(make_event("POST", "/batch", body={"operations": []}), None)
+    assert response["statusCode"] == 401
@@ -0,0 +1,76 @@
+"""
+Tests for the parallel BatchWriteItem engine
+"""
+
+from botocore.exceptions import ClientError
+
+from shared import batch_writer, db
+from shared.batch_writer import ParallelBatchWriter
+
+
+class FlakyClient:
+    """Returns half of every batch as unprocessed on the first few calls."""
+
+    def __init__(self, flaky_calls):
+        self.flaky_calls = flaky_calls
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems, ReturnConsumedCapacity):
+        self.calls += 1
+        (table, requests), = RequestItems.items()
+        if self.calls == 1:
+            raise ClientError(
+                {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+                "BatchWriteItem",
+            )
+        unprocessed = requests[len(requests) // 2 :] if self.calls <= self.flaky_calls else []
+        return {
+            "UnprocessedItems": {table: unprocessed} if unprocessed else {},
+            "ConsumedCapacity": [{"TableName": table, "CapacityUnits": 1.0}],
+        }
+
+
+def test_writes_all_items_in_parallel_batches(aws):
+    items = [{"userId": "u", "trackId": f"t{i:03d}", "trackName": None} for i in range(60)]
+
+    stats = ParallelBatchWriter(db.library_table.name, client=aws.meta.client).put_items(items)
+
+    assert stats["written"] == 60
+    assert stats["batches"] == 3
+    assert stats["failed"] == 0
+    assert db.library_table.scan(Select="COUNT")["Count"] == 60
+
+
+def test_retries_unprocessed_items_and_backs_off(mocker):
+    mocker.patch.object(batch_writer.time, "sleep")
+    client = FlakyClient(flaky_calls=3)
+    writer = ParallelBatchWriter("table", client=client, max_workers=4)
+
+    stats = writer.write([{"PutRequest": {"Item": {"id": i}}} for i in range(100)])
+
+    assert stats["written"] == 100
+    assert stats["failed"] == 0
+    assert stats["retries"] >= 3
+    assert stats["throttleEvents"] >= 3
+    assert stats["lowestConcurrency"] < 4
+
+
+def test_gives_up_after_max_retries(mocker):
+    mocker.patch.object(batch_writer.time, "sleep")
+    writer = ParallelBatchWriter("table", client=FlakyClient(flaky_calls=100), max_retries=2)
+
+    stats = writer.write([{"PutRequest": {"Item": {"id": i}}} for i in range(4)])
+
+    assert stats["failed"] > 0
+    assert stats["written"] + stats["failed"] == 4
+
+
+def test_save_tracks_skips_soft_deleted(aws):
+    track = {"trackName": "x", "artistName": "a", "albumName": "b", "platform": "spotify"}
+    db.save_tracks("u", [dict(track, trackId="spotify:1")])
+    assert db.soft_delete_track("u", "spotify:1")
+
+    saved = db.save_tracks("u", [dict(track, trackId=f"spotify:{i}") for i in range(1, 31)])
+
+    assert saved == 29
+    assert db.library_table.get_item(Key={"userId": "u", "trackId": "spotify:1"})["Item"]["deletedAt"]
@@ -0,0 +1,110 @@
+"""
+Tests for compact cover art storage and the thumbnail service
+"""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from benchmarks.fake_spotify import FakeSpotify
+from benchmarks.harness import make_event
+from service.cover_art import lambda_handler as cover_art_handler
+from shared import cover_art, request_limits, thumbnails
+from shared.request_limits import LocalRequestLimiter, set_request_limiter
+from shared.spotify_utils import parse_track, parse_tracks_page
+
+IMAGES = [
+    {"url": "https://i.scdn.co/image/ab67large", "width": 640, "height": 640},
+    {"url": "https://i.scdn.co/image/ab67medium", "width": 300, "height": 300},
+    {"url": "https://i.scdn.co/image/ab67small", "width": 64, "height": 64},
+]
+
+
+def jpeg(size):
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), (200, 30, 30)).save(out, "JPEG")
+    return out.getvalue()
+
+
+@pytest.fixture
+def origin(aws, mocker):
+    with FakeSpotify(images={"ab67medium": jpeg(300)}) as fake:
+        mocker.patch.object(thumbnails, "COVER_ART_ORIGIN", fake.image_origin)
+        yield fake
+
+
+def request(image_id="ab67medium", size="128", source_ip="127.0.0.1"):
+    event = make_event(
+        "GET",
+        f"/cover-art/{image_id}/{size}",
+        path_params={"imageId": image_id, "size": size},
+        route="/cover-art/{imageId}/{size}",
+        source_ip=source_ip,
+    )
+    return cover_art_handler(event, None)
+
+
+def test_images_are_stored_compactly_with_every_size():
+    encoded = cover_art.encode_images(list(reversed(IMAGES)))
+
+    assert encoded == "640:ab67large 300:ab67medium 64:ab67small"
+    assert [image["url"] for image in cover_art.decode_images(encoded)] == [
+        image["url"] for image in IMAGES
+    ]
+    track = {"id": "t1", "album": {"id": "album1", "images": IMAGES}}
+    assert parse_track(track)["coverArt"] == encoded
+    batch = parse_tracks_page([{"track": track}])
+    assert batch.columns["coverArt"] == [encoded]
+
+
+def test_served_items_link_to_a_list_size_thumbnail(mocker):
+    item = {"platformAlbumId": "album1", "coverArt": cover_art.encode_images(IMAGES)}
+
+    # Without the service, the smallest origin image that fits
+    served = cover_art.add_cover_art_url(dict(item))
+    assert served["coverArtUrl"].endswith("/ab67medium")
+    assert "coverArt" not in served
+
+    mocker.patch.object(cover_art, "COVER_ART_BASE_URL", "https://api.example.com")
+    assert (
+        cover_art.add_cover_art_url(dict(item))["coverArtUrl"]
+        == "https://api.example.com/cover-art/ab67medium/128"
+    )
+
+
+def test_thumbnail_is_made_once_and_cached(origin):
+    first = request()
+    second = request()
+
+    assert first["statusCode"] == second["statusCode"] == 200
+    assert first["headers"]["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert first["isBase64Encoded"] is True
+    image = Image.open(io.BytesIO(base64.b64decode(first["body"])))
+    assert image.size == (128, 128)
+    assert second["body"] == first["body"]
+    assert origin.requests["/image/ab67medium"] == 1
+    # One object per image and size, whatever album it is requested for
+    listed = thumbnails._get_s3_client().list_objects_v2(Bucket=thumbnails.COVER_ART_BUCKET)
+    assert [item["Key"] for item in listed["Contents"]] == ["covers/ab67medium/128.jpg"]
+
+
+def test_requests_are_limited_per_source_ip(origin, monkeypatch):
+    monkeypatch.setattr(
+        request_limits, "route_limits", {"GET /cover-art/{imageId}/{size}": (1, 2)}
+    )
+    set_request_limiter(LocalRequestLimiter())
+    try:
+        statuses = [request(size=size)["statusCode"] for size in ("64", "128", "300")]
+        assert statuses == [200, 200, 429]
+        assert request(source_ip="10.0.0.2")["statusCode"] == 200
+    finally:
+        set_request_limiter(None)
+
+
+def test_invalid_requests_are_rejected(origin):
+    assert request(size="1000")["statusCode"] == 400
+    assert request(image_id="../../etc")["statusCode"] == 400
+    assert request(image_id="missing")["statusCode"] == 404
+    assert not origin.requests["/image/../../etc"]
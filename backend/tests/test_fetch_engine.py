@@ -0,0 +1,168 @@
+"""
+Tests for the concurrent multi-provider fetch engine
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+from benchmarks.bench_sync import configure_spotify, seed_connection
+from benchmarks.fake_provider import FakeProvider
+from benchmarks.fake_spotify import FakeSpotify, generate_library
+from shared import db, fetch_engine, providers, token_manager
+from shared.library_sync import SyncError, sync_library
+
+USER_ID = "multi-user"
+
+
+def iso_in(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+def connect(provider, user_id=USER_ID, expires_in=3600):
+    token_manager._token_cache.pop((user_id, provider.name), None)
+    db.save_platform_connection(
+        user_id,
+        provider.name,
+        {"access_token": "token", "refresh_token": "refresh", "expires_at": iso_in(expires_in)},
+        None,
+    )
+
+
+@pytest.fixture
+def register(mocker):
+    def register(provider):
+        mocker.patch.dict(providers._PROVIDERS, {provider.name: provider})
+        return provider
+
+    return register
+
+
+def test_providers_are_fetched_concurrently(aws, register):
+    slow = register(FakeProvider(track_count=100, latency_ms=200, page_size=50, pool_size=1))
+    slower = FakeProvider(track_count=100, latency_ms=300, page_size=50, pool_size=1)
+    slower.name = "fakemusic2"
+    register(slower)
+    connect(slow)
+    connect(slower)
+
+    start = time.monotonic()
+    results = fetch_engine.fetch_libraries(USER_ID, ["fakemusic", "fakemusic2"])
+    elapsed = time.monotonic() - start
+
+    assert [len(batch) for batch in results.values()] == [100, 100]
+    # Two sequential pages each: 0.4s and 0.6s, run side by side
+    assert elapsed < 0.9
+
+
+def test_pages_are_fetched_in_parallel_and_kept_in_order(aws, register):
+    fake = register(FakeProvider(track_count=500, latency_ms=100, page_size=50, pool_size=10))
+    connect(fake)
+
+    start = time.monotonic()
+    batch = fetch_engine.fetch_libraries(USER_ID, ["fakemusic"])["fakemusic"]
+
+    assert time.monotonic() - start < 0.5
+    assert batch.track_ids() == [f"fakemusic:fm{i:010d}" for i in range(500)]
+    assert fake.requests["tracks"] == 10
+
+
+def test_tracks_repeated_on_overlapping_pages_are_stored_once(aws, register):
+    class ShiftingProvider(FakeProvider):
+        # A track added to the front mid-crawl pushes each later page back by one
+        def fetch_page(self, access_token, offset, limit):
+            items, total, has_next = super().fetch_page(access_token, max(offset - 1, 0), limit)
+            return items, total, offset + limit < len(self.library)
+
+    fake = register(ShiftingProvider(track_count=120, page_size=50))
+    connect(fake)
+
+    batch = fetch_engine.fetch_libraries(USER_ID, ["fakemusic"])["fakemusic"]
+    assert batch.track_ids() == [f"fakemusic:fm{i:010d}" for i in range(120)]
+
+    summary = sync_library(USER_ID, platforms=["fakemusic"])
+    assert summary["synced"] == 120
+    assert "failed" not in summary
+    assert len(db.get_library_state(USER_ID)) == 120
+
+
+def test_expired_token_is_refreshed_through_the_provider(aws, register):
+    fake = register(FakeProvider(track_count=10))
+    connect(fake, expires_in=-60)
+
+    assert len(fetch_engine.fetch_libraries(USER_ID, ["fakemusic"])["fakemusic"]) == 10
+    assert fake.requests["token"] == 1
+
+
+def test_sync_stores_every_connected_library(aws, register):
+    fake = register(FakeProvider(track_count=30))
+    with FakeSpotify(generate_library(60, seed=1)) as spotify:
+        configure_spotify(spotify, 1_000_000)
+        seed_connection(USER_ID)
+        connect(fake)
+
+        summary = sync_library(USER_ID, user_initiated=True)
+
+    assert summary["synced"] == 90
+    assert {platform: s["synced"] for platform, s in summary["platforms"].items()} == {
+        "spotify": 60,
+        "fakemusic": 30,
+    }
+    platforms = [track_id.split(":")[0] for track_id in db.get_library_state(USER_ID)]
+    assert platforms.count("spotify") == 60
+    assert platforms.count("fakemusic") == 30
+
+
+def test_failing_provider_is_reported_and_others_still_sync(aws, register):
+    register(FakeProvider(track_count=20, fail=True))
+    healthy = FakeProvider(track_count=30)
+    healthy.name = "fakemusic2"
+    register(healthy)
+    connect(providers.get_provider("fakemusic"))
+    connect(healthy)
+
+    summary = sync_library(USER_ID)
+
+    assert summary["synced"] == 30
+    assert summary["platforms"]["fakemusic"]["error"] == "Failed to fetch tracks from Fake Music"
+    connection = db.get_platform_connection(USER_ID, "fakemusic", consistent=True)
+    assert "syncLeaseOwner" not in connection
+
+    with pytest.raises(SyncError) as error:
+        sync_library(USER_ID, platforms=["fakemusic"])
+    assert error.value.status_code == 500
+
+
+def test_sync_without_connections_is_rejected(aws):
+    with pytest.raises(SyncError) as error:
+        sync_library(USER_ID)
+    assert error.value.status_code == 400
+
+
+def test_provider_must_implement_the_library_calls():
+    class Incomplete(providers.LibraryProvider):
+        name = "incomplete"
+
+        def refresh_tokens(self, refresh_token):
+            return {}, None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_rejected_token_is_evicted(aws, register, mocker):
+    fake = register(FakeProvider(track_count=10))
+    connect(fake)
+    assert token_manager.get_access_token(USER_ID, "fakemusic") == ("token", None)
+    response = requests.Response()
+    response.status_code = 401
+    mocker.patch.object(
+        fake, "fetch_page", side_effect=requests.exceptions.HTTPError(response=response)
+    )
+
+    result = fetch_engine.fetch_libraries(USER_ID, ["fakemusic"])["fakemusic"]
+
+    assert isinstance(result, fetch_engine.FetchError) and result.status_code == 401
+    assert (USER_ID, "fakemusic") not in token_manager._token_cache
@@ -0,0 +1,62 @@
+"""
+Tests for request-level tracing and EMF output
+"""
+
+import json
+
+from shared import db, instrumentation
+from shared.instrumentation import instrument_handler, span
+
+
+def emitted_records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_spans_are_noops_outside_handlers():
+    assert span("anything") is instrumentation._NULL_SPAN
+
+
+def test_handler_emits_one_emf_record(aws, capsys):
+    @instrument_handler
+    def handler(event, context):
+        db.get_user("missing")
+        with span("work"):
+            pass
+        return {"statusCode": 204}
+
+    handler({}, None)
+
+    (record,) = emitted_records(capsys)
+    assert record["StatusCode"] == 204
+    assert record["db.get_user.count"] == 1
+    assert record["work.count"] == 1
+    assert record["ConsumedRCU"] > 0
+    metric_names = {m["Name"] for m in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+    assert {"Duration", "db.get_user.ms", "ConsumedRCU"} <= metric_names
+
+
+def test_batch_writer_threads_report_to_invocation(aws, capsys):
+    @instrument_handler
+    def handler(event, context):
+        track = {"trackName": "x", "artistName": "a", "albumName": "b", "platform": "spotify"}
+        db.save_tracks("u", [dict(track, trackId=f"spotify:{i}") for i in range(30)])
+        return {"statusCode": 200}
+
+    handler({}, None)
+
+    (record,) = emitted_records(capsys)
+    assert record["ConsumedWCU"] > 0
+
+
+def test_profiler_samples_when_enabled(mocker, capsys):
+    mocker.patch.object(instrumentation, "PROFILE_SAMPLE_INTERVAL_MS", 1)
+
+    @instrument_handler
+    def handler(event, context):
+        sum(i * i for i in range(2_000_000))
+        return {"statusCode": 200}
+
+    handler({}, None)
+
+    (record,) = emitted_records(capsys)
+    assert record["profile"]
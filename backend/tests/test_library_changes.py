@@ -0,0 +1,140 @@
+"""
+Tests for the library change log and GET /library/changes
+"""
+
+import json
+import time
+
+from benchmarks.harness import CallCounter, make_event
+from service.library import lambda_handler as library_handler
+from shared import db, library_changes
+from shared.library_changes import encode_cursor, get_changes_since
+
+USER_ID = "changes-user"
+
+
+def track(i, name=None):
+    return {
+        "trackId": f"spotify#{i}",
+        "trackName": name or f"Track {i}",
+        "artistName": "Artist",
+        "albumName": "Album",
+        "platform": "spotify",
+        "addedDate": "2026-01-01T00:00:00+00:00",
+    }
+
+
+def get_changes(cursor):
+    event = make_event("GET", "/library/changes", user_id=USER_ID, query={"since": cursor})
+    response = library_handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def setup_user():
+    db.users_table.put_item(Item={"userId": USER_ID, "email": "changes@example.com"})
+
+
+def test_changes_since_snapshot_cursor(aws):
+    setup_user()
+    db.save_tracks(USER_ID, [track(1), track(2), track(3)])
+    snapshot = library_handler(make_event("GET", "/library/snapshot", user_id=USER_ID), None)
+    cursor = json.loads(snapshot["body"])["cursor"]
+
+    db.save_tracks(USER_ID, [track(1), track(2, "Renamed"), track(3), track(4)])
+    db.soft_delete_track(USER_ID, "spotify#3")
+
+    status, body = get_changes(cursor)
+    assert status == 200
+    assert [t["trackId"] for t in body["inserted"]] == ["spotify#4"]
+    assert [t["trackName"] for t in body["updated"]] == ["Renamed"]
+    assert body["deleted"] == ["spotify#3"]
+    assert body["hasMore"] is False
+    assert "contentHash" not in body["inserted"][0]
+
+    status, body = get_changes(body["cursor"])
+    assert (body["inserted"], body["updated"], body["deleted"]) == ([], [], [])
+
+
+def test_unchanged_tracks_are_not_rewritten(aws):
+    setup_user()
+    db.save_tracks(USER_ID, [track(i) for i in range(30)])
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        result = db.store_tracks(USER_ID, [track(i) for i in range(30)])
+    finally:
+        counter.close()
+
+    assert (result["written"], result["unchanged"]) == (0, 30)
+    assert counter.calls["BatchWriteItem"] == 0
+    assert db.get_library_seq(USER_ID)[0] == 30
+
+
+def test_insert_then_delete_is_compacted_away(aws):
+    setup_user()
+    cursor = encode_cursor(0)
+    db.save_tracks(USER_ID, [track(1)])
+    db.soft_delete_track(USER_ID, "spotify#1")
+
+    changes = get_changes_since(USER_ID, cursor)
+
+    assert (changes["inserted"], changes["deleted"]) == ([], [])
+    assert changes["cursor"].startswith("2-")
+
+
+def test_deletes_that_find_nothing_are_not_logged(aws):
+    setup_user()
+    db.save_tracks(USER_ID, [track(1), track(2)])
+    assert db.soft_delete_track(USER_ID, "spotify#1")
+
+    assert not db.soft_delete_track(USER_ID, "spotify#1")
+    assert not db.soft_delete_track(USER_ID, "spotify#9")
+    assert db.soft_delete_tracks(USER_ID, ["spotify#1", "spotify#2", "spotify#9"]) == ["spotify#2"]
+    assert not db.soft_delete_track("unknown-user", "spotify#1")
+
+    assert db.get_library_seq(USER_ID)[0] == 4
+    assert get_changes_since(USER_ID, encode_cursor(2))["deleted"] == ["spotify#1", "spotify#2"]
+    assert "Item" not in db.users_table.get_item(Key={"userId": "unknown-user"})
+
+
+def test_expired_and_malformed_cursors(aws):
+    setup_user()
+    old = encode_cursor(0, time.time() - db.CHANGE_LOG_RETENTION_SECONDS - 60)
+
+    status, body = get_changes(old)
+    assert status == 410
+    assert body["details"] == {"resync": True}
+
+    assert get_changes("not-a-cursor")[0] == 400
+
+
+def test_waits_for_in_flight_seqs_then_skips_abandoned_ones(aws):
+    setup_user()
+    now = int(time.time())
+    db.log_library_changes(USER_ID, [("insert", "spotify#1", track(1))])
+    # Seq 2 allocated by a writer that has not logged its entry yet
+    db.users_table.update_item(
+        Key={"userId": USER_ID},
+        UpdateExpression="ADD librarySeq :one",
+        ExpressionAttributeValues={":one": 1},
+    )
+    db.log_library_changes(USER_ID, [("insert", "spotify#3", track(3))])
+
+    changes = get_changes_since(USER_ID, encode_cursor(0), now=now)
+    assert [t["trackId"] for t in changes["inserted"]] == ["spotify#1"]
+    assert changes["cursor"].startswith("1-")
+
+    later = now + library_changes.CHANGE_LOG_GAP_TIMEOUT_SECONDS + 1
+    changes = get_changes_since(USER_ID, changes["cursor"], now=later)
+    assert [t["trackId"] for t in changes["inserted"]] == ["spotify#3"]
+    assert changes["cursor"] == f"3-{later}"
+
+
+def test_large_change_sets_force_a_resync(aws, mocker):
+    mocker.patch.object(db, "CHANGE_LOG_MAX_ENTRIES", 10)
+    setup_user()
+    cursor = encode_cursor(0)
+
+    result = db.store_tracks(USER_ID, [track(i) for i in range(11)])
+
+    assert (result["firstSeq"], result["lastSeq"]) == (1, 1)
+    assert get_changes(cursor)[0] == 410
@@ -0,0 +1,187 @@
+"""
+Tests for library similarity sketches and the friends overlap endpoints
+"""
+
+import json
+
+from benchmarks.bench_sync import configure_spotify, seed_connection
+from benchmarks.fake_spotify import FakeSpotify, generate_library
+from benchmarks.harness import make_event
+from service.friends import lambda_handler as friends_handler
+from service.library import lambda_handler as library_handler
+from shared import db, library_sketch, library_sync
+from shared.library_sketch import (
+    build_sketch,
+    estimate_overlap,
+    rebuild_sketch,
+    refresh_sketch,
+)
+
+USER_ID = "sketch-user"
+
+
+def ids(start, stop):
+    return [f"spotify:track{i:06d}" for i in range(start, stop)]
+
+
+def seed_library(user_id, track_ids):
+    db.users_table.update_item(
+        Key={"userId": user_id},
+        UpdateExpression="SET displayName = :name",
+        ExpressionAttributeValues={":name": user_id.title()},
+    )
+    db.store_tracks(
+        user_id,
+        [
+            {
+                "trackId": track_id,
+                "trackName": track_id,
+                "artistName": "Artist",
+                "albumName": "Album",
+                "platform": "spotify",
+            }
+            for track_id in track_ids
+        ],
+    )
+
+
+def get(path, user_id=USER_ID, path_params=None):
+    event = make_event("GET", path, user_id=user_id, path_params=path_params)
+    response = friends_handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def test_estimate_is_close_for_large_libraries():
+    mine = build_sketch(ids(0, 10_000))
+    theirs = build_sketch(ids(7_000, 15_000))
+
+    overlap = estimate_overlap(mine, theirs)
+
+    assert overlap["exact"] is False
+    assert abs(overlap["sharedTracks"] - 3_000) < 3_000 * 0.25
+    assert len(mine["hashes"]) == 256 * 8
+
+
+def test_small_libraries_compare_exactly():
+    overlap = estimate_overlap(build_sketch(ids(0, 100)), build_sketch(ids(60, 200)))
+
+    assert overlap == {"sharedTracks": 40, "jaccard": 0.2, "exact": True}
+
+
+def test_incremental_updates_match_a_rebuild(aws):
+    seed_library(USER_ID, ids(0, 500))
+    rebuild_sketch(USER_ID)
+
+    seed_library(USER_ID, ids(500, 700))
+    refresh_sketch(USER_ID, added_track_ids=ids(500, 700))
+    for track_id in ids(0, 300)[::7]:
+        event = make_event(
+            "DELETE", f"/library/{track_id}", user_id=USER_ID, path_params={"trackId": track_id}
+        )
+        assert library_handler(event, None)["statusCode"] == 200
+
+    remaining = [track_id for track_id in ids(0, 700) if track_id not in ids(0, 300)[::7]]
+    stored = db.get_library_sketch(USER_ID, consistent=True)
+    expected = build_sketch(remaining)
+    assert int(stored["count"]) == expected["count"]
+    assert bytes(stored["hashes"]) == expected["hashes"]
+
+
+def test_sync_adds_new_tracks_to_the_sketch(aws, mocker):
+    mocker.patch.object(library_sync, "SYNC_DEBOUNCE_SECONDS", 0)
+    library = generate_library(400, seed=4)
+    with FakeSpotify(library[:300]) as spotify:
+        configure_spotify(spotify, 1_000_000)
+        seed_connection(USER_ID)
+        library_sync.sync_spotify_library(USER_ID)
+        rebuild_sketch(USER_ID)
+
+        spotify.library = library
+        library_sync.sync_spotify_library(USER_ID)
+
+    stored = db.get_library_sketch(USER_ID, consistent=True)
+    expected = build_sketch(f"spotify:{item['track']['id']}" for item in library)
+    assert int(stored["count"]) == 400
+    assert bytes(stored["hashes"]) == expected["hashes"]
+
+
+def test_friends_are_ranked_by_estimated_overlap(aws):
+    seed_library(USER_ID, ids(0, 2_000))
+    seed_library("close-friend", ids(500, 2_500))
+    seed_library("distant-friend", ids(1_800, 3_000))
+    seed_library("stranger", ids(0, 2_000))
+    db.add_friend(USER_ID, "close-friend")
+    db.add_friend(USER_ID, "distant-friend")
+    for user_id in ("close-friend", "distant-friend"):
+        rebuild_sketch(user_id)
+
+    status, body = get("/friends/overlap")
+
+    assert status == 200
+    assert [friend["friendId"] for friend in body["friends"]] == [
+        "close-friend",
+        "distant-friend",
+    ]
+    close = body["friends"][0]
+    assert close["displayName"] == "Close-Friend"
+    assert close["libraryTracks"] == 2_000
+    assert abs(close["sharedTracks"] - 1_500) < 1_500 * 0.25
+
+
+def test_friends_without_a_sketch_are_pending_until_their_sync(aws, mocker):
+    seed_library(USER_ID, ids(0, 200))
+    db.add_friend(USER_ID, "new-friend")
+    seed_library("new-friend", ids(100, 200))
+    rebuild = mocker.spy(library_sketch, "rebuild_sketch")
+
+    status, body = get("/friends/overlap")
+
+    assert status == 200
+    assert body["friends"] == [
+        {"friendId": "new-friend", "displayName": "New-Friend", "pending": True}
+    ]
+    # Only the caller's own sketch was built, the friend's library was not read
+    assert [call.args for call in rebuild.call_args_list] == [(USER_ID,)]
+    assert db.get_library_sketch("new-friend") is None
+
+    read_library = mocker.spy(library_sketch, "get_library_state")
+    with FakeSpotify(generate_library(50, seed=5)) as spotify:
+        configure_spotify(spotify, 1_000_000)
+        seed_connection("new-friend")
+        library_sync.sync_spotify_library("new-friend")
+    # Built from the library the sync holds, not read again
+    assert read_library.call_count == 0
+
+    status, body = get("/friends/overlap")
+    friend = body["friends"][0]
+    assert "pending" not in friend
+    assert (friend["sharedTracks"], friend["libraryTracks"], friend["exact"]) == (100, 150, True)
+
+
+def test_exact_overlap_with_a_friend(aws):
+    seed_library(USER_ID, ids(0, 1_200))
+    seed_library("close-friend", ids(1_000, 1_500))
+    seed_library("stranger", ids(0, 1_200))
+    db.add_friend(USER_ID, "close-friend")
+    library_handler(
+        make_event(
+            "DELETE",
+            "/library/x",
+            user_id="close-friend",
+            path_params={"trackId": ids(1_000, 1_001)[0]},
+        ),
+        None,
+    )
+
+    status, body = get("/friends/close-friend/overlap", path_params={"friendId": "close-friend"})
+
+    assert status == 200
+    assert body == {
+        "friendId": "close-friend",
+        "sharedTracks": 199,
+        "jaccard": round(199 / 1_500, 4),
+        "libraryTracks": 499,
+        "exact": True,
+    }
+    status, _ = get("/friends/stranger/overlap", path_params={"friendId": "stranger"})
+    assert status == 404
@@ -0,0 +1,153 @@
+"""
+Tests for the per-user library snapshot objects
+"""
+
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import make_event
+from service.library import lambda_handler as library_handler
+from shared import db, library_snapshot
+from shared.track_batch import TrackBatch
+
+USER_ID = "snapshot-user"
+
+
+def seed_library(count):
+    db.users_table.put_item(Item={"userId": USER_ID, "email": "snapshot@example.com"})
+    tracks = [
+        {
+            "trackId": f"spotify#{i:04d}",
+            "trackName": f"Track {i}",
+            "artistName": "Artist",
+            "albumName": "Album",
+            "platform": "spotify",
+            "duration": 1000 + i,
+        }
+        for i in range(count)
+    ]
+    db.save_tracks(USER_ID, TrackBatch.from_tracks(tracks))
+
+
+def read_snapshot(snapshot):
+    body = library_snapshot._get_s3_client().get_object(
+        Bucket=library_snapshot.SNAPSHOT_BUCKET, Key=snapshot["key"]
+    )
+    assert body["ContentEncoding"] == "gzip"
+    return library_snapshot.decode_snapshot(body["Body"].read())
+
+
+def object_keys():
+    response = library_snapshot._get_s3_client().list_objects_v2(
+        Bucket=library_snapshot.SNAPSHOT_BUCKET
+    )
+    return {item["Key"] for item in response.get("Contents", [])}
+
+
+def test_snapshot_endpoint_builds_full_library_once(aws):
+    seed_library(120)
+
+    response = library_handler(make_event("GET", "/library/snapshot", user_id=USER_ID), None)
+    body = json.loads(response["body"])
+
+    assert response["statusCode"] == 200
+    assert body["version"] == 1 and body["count"] == 120
+    assert library_snapshot.SNAPSHOT_BUCKET in body["url"]
+
+    document = read_snapshot(db.get_library_snapshot(USER_ID))
+    page = db.get_user_library(USER_ID, limit=120)["items"]
+    assert [item["trackId"] for item in document["items"]] == [item["trackId"] for item in page]
+    assert "userId" not in document["items"][0]
+
+    # Served from the existing pointer the second time, HTTP API event shape
+    again = library_handler(
+        make_event("GET", "/library/snapshot", user_id=USER_ID, version=2), None
+    )
+    assert json.loads(again["body"])["version"] == 1
+
+
+def test_delete_patches_snapshot_and_keeps_one_old_version(aws):
+    seed_library(5)
+    first = library_snapshot.rebuild_snapshot(USER_ID)
+
+    for track_id in ("spotify#0001", "spotify#0003"):
+        event = make_event(
+            "DELETE", f"/library/{track_id}", user_id=USER_ID, path_params={"trackId": track_id}
+        )
+        assert library_handler(event, None)["statusCode"] == 200
+
+    current = db.get_library_snapshot(USER_ID)
+    assert current["version"] == 3
+    ids = [item["trackId"] for item in read_snapshot(current)["items"]]
+    assert ids == ["spotify#0004", "spotify#0002", "spotify#0000"]
+    # v1 was removed once v3 replaced v2
+    assert object_keys() == {current["key"], current["previousKey"]}
+    assert first["key"] not in object_keys()
+
+
+def test_concurrent_publish_loses_cleanly(aws):
+    seed_library(3)
+    current = library_snapshot.rebuild_snapshot(USER_ID)
+    library_snapshot.rebuild_snapshot(USER_ID)
+
+    # A publisher that read v1 before the second rebuild must not win
+    assert library_snapshot._publish(USER_ID, current, [], current["cursor"]) is None
+    assert db.get_library_snapshot(USER_ID)["version"] == 2
+    assert len(object_keys()) == 2
+
+
+def test_concurrent_rebuilds_share_the_winner(aws, mocker):
+    seed_library(3)
+    rebuilds = 4
+    # Every rebuild has read the library before any of them publishes
+    barrier = threading.Barrier(rebuilds)
+    iter_user_library = library_snapshot.iter_user_library
+
+    def read_library(*args, **kwargs):
+        items = list(iter_user_library(*args, **kwargs))
+        barrier.wait(timeout=10)
+        return items
+
+    mocker.patch.object(library_snapshot, "iter_user_library", side_effect=read_library)
+    with ThreadPoolExecutor(max_workers=rebuilds) as executor:
+        snapshots = list(
+            executor.map(lambda _: library_snapshot.rebuild_snapshot(USER_ID), range(rebuilds))
+        )
+
+    assert {snapshot["version"] for snapshot in snapshots} == {1}
+    assert {snapshot["key"] for snapshot in snapshots} == {db.get_library_snapshot(USER_ID)["key"]}
+    assert read_snapshot(snapshots[0])["count"] == 3
+    assert len(object_keys()) == 1
+
+
+def test_failed_refresh_drops_pointer(aws, mocker):
+    seed_library(3)
+    library_snapshot.rebuild_snapshot(USER_ID)
+    mocker.patch.object(library_snapshot, "iter_user_library", side_effect=RuntimeError("boom"))
+
+    library_snapshot.refresh_snapshot(USER_ID)
+
+    assert db.get_library_snapshot(USER_ID) is None
+
+
+def test_sync_merges_written_tracks_into_existing_snapshot(aws, mocker):
+    seed_library(3)
+    library_snapshot.rebuild_snapshot(USER_ID)
+    rebuild = mocker.spy(library_snapshot, "rebuild_snapshot")
+
+    written = [
+        {"userId": USER_ID, "trackId": "spotify#0001", "trackName": "Renamed"},
+        {"userId": USER_ID, "trackId": "spotify#0005", "trackName": "New"},
+    ]
+    library_snapshot.refresh_snapshot(USER_ID, added_items=written)
+
+    items = read_snapshot(db.get_library_snapshot(USER_ID))["items"]
+    assert [item["trackId"] for item in items] == [
+        "spotify#0005",
+        "spotify#0002",
+        "spotify#0001",
+        "spotify#0000",
+    ]
+    assert items[2]["trackName"] == "Renamed"
+    rebuild.assert_not_called()
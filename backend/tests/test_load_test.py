@@ -0,0 +1,53 @@
+"""
+Smoke test for the endpoint load test
+"""
+
+import argparse
+
+from benchmarks import load_test
+
+
+def test_every_endpoint_is_replayed_with_dependency_counts():
+    args = argparse.Namespace(
+        endpoints=load_test.ENDPOINTS,
+        requests=8,
+        concurrency=2,
+        users=4,
+        tracks=60,
+        api_version="mixed",
+        latency_ms=0,
+        rate_limit=1_000_000,
+        sync_debounce=0,
+    )
+
+    results = load_test.run(args)
+
+    assert list(results) == load_test.ENDPOINTS
+    for result in results.values():
+        assert result["errors"] == 0
+        assert sum(result["statuses"].values()) == 8
+        latency = result["latencyMs"]
+        assert latency["p50"] <= latency["p95"] <= latency["p99"] <= latency["max"]
+    assert results["login"]["callsPerRequest"]["dynamodb"] == 0
+    # Token exchange and profile for every returning login
+    assert results["callback"]["calls"]["spotify"] == {"/api/token": 8, "/v1/me": 8}
+    assert results["library"]["calls"]["dynamodb"] == {"Query": 8}
+    # Two library pages per sync
+    assert results["fetch_library"]["calls"]["spotify"] == {"/v1/me/tracks": 16}
+
+
+def test_compare_flags_regressions():
+    result = {
+        "errors": 0,
+        "latencyMs": {"p95": 10.0, "p99": 20.0},
+        "callsPerRequest": {"dynamodb": 2.0, "s3": 0.0, "ssm": 0.0, "spotify": 1.0},
+    }
+    worse = {
+        "errors": 1,
+        "latencyMs": {"p95": 10.0, "p99": 20.0},
+        "callsPerRequest": {"dynamodb": 3.0, "s3": 0.0, "ssm": 0.0, "spotify": 1.0},
+    }
+
+    regressions = load_test.compare({"library": worse}, {"results": {"library": result}})
+
+    assert len(regressions) == 2
@@ -0,0 +1,103 @@
+"""
+Tests for the in-container user and connection read cache
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.harness import CallCounter
+from shared import db, token_manager
+from shared.instrumentation import instrument_handler
+from shared.read_cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def iso_in(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+def test_entries_expire_and_least_recently_used_are_evicted():
+    clock = FakeClock()
+    cache = TTLCache("test", max_entries=2, ttl_seconds=10, clock=clock)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None
+
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hitRate": 1 / 3, "size": 1}
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    cache = TTLCache("test", max_entries=10, ttl_seconds=10)
+    generation = cache.generation
+    cache.invalidate("a")
+
+    cache.put("a", {"v": "read before the write"}, generation)
+
+    assert cache.get("a") is None
+
+
+def test_cached_values_are_copies():
+    cache = TTLCache("test", max_entries=10, ttl_seconds=10)
+    cache.put("a", {"tags": ["x"]})
+    cache.get("a")["tags"].append("y")
+    assert cache.get("a") == {"tags": ["x"]}
+
+
+def test_get_user_is_read_through_and_invalidated_by_writes(aws):
+    user = db.create_user("cache@example.com", "Cache", None, True)
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        db.get_user(user["userId"])
+        db.get_user(user["userId"])
+        assert counter.calls["GetItem"] == 1
+
+        db.link_spotify_id_to_user(user["userId"], "spotify-1")
+        assert db.get_user(user["userId"])["spotifyId"] == "spotify-1"
+        assert counter.calls["GetItem"] == 2
+    finally:
+        counter.close()
+
+
+def test_hit_rate_is_reported_per_invocation(aws, capsys):
+    db.save_platform_connection("user-1", "spotify", {"access_token": "a"}, None)
+
+    @instrument_handler
+    def handler(event, context):
+        db.get_platform_connection("user-1", "spotify")
+        db.get_platform_connection("user-1", "spotify")
+        return {"statusCode": 200}
+
+    handler({}, None)
+
+    out = capsys.readouterr().out
+    assert '"cache.connection.hits": 1' in out
+    assert '"cache.connection.misses": 1' in out
+
+
+def test_cached_connection_never_supplies_a_refreshed_away_token(aws):
+    token_manager._token_cache.clear()
+    db.save_platform_connection(
+        "user-1", "spotify", {"access_token": "old", "expires_at": iso_in(3600)}, None
+    )
+    assert db.get_platform_connection("user-1", "spotify")["accessToken"] == "old"
+
+    # Another container refreshes the token, this container's cache is not told
+    db.connections_table.update_item(
+        Key={"userId": "user-1", "platform": "spotify"},
+        UpdateExpression="SET accessToken = :access",
+        ExpressionAttributeValues={":access": "new"},
+    )
+
+    assert db.get_platform_connection("user-1", "spotify")["accessToken"] == "old"
+    assert token_manager.get_access_token("user-1", "spotify") == ("new", None)
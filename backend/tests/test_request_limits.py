@@ -0,0 +1,141 @@
+"""
+Tests for the per-user, per-route request limits in require_auth
+"""
+
+import json
+
+import pytest
+
+from benchmarks.harness import CallCounter, make_event
+from service.library import lambda_handler as library_handler
+from shared import db, request_limits
+from shared.request_limits import (
+    DynamoDBRequestLimiter,
+    LocalRequestLimiter,
+    route_key,
+    set_request_limiter,
+)
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(
+        request_limits, "route_limits", {"GET /library": (1, 3), "GET /library/changes": None}
+    )
+    yield
+    set_request_limiter(None)
+
+
+def get_library(user_id, version=1):
+    return library_handler(
+        make_event("GET", "/library", user_id=user_id, query={"limit": "10"}, version=version),
+        None,
+    )
+
+
+def test_requests_over_the_limit_get_429_with_retry_after(aws, limits):
+    clock = Clock()
+    set_request_limiter(DynamoDBRequestLimiter(clock=clock))
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        statuses = [get_library("limited", version=1 + i % 2)["statusCode"] for i in range(3)]
+        # One conditional write per admitted request
+        assert counter.calls["UpdateItem"] == 3
+
+        response = get_library("limited")
+        # Refused from the state the last write returned, without DynamoDB
+        assert counter.calls["UpdateItem"] == 3
+    finally:
+        counter.close()
+
+    assert statuses == [200, 200, 200]
+    assert response["statusCode"] == 429
+    assert response["headers"]["Retry-After"] == "1"
+    assert json.loads(response["body"])["details"] == {"retryAfter": 1}
+    assert get_library("other-user")["statusCode"] == 200
+
+    clock.now += 1
+    assert get_library("limited")["statusCode"] == 200
+    assert get_library("limited")["statusCode"] == 429
+
+
+def test_containers_share_the_bucket(aws):
+    clock = Clock()
+    first = DynamoDBRequestLimiter(clock=clock)
+    second = DynamoDBRequestLimiter(clock=clock)
+
+    assert first.check("user#shared#GET /library", 1, 2) == 0
+    assert second.check("user#shared#GET /library", 1, 2) == 0
+    assert first.check("user#shared#GET /library", 1, 2) == pytest.approx(1)
+    assert second.check("user#shared#GET /library", 1, 2) == pytest.approx(1)
+
+    clock.now += 5
+    assert second.check("user#shared#GET /library", 1, 2) == 0
+    item = db.rate_limits_table.get_item(Key={"bucketId": "user#shared#GET /library"})["Item"]
+    assert float(item["refilledAt"]) == pytest.approx(clock.now + 1)
+    assert item["expiresAt"] > clock.now
+
+
+def test_unlimited_routes_and_local_fallback(monkeypatch, limits):
+    def unavailable(*args):
+        raise RuntimeError("table unreachable")
+
+    monkeypatch.setattr(request_limits, "take_request_token", unavailable)
+    limiter = DynamoDBRequestLimiter(fallback=LocalRequestLimiter(clock=Clock()))
+    set_request_limiter(limiter)
+
+    event = make_event("GET", "/library/changes")
+    assert all(request_limits.check_request("someone", event) == 0 for _ in range(10))
+    event = make_event("GET", "/library")
+    assert [request_limits.check_request("someone", event) for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_default_route_is_keyed_by_template(limits):
+    # HTTP API $default routes carry only the concrete path
+    def default_event(method, path):
+        event = make_event(method, path, version=2)
+        event["routeKey"] = "$default"
+        return event
+
+    assert route_key(default_event("DELETE", "/library/spotify:1")) == "DELETE /library/{trackId}"
+    assert route_key(default_event("DELETE", "/library/spotify:2")) == "DELETE /library/{trackId}"
+    assert route_key(default_event("GET", "/friends/u2/overlap")) == (
+        "GET /friends/{friendId}/overlap"
+    )
+    assert route_key(default_event("GET", "/library/changes")) == "GET /library/changes"
+    assert route_key(default_event("GET", "/nowhere/123")) == "GET *"
+    assert route_key(default_event("GET", "/nowhere/456")) == "GET *"
+
+    # Every track shares one bucket instead of getting its own
+    set_request_limiter(LocalRequestLimiter())
+    waits = [
+        request_limits.check_request("someone", default_event("DELETE", f"/library/spotify:{i}"))
+        for i in range(request_limits.REQUEST_BURST + 1)
+    ]
+    assert waits[-1] > 0
+    assert len(request_limits.get_request_limiter()._buckets) == 1
+
+
+def test_route_key_and_configured_limits(monkeypatch):
+    assert route_key(make_event("POST", "/batch", version=2)) == "POST /batch"
+    event = make_event("DELETE", "/library/spotify:1")
+    event["resource"] = "/library/{trackId}"
+    assert route_key(event) == "DELETE /library/{trackId}"
+    event = make_event("POST", "/library/sync/spotify", path_params={"platform": "spotify"})
+    assert route_key(event) == "POST /library/sync/{platform}"
+
+    monkeypatch.setenv(
+        "REQUEST_LIMITS", json.dumps({"POST /batch": {"perSecond": 2, "burst": 4}, "GET /x": None})
+    )
+    limits = request_limits._load_route_limits()
+    assert limits["POST /batch"] == (2.0, 4)
+    assert limits["GET /x"] is None
+    assert limits["POST /library/sync"] == request_limits.ROUTE_LIMITS["POST /library/sync"]
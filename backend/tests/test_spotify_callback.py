@@ -0,0 +1,162 @@
+"""
+Tests for the Spotify login callback
+"""
+
+import json
+
+import pytest
+
+from auth.spotify_callback import lambda_handler as callback_handler
+from benchmarks.bench_sync import configure_spotify
+from benchmarks.fake_spotify import FakeSpotify
+from benchmarks.harness import CallCounter, make_event
+from shared import config, db
+
+
+@pytest.fixture
+def spotify(aws, monkeypatch):
+    monkeypatch.setenv("SPOTIFY_REDIRECT_URI", "http://localhost/callback")
+    with FakeSpotify() as fake:
+        configure_spotify(fake, 1_000_000)
+        yield fake
+
+
+def login():
+    event = make_event("GET", "/auth/spotify/callback", query={"code": "fake-code"})
+    response = callback_handler(event, None)
+    assert response["statusCode"] == 200, response["body"]
+    return json.loads(response["body"])
+
+
+def all_users():
+    return db.users_table.scan()["Items"]
+
+
+def test_first_login_creates_user_identities_and_connection(spotify):
+    body = login()
+
+    user_id = body["user"]["userId"]
+    assert [user["userId"] for user in all_users()] == [user_id]
+    assert db.get_identities(("spotify", "fake-spotify-user"), ("email", "fake@example.com")) == {
+        ("spotify", "fake-spotify-user"): user_id,
+        ("email", "fake@example.com"): user_id,
+    }
+    connection = db.get_platform_connection(user_id, "spotify")
+    assert connection["accessToken"] == "fake-access-token"
+
+
+def test_returning_login_is_lookups_plus_one_write(spotify, capsys):
+    user_id = login()["user"]["userId"]
+    capsys.readouterr()
+
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        assert login()["user"]["userId"] == user_id
+    finally:
+        counter.close()
+
+    assert dict(counter.calls) == {"BatchGetItem": 1, "GetItem": 1, "UpdateItem": 1}
+    assert len(all_users()) == 1
+
+    record = json.loads(capsys.readouterr().out.splitlines()[-1])
+    for stage in ("secrets", "exchange", "profile", "user", "jwt"):
+        assert f"callback.{stage}.ms" in record
+    assert record["callback.existing"] == 1
+
+
+def test_returning_login_keeps_sync_state(spotify):
+    user_id = login()["user"]["userId"]
+    assert db.acquire_sync_lease(user_id, "spotify", "running-sync", 300, 0)
+    db.record_sync_result(user_id, "spotify", {"synced": 7, "message": "Synced"}, True)
+    before = db.get_platform_connection(user_id, "spotify", cached=False)
+
+    login()
+
+    after = db.get_platform_connection(user_id, "spotify", cached=False)
+    for name in (
+        "syncLeaseOwner",
+        "syncLeaseUntil",
+        "lastSyncedAt",
+        "lastSyncedEpoch",
+        "lastSyncResult",
+        "lastSyncCount",
+        "lastActiveAt",
+        "connectedAt",
+    ):
+        assert after.get(name) == before.get(name), name
+    assert after["syncLeaseOwner"] == "running-sync"
+    assert after["accessToken"] == "fake-access-token"
+
+
+def test_identity_of_a_missing_user_fails_cleanly(spotify, caplog):
+    user_id = login()["user"]["userId"]
+    db.users_table.delete_item(Key={"userId": user_id})
+    db.clear_read_caches()
+
+    event = make_event("GET", "/auth/spotify/callback", query={"code": "fake-code"})
+    response = callback_handler(event, None)
+
+    assert response["statusCode"] == 500
+    assert json.loads(response["body"])["error"] == "Failed to sign in"
+    assert f"belongs to missing user {user_id}" in caplog.text
+    # No second user took over the account
+    assert all_users() == []
+
+
+def test_legacy_user_is_linked_once(spotify):
+    db.users_table.put_item(
+        Item={
+            "userId": "legacy-user",
+            "email": "someone@example.com",
+            "displayName": "Legacy",
+            "spotifyId": "fake-spotify-user",
+        }
+    )
+
+    assert login()["user"]["userId"] == "legacy-user"
+
+    assert db.get_identities(("spotify", "fake-spotify-user")) == {
+        ("spotify", "fake-spotify-user"): "legacy-user"
+    }
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        assert login()["user"]["userId"] == "legacy-user"
+    finally:
+        counter.close()
+    assert counter.calls["Scan"] == 0
+
+
+def test_user_with_matching_email_gets_spotify_linked(spotify):
+    user = db.create_user("fake@example.com", "Email User", None, True)
+    db.identities_table.put_item(
+        Item={"identityId": db.identity_id("email", "fake@example.com"), "userId": user["userId"]}
+    )
+
+    body = login()
+
+    assert body["user"]["userId"] == user["userId"]
+    assert db.get_user(user["userId"])["spotifyId"] == "fake-spotify-user"
+    assert len(all_users()) == 1
+
+
+def test_concurrent_signup_loses_cleanly(spotify):
+    first = db.create_spotify_user(
+        "fake@example.com", "Fake", "fake-spotify-user", True, {"access_token": "a"}, None
+    )
+    second = db.create_spotify_user(
+        "fake@example.com", "Fake", "fake-spotify-user", True, {"access_token": "b"}, None
+    )
+
+    assert first and second is None
+    assert len(all_users()) == 1
+
+
+def test_secrets_are_fetched_in_one_call(spotify):
+    counter = CallCounter(config._get_ssm_client())
+    try:
+        login()
+        login()
+    finally:
+        counter.close()
+
+    assert dict(counter.calls) == {"GetParameters": 1}
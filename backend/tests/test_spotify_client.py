@@ -0,0 +1,167 @@
+"""
+Tests for the pooled Spotify HTTP client
+"""
+
+import pytest
+import requests
+
+from benchmarks.harness import CallCounter
+from shared import db, spotify_client
+from shared.spotify_client import DynamoDBTokenBucket, LocalTokenBucket
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_response(status, body=b"{}", headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    response.url = "https://api.spotify.com/v1/me"
+    return response
+
+
+@pytest.fixture(autouse=True)
+def client(mocker):
+    clock = FakeClock()
+    spotify_client.set_rate_limiter(LocalTokenBucket(100, 100, clock=clock, sleep=clock.sleep))
+    spotify_client.stats.reset()
+    mocker.patch.object(spotify_client.time, "sleep")
+    session = mocker.Mock()
+    mocker.patch.object(spotify_client, "get_session", return_value=session)
+    return session
+
+
+def test_local_token_bucket_waits_for_refill():
+    clock = FakeClock()
+    bucket = LocalTokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.now == pytest.approx(0.5)
+
+
+def shared_bucket(clock):
+    return DynamoDBTokenBucket(
+        "spotify-test",
+        rate=10,
+        capacity=20,
+        lease_size=5,
+        clock=clock,
+        sleep=clock.sleep,
+    )
+
+
+def test_shared_bucket_claims_leases_in_one_write(aws):
+    clock = FakeClock(1_700_000_000.0)
+    bucket = shared_bucket(clock)
+    counter = CallCounter(db.dynamodb.meta.client)
+    try:
+        waits = [bucket.acquire() for _ in range(10)]
+    finally:
+        counter.close()
+
+    assert waits == [0] * 10
+    assert dict(counter.calls) == {"UpdateItem": 2}
+    item = db.rate_limits_table.get_item(Key={"bucketId": "spotify-test"})["Item"]
+    assert float(item["refilledAt"]) == pytest.approx(clock.now + 1.0)
+
+
+def test_shared_bucket_is_split_between_containers_and_refills(aws):
+    clock = FakeClock(1_700_000_000.0)
+    first, second = shared_bucket(clock), shared_bucket(clock)
+
+    # The whole burst, claimed alternately by two containers
+    assert [bucket.acquire() for _ in range(10) for bucket in (first, second)] == [0] * 20
+
+    # Empty: each container learns so from a refused claim and waits for
+    # one token's refill, then claims just that token
+    assert first.acquire() == pytest.approx(0.1)
+    assert second.acquire() == pytest.approx(0.1)
+    assert clock.now == pytest.approx(1_700_000_000.2)
+    item = db.rate_limits_table.get_item(Key={"bucketId": "spotify-test"})["Item"]
+    # Never overdrawn: exactly empty again
+    assert float(item["refilledAt"]) == pytest.approx(clock.now + 2.0)
+
+    clock.now += 10
+    assert first.acquire() == 0
+    assert first._reserve == 4
+
+
+def test_shared_bucket_falls_back_to_local_bucket(aws, mocker):
+    clock = FakeClock(1_700_000_000.0)
+    bucket = shared_bucket(clock)
+    mocker.patch.object(
+        spotify_client, "take_request_token", side_effect=RuntimeError("table unreachable")
+    )
+
+    assert bucket.acquire() == 0
+    assert bucket.fallback.try_acquire(20) > 0
+
+
+def test_retries_server_errors_then_succeeds(client):
+    client.request.side_effect = [make_response(503), make_response(200)]
+
+    response = spotify_client.request("GET", "https://x/me", endpoint="me")
+
+    assert response.status_code == 200
+    stats = spotify_client.stats.snapshot()["me"]
+    assert stats["calls"] == 2
+    assert stats["retries"] == 1
+    assert stats["errors"] == 1
+
+
+def test_honours_retry_after_on_429(client):
+    client.request.side_effect = [
+        make_response(429, headers={"Retry-After": "3"}),
+        make_response(200),
+    ]
+
+    spotify_client.request("GET", "https://x/me", endpoint="me")
+
+    spotify_client.time.sleep.assert_called_once_with(3.0)
+    assert spotify_client.stats.snapshot()["me"]["throttled"] == 1
+
+
+def test_gives_up_after_max_retries(client):
+    client.request.return_value = make_response(500)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        spotify_client.request("GET", "https://x/me", endpoint="me")
+
+    assert client.request.call_count == spotify_client.SPOTIFY_MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried(client):
+    client.request.return_value = make_response(401)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        spotify_client.request("GET", "https://x/me", endpoint="me")
+
+    assert client.request.call_count == 1
+
+
+def test_authorization_code_exchange_is_never_resent(client):
+    client.request.side_effect = [make_response(503)]
+    with pytest.raises(requests.exceptions.HTTPError):
+        spotify_client.request("POST", "https://x/token", endpoint="token", idempotent=False)
+
+    client.request.side_effect = [requests.exceptions.ReadTimeout("slow")]
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        spotify_client.request("POST", "https://x/token", endpoint="token", idempotent=False)
+    assert client.request.call_count == 2
+
+    # Throttled requests were not processed, so they are still retried
+    client.request.side_effect = [make_response(429), make_response(200)]
+    response = spotify_client.request("POST", "https://x/token", endpoint="token", idempotent=False)
+    assert response.status_code == 200
@@ -0,0 +1,41 @@
+"""
+Smoke test for the sync benchmark and its Spotify stand-in
+"""
+
+import argparse
+
+from benchmarks import bench_sync
+
+
+def bench_args(**overrides):
+    defaults = dict(
+        latency_ms=0,
+        throttle_every=4,
+        error_rate=0.1,
+        rate_limit=1_000_000,
+        pages=3,
+        page_size=50,
+    )
+    return argparse.Namespace(**{**defaults, **overrides})
+
+
+def test_sync_survives_throttling_and_errors():
+    result = bench_sync.run_size(230, bench_args())
+
+    assert result["tracks"] == 230
+    assert result["throttled"] > 0
+    # 5 pages of tracks, 3 audio features batches, plus one retry per 429 / 500
+    assert result["httpCalls"] == 8 + result["throttled"] + result["serverErrors"]
+    # 230 tracks in batches of 25, for the library, the change log and the
+    # shared audio features
+    assert result["dbCallsByOperation"]["BatchWriteItem"] == 30
+    assert result["pages"] == 3
+
+
+def test_compare_flags_regressions():
+    baseline = bench_sync.run_size(100, bench_args(throttle_every=0, error_rate=0))
+    slower = dict(baseline, syncSeconds=baseline["syncSeconds"] + 10, dbCalls=baseline["dbCalls"] + 1)
+
+    regressions = bench_sync.compare({"100": slower}, {"results": {"100": baseline}})
+
+    assert len(regressions) == 2
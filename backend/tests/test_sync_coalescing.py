@@ -0,0 +1,124 @@
+"""
+Tests for per-user coalescing of library syncs
+"""
+
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from benchmarks.bench_sync import configure_spotify, seed_connection
+from benchmarks.fake_spotify import FakeSpotify, generate_library
+from benchmarks.harness import make_event
+from service.spotify.fetch_library import lambda_handler as fetch_library_handler
+from shared import db, library_sync
+from shared.library_sync import SyncError, sync_spotify_library
+from shared.providers import SpotifyProvider
+
+USER_ID = "coalesce-user"
+
+
+@pytest.fixture
+def spotify(aws, mocker):
+    mocker.patch.object(library_sync, "SYNC_POLL_INTERVAL", 0.01)
+    with FakeSpotify(generate_library(60, seed=1), latency_ms=50) as fake:
+        configure_spotify(fake, 1_000_000)
+        seed_connection(USER_ID)
+        yield fake
+
+
+def test_repeated_sync_returns_recent_result(spotify):
+    first = sync_spotify_library(USER_ID, user_initiated=True)
+    requests = sum(spotify.requests.values())
+
+    second = sync_spotify_library(USER_ID, user_initiated=True)
+
+    assert second == dict(first, coalesced=True)
+    assert sum(spotify.requests.values()) == requests
+
+
+def test_concurrent_syncs_crawl_once(spotify):
+    results = []
+
+    def sync():
+        event = make_event(
+            "POST", "/library/sync/spotify", user_id=USER_ID, path_params={"platform": "spotify"}
+        )
+        response = fetch_library_handler(event, None)
+        results.append((response["statusCode"], json.loads(response["body"])))
+
+    threads = [threading.Thread(target=sync) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [status for status, _ in results] == [200] * 4
+    assert [body["synced"] for _, body in results] == [60] * 4
+    assert sum(bool(body.get("coalesced")) for _, body in results) == 3
+    # One crawl of 60 tracks, 50 per page
+    assert spotify.requests["/v1/me/tracks"] == 2
+
+
+def test_scheduled_sync_does_not_wait_for_held_lease(spotify):
+    assert db.acquire_sync_lease(USER_ID, "spotify", "other", 120, 0)
+
+    start = time.monotonic()
+    summary = sync_spotify_library(USER_ID)
+
+    assert summary["inProgress"] is True
+    assert time.monotonic() - start < 1
+    assert not spotify.requests
+
+
+def test_user_sync_gives_up_with_202(spotify, mocker):
+    mocker.patch.object(library_sync, "SYNC_WAIT_SECONDS", 0.05)
+    assert db.acquire_sync_lease(USER_ID, "spotify", "other", 120, 0)
+
+    event = make_event(
+        "POST", "/library/sync/spotify", user_id=USER_ID, path_params={"platform": "spotify"}
+    )
+    response = fetch_library_handler(event, None)
+
+    assert response["statusCode"] == 202
+    assert json.loads(response["body"])["inProgress"] is True
+
+
+def test_failed_sync_releases_lease(spotify, mocker):
+    mocker.patch.object(
+        SpotifyProvider, "fetch_page", side_effect=requests.exceptions.ConnectionError("down")
+    )
+    with pytest.raises(SyncError):
+        sync_spotify_library(USER_ID)
+
+    connection = db.get_platform_connection(USER_ID, "spotify", consistent=True)
+    assert "syncLeaseOwner" not in connection
+    mocker.stopall()
+    assert sync_spotify_library(USER_ID)["synced"] == 60
+
+
+def test_partly_failed_sync_is_retried_right_away(spotify, mocker):
+    put_items = db.library_writer.put_items
+
+    def lose_one(items):
+        stats = put_items(items[1:])
+        stats["failed"] += 1
+        return stats
+
+    mocker.patch.object(db.library_writer, "put_items", side_effect=lose_one)
+    first = sync_spotify_library(USER_ID, user_initiated=True)
+
+    assert first["partial"] is True
+    assert (first["synced"], first["failed"]) == (59, 1)
+    connection = db.get_platform_connection(USER_ID, "spotify", cached=False)
+    assert "lastSyncedEpoch" not in connection and "lastSyncedAt" not in connection
+    assert connection["lastSyncResult"]["partial"] is True
+
+    mocker.stopall()
+    second = sync_spotify_library(USER_ID, user_initiated=True)
+
+    assert "coalesced" not in second and "partial" not in second
+    assert (second["synced"], second["changed"]) == (60, 1)
+    assert "lastSyncedEpoch" in db.get_platform_connection(USER_ID, "spotify", cached=False)
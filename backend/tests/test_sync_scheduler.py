@@ -0,0 +1,77 @@
+"""
+Tests for the scheduled sync orchestrator
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.bench_sync import configure_spotify, seed_connection
+from benchmarks.fake_spotify import FakeSpotify, generate_library
+from shared import db, queues, sync_scheduler
+from shared.queues import LocalQueue
+
+NOW = datetime(2026, 1, 10, tzinfo=timezone.utc)
+
+
+def ago(**delta):
+    return (NOW - timedelta(**delta)).isoformat()
+
+
+@pytest.fixture(autouse=True)
+def local_queues():
+    queues._local_queues.clear()
+    yield
+    queues._local_queues.clear()
+
+
+def add_connection(user_id, **attributes):
+    seed_connection(user_id)
+    for name, value in attributes.items():
+        db.connections_table.update_item(
+            Key={"userId": user_id, "platform": "spotify"},
+            UpdateExpression="SET #a = :v",
+            ExpressionAttributeNames={"#a": name},
+            ExpressionAttributeValues={":v": value},
+        )
+
+
+def test_segment_ranks_by_staleness_and_activity_within_budget(aws):
+    add_connection("fresh", lastSyncedAt=ago(hours=1), lastSyncCount=100)
+    add_connection("stale", lastSyncedAt=ago(days=2), lastSyncCount=100)
+    add_connection("stale-active", lastSyncedAt=ago(days=1), lastActiveAt=ago(days=1), lastSyncCount=100)
+    add_connection("never")
+    add_connection("huge", lastSyncedAt=ago(days=3), lastSyncCount=10_000)
+    queue = LocalQueue()
+
+    result = sync_scheduler.schedule_segment(0, 1, call_budget=30, sync_queue=queue, now=NOW)
+
+    # never (20 calls) and stale-active (3) fit, huge (201) does not, stale (3) still fits
+    assert [job["userId"] for job in queue.drain()] == ["never", "stale-active", "stale"]
+    assert result == {"scanned": 5, "candidates": 4, "enqueued": 3, "plannedCalls": 26}
+
+
+def test_coordinator_only_enqueues_segments(aws, mocker):
+    mocker.patch.object(sync_scheduler, "SYNC_ITEMS_PER_SEGMENT", 2)
+    for i in range(5):
+        add_connection(f"user-{i}")
+    queue = LocalQueue()
+
+    result = sync_scheduler.start_scheduled_run(queue, NOW)
+
+    assert result["segments"] == 3
+    assert [m["segment"] for m in queue.drain()] == [0, 1, 2]
+
+
+def test_local_run_syncs_stale_users(aws):
+    with FakeSpotify(generate_library(60)) as spotify:
+        configure_spotify(spotify, rate_limit=1_000_000)
+        for i in range(3):
+            add_connection(f"user-{i}", lastSyncedAt=ago(days=1))
+
+        result = sync_scheduler.run_locally(now=NOW)
+
+    assert result["jobs"] == result["completed"] == 3
+    connection = db.get_platform_connection("user-0", "spotify")
+    assert connection["lastSyncCount"] == 60
+    assert "lastActiveAt" not in connection
@@ -0,0 +1,126 @@
+"""
+Tests for single-flight access token refresh
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+from shared import db, token_manager
+from shared.providers import get_provider
+
+
+def iso_in(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+@pytest.fixture
+def connection(aws):
+    token_manager._token_cache.clear()
+    db.save_platform_connection(
+        "user-1",
+        "spotify",
+        {"access_token": "old-access", "refresh_token": "refresh-1", "expires_at": iso_in(-60)},
+        None,
+    )
+
+
+@pytest.fixture
+def refresher(mocker):
+    calls = []
+
+    def refresh(refresh_token):
+        calls.append(refresh_token)
+        return {
+            "access_token": f"access-{len(calls)}",
+            "refresh_token": f"refresh-{len(calls) + 1}",
+            "expires_at": iso_in(3600),
+        }, None
+
+    mocker.patch.object(get_provider("spotify"), "refresh_tokens", side_effect=refresh)
+    return calls
+
+
+def test_valid_token_is_served_from_cache(connection, refresher, mocker):
+    db.update_platform_tokens(
+        "user-1", "spotify", {"access_token": "fresh", "expires_at": iso_in(3600)}
+    )
+    get_connection = mocker.spy(token_manager, "get_platform_connection")
+
+    assert token_manager.get_access_token("user-1", "spotify") == ("fresh", None)
+    assert token_manager.get_access_token("user-1", "spotify") == ("fresh", None)
+    assert get_connection.call_count == 1
+    assert refresher == []
+
+
+def test_expired_token_is_refreshed_and_rotation_stored(connection, refresher):
+    token, error = token_manager.get_access_token("user-1", "spotify")
+
+    assert (token, error) == ("access-1", None)
+    stored = db.get_platform_connection("user-1", "spotify")
+    assert stored["refreshToken"] == "refresh-2"
+    assert "refreshLeaseOwner" not in stored
+
+
+def test_concurrent_callers_refresh_once(connection, refresher):
+    results = []
+
+    def call():
+        results.append(token_manager.get_access_token("user-1", "spotify"))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert refresher == ["refresh-1"]
+    assert results == [("access-1", None)] * 8
+
+
+def test_caller_waits_for_lease_holder(connection, refresher, mocker):
+    # Another container holds the lease and finishes while we poll
+    assert db.acquire_token_refresh_lease("user-1", "spotify", "other", "refresh-1", 60)
+
+    def finish_other_refresh(_seconds):
+        db.update_platform_tokens(
+            "user-1",
+            "spotify",
+            {"access_token": "theirs", "refresh_token": "refresh-9", "expires_at": iso_in(3600)},
+            previous_refresh_token="refresh-1",
+        )
+
+    mocker.patch.object(token_manager.time, "sleep", side_effect=finish_other_refresh)
+
+    assert token_manager.get_access_token("user-1", "spotify") == ("theirs", None)
+    assert refresher == []
+
+
+def test_failed_refresh_releases_the_lease(connection, mocker):
+    mocker.patch.object(
+        get_provider("spotify"), "refresh_tokens", return_value=({}, "Spotify is down")
+    )
+
+    assert token_manager.get_access_token("user-1", "spotify") == (None, "Spotify is down")
+
+    stored = db.get_platform_connection("user-1", "spotify", cached=False)
+    assert "refreshLeaseOwner" not in stored
+    # The next caller may take the lease at once rather than time out waiting
+    assert db.acquire_token_refresh_lease("user-1", "spotify", "next", "refresh-1", 60)
+    assert token_manager._key_locks == {}
+
+
+def test_rejected_token_is_dropped_from_the_cache(connection, refresher):
+    assert token_manager.get_access_token("user-1", "spotify") == ("access-1", None)
+    response = requests.Response()
+    response.status_code = 401
+
+    rejected = token_manager.invalidate_if_rejected(
+        "user-1", "spotify", requests.exceptions.HTTPError(response=response)
+    )
+
+    assert rejected
+    assert ("user-1", "spotify") not in token_manager._token_cache
+    assert not token_manager.invalidate_if_rejected("user-1", "spotify", RuntimeError("boom"))
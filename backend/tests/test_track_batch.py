@@ -0,0 +1,85 @@
+"""
+Tests for page-level parsing into column-oriented track batches
+"""
+
+from benchmarks.fake_spotify import generate_library
+from shared.cover_art import add_cover_art_url
+from shared.spotify_utils import parse_track, parse_tracks_page
+from shared.track_batch import LIBRARY_COLUMNS, TrackBatch, content_hash
+
+
+def per_track(items):
+    tracks = []
+    for item in items:
+        track = dict(item["track"], added_at=item["added_at"])
+        tracks.append(parse_track(track))
+    return tracks
+
+
+def test_page_parser_matches_per_track_parser():
+    items = generate_library(120)
+
+    batch = TrackBatch()
+    for start in range(0, len(items), 50):
+        parse_tracks_page(items[start : start + 50], batch)
+
+    assert list(batch.iter_tracks()) == per_track(items)
+    assert batch.malformed == 0
+
+
+def test_malformed_and_missing_tracks():
+    items = generate_library(3)
+    items.append({"added_at": "2020-01-01T00:00:00Z", "track": {"name": "no id"}})
+    items.append({"added_at": "2020-01-01T00:00:00Z", "track": None})
+
+    batch = parse_tracks_page(items)
+
+    assert len(batch) == 3
+    assert batch.malformed == 1
+
+
+def test_repeated_strings_are_shared():
+    items = generate_library(200)
+
+    batch = parse_tracks_page(items)
+
+    names = {}
+    for name in batch.columns["albumName"]:
+        assert names.setdefault(name, name) is name
+
+
+def test_items_skip_deleted_tracks():
+    batch = parse_tracks_page(generate_library(3))
+    deleted = {batch.track_ids()[1]}
+
+    items = batch.to_items("user-1", skip_track_ids=deleted)
+
+    assert [item["trackId"] for item in items] == [
+        track_id for track_id in batch.track_ids() if track_id not in deleted
+    ]
+    assert all(item["userId"] == "user-1" for item in items)
+
+
+def test_manual_tracks_keep_their_cover_url():
+    manual = {
+        "trackId": "manual:1",
+        "trackName": "Demo",
+        "artistName": "Band",
+        "albumName": "Tape",
+        "platform": "manual",
+        "isManual": True,
+        "coverArtUrl": "https://example.com/tape.jpg",
+    }
+    parsed = parse_tracks_page(generate_library(1))
+    batch = TrackBatch.from_tracks([manual, *parsed.iter_tracks()])
+
+    manual_item, spotify_item = batch.to_items("user-1")
+
+    assert manual_item["coverArtUrl"] == "https://example.com/tape.jpg"
+    assert add_cover_art_url(dict(manual_item))["coverArtUrl"] == manual["coverArtUrl"]
+    # Tracks without one store no coverArtUrl and keep their earlier hash
+    assert "coverArtUrl" not in spotify_item
+    assert spotify_item["contentHash"] == parsed.to_items("user-1")[0]["contentHash"]
+    assert spotify_item["contentHash"] == content_hash(
+        tuple(spotify_item[name] for name in LIBRARY_COLUMNS if name != "coverArtUrl")
+    )
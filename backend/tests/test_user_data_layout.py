@@ -0,0 +1,163 @@
+"""
+Tests for the single-table user data layout, its dual writes and backfill
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.bench_sync import configure_spotify
+from benchmarks.fake_spotify import FakeSpotify, generate_library
+from benchmarks.harness import CallCounter, make_event
+from service.batch import lambda_handler as batch_handler
+from shared import db, token_manager
+from shared.library_sync import sync_spotify_library
+from shared.user_data_backfill import backfill_user_data, user_data_item
+
+TOKENS = {
+    "access_token": "fake-access-token",
+    "refresh_token": "fake-refresh-token",
+    "expires_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat(),
+}
+
+
+def create_user(name):
+    user = db.create_spotify_user(
+        f"{name}@example.com", name, f"spotify-{name}", True, TOKENS, {"id": f"spotify-{name}"}
+    )
+    return user["userId"]
+
+
+def legacy_items(user_id):
+    user = db.users_table.get_item(Key={"userId": user_id})["Item"]
+    connections = db.connections_table.query(
+        KeyConditionExpression="userId = :userId",
+        ExpressionAttributeValues={":userId": user_id},
+    )["Items"]
+    return [user_data_item(db.connections_table, c) for c in connections] + [
+        user_data_item(db.users_table, user)
+    ]
+
+
+def user_data_items(user_id):
+    return db.user_data_table.query(
+        KeyConditionExpression="userId = :userId",
+        ExpressionAttributeValues={":userId": user_id},
+    )["Items"]
+
+
+@pytest.fixture
+def layout(aws, monkeypatch):
+    token_manager._token_cache.clear()
+
+    def use(name):
+        monkeypatch.setattr(db, "USER_DATA_LAYOUT", name)
+        db.clear_read_caches()
+
+    return use
+
+
+def test_writes_are_copied_and_single_layout_reads_one_partition(layout):
+    layout("dual")
+    with FakeSpotify(generate_library(30, seed=1)) as spotify:
+        configure_spotify(spotify, 1_000_000)
+        user_id = create_user("dual")
+        db.save_platform_connection(user_id, "deezer", TOKENS, None)
+        assert db.link_spotify_user(user_id, "spotify-dual", None, TOKENS, None)
+        assert sync_spotify_library(user_id)["synced"] == 30
+
+        # Profile with change log seq, snapshot and sketch, and both connections
+        assert user_data_items(user_id) == legacy_items(user_id)
+        assert user_data_items(user_id)[-1]["librarySeq"] == 30
+
+        layout("single")
+        counter = CallCounter(db.dynamodb.meta.client)
+        try:
+            user, connections = db.get_user_and_connections(user_id)
+            assert dict(counter.calls) == {"Query": 1}
+        finally:
+            counter.close()
+        assert user == db.users_table.get_item(Key={"userId": user_id})["Item"]
+        assert [c["platform"] for c in connections] == ["deezer", "spotify"]
+        assert connections[1]["lastSyncCount"] == 30
+
+        # Writes now land in the single table first and are copied back
+        db.clear_library_sketch(user_id)
+        assert sync_spotify_library(user_id)["synced"] == 30
+        assert user_data_items(user_id) == legacy_items(user_id)
+        assert db.get_library_seq(user_id)[0] == 30
+
+
+def test_batch_reads_follow_the_layout(layout):
+    layout("dual")
+    user_id = create_user("batch")
+    db.record_sync_result(user_id, "spotify", {"synced": 5, "message": "Synced"})
+    # Stale copy of the old tables: reads must come from the single table
+    db.users_table.delete_item(Key={"userId": user_id})
+    layout("single")
+
+    response = batch_handler(
+        make_event(
+            "POST",
+            "/batch",
+            user_id=user_id,
+            body={"operations": [{"op": "library.stats"}, {"op": "sync.status"}]},
+        ),
+        None,
+    )
+
+    stats, status = json.loads(response["body"])["results"]
+    assert stats["status"] == 200
+    assert status["body"]["connected"] is True
+    assert status["body"]["lastSyncResult"]["synced"] == 5
+
+
+def test_copies_landing_out_of_order_keep_the_newest_write(layout):
+    layout("dual")
+    user_id = create_user("race")
+    rows = db._connection_rows(user_id, "spotify")
+    db.update_platform_tokens(user_id, "spotify", {"access_token": "a1", "expires_at": "x"})
+    earlier = db.connections_table.get_item(Key=rows[0][1])["Item"]
+    db.update_platform_tokens(
+        user_id, "spotify", {"access_token": "a2", "refresh_token": "rotated", "expires_at": "x"}
+    )
+
+    # The earlier write's copy arrives last
+    db._mirror(earlier, rows[1:])
+
+    copy = db.user_data_table.get_item(Key=rows[1][1])["Item"]
+    assert (copy["accessToken"], copy["refreshToken"]) == ("a2", "rotated")
+    assert user_data_items(user_id) == legacy_items(user_id)
+    # The backfill cannot put it back either
+    assert not db.put_if_newer(db.user_data_table, user_data_item(db.connections_table, earlier))
+
+
+def test_backfill_copies_missing_items_and_repairs_differences(layout):
+    layout("tables")
+    user_ids = [create_user(f"backfill{i}") for i in range(3)]
+    assert user_data_items(user_ids[0]) == []
+
+    layout("dual")
+    summary = backfill_user_data(total_segments=2)
+    assert summary[db.users_table.name]["missing"] == 3
+    assert summary[db.connections_table.name]["written"] == 3
+    for user_id in user_ids:
+        assert user_data_items(user_id) == legacy_items(user_id)
+
+    # A write whose copy failed
+    db.users_table.update_item(
+        Key={"userId": user_ids[1]},
+        UpdateExpression="SET displayName = :name ADD rowVersion :one",
+        ExpressionAttributeValues={":name": "Renamed", ":one": 1},
+    )
+    assert backfill_user_data()[db.users_table.name]["written"] == 0
+    dry_run = backfill_user_data(dry_run=True, total_segments=2)
+    assert dry_run[db.users_table.name]["different"] == 1
+    assert backfill_user_data(overwrite=True)[db.users_table.name]["written"] == 1
+    assert user_data_items(user_ids[1]) == legacy_items(user_ids[1])
+    assert backfill_user_data(dry_run=True)[db.users_table.name]["different"] == 0
+
+    layout("single")
+    with pytest.raises(ValueError):
+        backfill_user_data(overwrite=True)
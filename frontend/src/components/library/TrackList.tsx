@@ -1,17 +1,40 @@
-import { useCallback, useEffect, useState } from 'react';
+import { useCallback, useEffect, useRef, useState } from 'react';
 import api from '../../services/api';
-import type { Track } from '../../types';
+import type { LibraryChangesResponse, Track } from '../../types';
 import { TrackItem } from './TrackItem';
 
+const PAGE_SIZE = 50;
+
+// Same order as the snapshot and the paged API (track ID descending)
+const byTrackIdDesc = (a: Track, b: Track) =>
+  a.trackId < b.trackId ? 1 : a.trackId > b.trackId ? -1 : 0;
+
+const applyChanges = (tracks: Track[], changes: LibraryChangesResponse<Track>): Track[] => {
+  const replaced = new Set([
+    ...changes.deleted,
+    ...changes.inserted.map((t) => t.trackId),
+    ...changes.updated.map((t) => t.trackId),
+  ]);
+  return [
+    ...tracks.filter((t) => !replaced.has(t.trackId)),
+    ...changes.inserted,
+    ...changes.updated,
+  ].sort(byTrackIdDesc);
+};
+
 interface TrackListProps {
   refreshKey: number;
 }
 
 export const TrackList: React.FC<TrackListProps> = ({ refreshKey }) => {
   const [tracks, setTracks] = useState<Track[]>([]);
+  // Tracks rendered so far, the snapshot holds the whole library at once
+  const [visibleCount, setVisibleCount] = useState(PAGE_SIZE);
   const [lastKey, setLastKey] = useState<Record<string, string> | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  // Change feed position of the loaded snapshot, null when paging instead
+  const cursor = useRef<string | null>(null);
 
   const handleDelete = useCallback(async (trackId: string) => {
     await api.library.deleteTrack(trackId);
@@ -23,12 +46,13 @@ export const TrackList: React.FC<TrackListProps> = ({ refreshKey }) => {
     setError(null);
 
     try {
-      const params: { limit: number; lastKey?: string } = { limit: 50 };
+      const params: { limit: number; lastKey?: string } = { limit: PAGE_SIZE };
       if (cursor) {
         params.lastKey = JSON.stringify(cursor);
       }
       const result = await api.library.getLibrary(params);
       setTracks((prev) => (cursor ? [...prev, ...result.items] : result.items));
+      setVisibleCount((prev) => (cursor ? prev + result.items.length : result.items.length));
       setLastKey(result.lastKey);
     } catch (err: unknown) {
       const message = err instanceof Error ? err.message : 'Failed to load library';
@@ -38,17 +62,65 @@ export const TrackList: React.FC<TrackListProps> = ({ refreshKey }) => {
     }
   }, []);
 
-  useEffect(() => {
+  const fetchSnapshot = useCallback(async () => {
+    setLoading(true);
+    setError(null);
+
+    try {
+      const snapshot = await api.library.getLibrarySnapshot();
+      cursor.current = snapshot.cursor;
+      setTracks(snapshot.items);
+      setVisibleCount(PAGE_SIZE);
+      setLoading(false);
+    } catch {
+      // Fall back to paging through the API
+      cursor.current = null;
+      await fetchTracks();
+    }
+  }, [fetchTracks]);
+
+  const reload = useCallback(() => {
     setTracks([]);
     setLastKey(null);
-    fetchTracks();
-  }, [fetchTracks, refreshKey]);
+    fetchSnapshot();
+  }, [fetchSnapshot]);
+
+  // Apply what changed since the snapshot instead of downloading it again
+  const fetchChanges = useCallback(
+    async (since: string) => {
+      try {
+        let changes: LibraryChangesResponse<Track>;
+        do {
+          changes = await api.library.getLibraryChanges(since);
+          const page = changes;
+          setTracks((prev) => applyChanges(prev, page));
+          since = changes.cursor;
+        } while (changes.hasMore);
+        cursor.current = since;
+      } catch {
+        // Expired cursor (410) or any other failure: start over
+        reload();
+      }
+    },
+    [reload]
+  );
+
+  useEffect(() => {
+    if (cursor.current) {
+      fetchChanges(cursor.current);
+    } else {
+      reload();
+    }
+  }, [fetchChanges, reload, refreshKey]);
+
+  const hasMore = lastKey !== null || visibleCount < tracks.length;
 
   return (
     <div className="bg-white rounded-lg shadow">
       <div className="p-4 border-b border-gray-100">
         <h3 className="text-lg font-semibold text-gray-900">
-          Your Tracks{tracks.length > 0 && ` (showing ${tracks.length})`}
+          Your Tracks
+          {tracks.length > 0 && ` (showing ${Math.min(visibleCount, tracks.length)})`}
         </h3>
       </div>
 
@@ -68,16 +140,20 @@ export const TrackList: React.FC<TrackListProps> = ({ refreshKey }) => {
 
       {tracks.length > 0 && (
         <ul className="divide-y divide-gray-100">
-          {tracks.map((track) => (
+          {tracks.slice(0, visibleCount).map((track) => (
             <TrackItem key={track.trackId} track={track} onDelete={handleDelete} />
           ))}
         </ul>
       )}
 
-      {lastKey && (
+      {hasMore && (
         <div className="p-4 border-t border-gray-100 text-center">
           <button
-            onClick={() => fetchTracks(lastKey)}
+            onClick={() =>
+              visibleCount < tracks.length
+                ? setVisibleCount((prev) => prev + PAGE_SIZE)
+                : fetchTracks(lastKey)
+            }
             disabled={loading}
             className="text-slate-600 hover:text-slate-800 font-medium text-sm disabled:text-gray-400"
             type="button"
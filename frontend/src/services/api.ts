@@ -6,6 +6,9 @@ import type {
   PlatformConnection,
   ApiError,
   PaginatedResponse,
+  LibrarySnapshot,
+  LibrarySnapshotResponse,
+  LibraryChangesResponse,
   SpotifyAuthUrlResponse,
   AuthCallbackResponse,
   LibraryQueryParams,
@@ -80,6 +83,22 @@ class ApiService {
       return response.data;
     },
 
+    // Whole library in one static download instead of paging through /library
+    getLibrarySnapshot: async (): Promise<LibrarySnapshot<Track>> => {
+      const response = await this.client.get<LibrarySnapshotResponse>('/library/snapshot');
+      // Plain axios: the presigned URL must not carry our Authorization header
+      const snapshot = await axios.get<LibrarySnapshot<Track>>(response.data.url);
+      return snapshot.data;
+    },
+
+    // Answers 410 when the cursor expired and the snapshot must be reloaded
+    getLibraryChanges: async (since: string): Promise<LibraryChangesResponse<Track>> => {
+      const response = await this.client.get<LibraryChangesResponse<Track>>('/library/changes', {
+        params: { since },
+      });
+      return response.data;
+    },
+
     addManualTrack: async (
       track: Omit<Track, 'trackId' | 'platform' | 'addedDate' | 'isManual'>
     ): Promise<Track> => {
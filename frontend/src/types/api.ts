@@ -16,6 +16,31 @@ export interface PaginatedResponse<T> {
   lastKey: Record<string, string> | null;
 }
 
+export interface LibrarySnapshotResponse {
+  url: string;
+  version: number;
+  count: number;
+  generatedAt: string;
+  cursor: string;
+  expiresIn: number | null;
+}
+
+export interface LibrarySnapshot<T> {
+  version: number;
+  generatedAt: string;
+  cursor: string;
+  count: number;
+  items: T[];
+}
+
+export interface LibraryChangesResponse<T> {
+  inserted: T[];
+  updated: T[];
+  deleted: string[];
+  cursor: string;
+  hasMore: boolean;
+}
+
 export interface SpotifyAuthUrlResponse {
   authUrl: string;
 }